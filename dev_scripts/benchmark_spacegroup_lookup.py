@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+'''
+Developer script to rebuild the packed space group database from the text
+files in pymatgen/symmetry/sg_data and to benchmark the cost of space group
+lookups against parsing the text files.
+'''
+
+from __future__ import division
+
+import os
+import glob
+import sys
+from timeit import Timer
+
+from pymatgen.symmetry.spacegroup import Spacegroup, SpacegroupDatabase, \
+    SG_DATA_DIR, parse_sg_data_file
+
+
+def lookup_text():
+    for sgnum in xrange(1, 231):
+        filename = str(sgnum).zfill(3) + "*"
+        files = sorted(glob.glob(os.path.join(SG_DATA_DIR, filename)))
+        parse_sg_data_file(files[0])
+
+
+def lookup_database():
+    for sgnum in xrange(1, 231):
+        Spacegroup.from_spacegroup_number(sgnum)
+
+
+def lookup_operations():
+    from pymatgen.symmetry.spacegroup import get_spacegroup_database
+    db = get_spacegroup_database()
+    for sgnum in xrange(1, 231):
+        db.get_operations(sgnum)
+
+
+if __name__ == "__main__":
+    if "--build" in sys.argv:
+        SpacegroupDatabase.write_database()
+    n = 10
+    for name in ["lookup_text", "lookup_database", "lookup_operations"]:
+        t = Timer(name + "()", "from __main__ import " + name)
+        print "{}: {:.3f} ms per space group".format(name, t.timeit(n) / n / 230 * 1000)
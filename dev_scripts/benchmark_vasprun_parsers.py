@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+'''
+Developer script to benchmark the sax and iterparse backends of Vasprun on
+large vasprun.xml files. Files of the requested sizes are generated from an
+existing vasprun.xml by repeating its last ionic step, which includes the
+eigenvalues and dos if present.
+
+Usage:
+    python benchmark_vasprun_parsers.py vasprun.xml [size_in_MB ...]
+
+The default sizes are 10, 100 and 1000 MB.
+'''
+
+from __future__ import division
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+from pymatgen.io.vaspio import Vasprun
+
+
+def make_vasprun(template, filename, size):
+    """
+    Writes a vasprun.xml of approximately size bytes by repeating the last
+    calculation element of template.
+    """
+    with open(template) as f:
+        data = f.read()
+    start = data.rindex("<calculation>")
+    end = data.rindex("</calculation>") + len("</calculation>")
+    calculation = data[start:end] + "\n"
+    with open(filename, "w") as f:
+        f.write(data[:start])
+        written = start + len(data) - end
+        while written < size:
+            f.write(calculation)
+            written += len(calculation)
+        f.write(data[end:])
+
+
+def timeit(func):
+    t = time.time()
+    func()
+    return time.time() - t
+
+
+if __name__ == "__main__":
+    template = sys.argv[1]
+    sizes = [float(s) for s in sys.argv[2:]] or [10, 100, 1000]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print "{:>10} {:>10} {:>10} {:>10}".format("Size (MB)", "sax (s)",
+                                                   "iterparse", "speedup")
+        for size in sizes:
+            filename = os.path.join(tmpdir, "vasprun.xml")
+            make_vasprun(template, filename, size * 1024 * 1024)
+            t_sax = timeit(lambda: Vasprun(filename, parser="sax"))
+            t_iter = timeit(lambda: Vasprun(filename, parser="iterparse"))
+            print "{:>10.0f} {:>10.2f} {:>10.2f} {:>10.1f}".format(
+                size, t_sax, t_iter, t_sax / t_iter)
+            os.remove(filename)
+    finally:
+        shutil.rmtree(tmpdir)
@@ -15,7 +15,17 @@ __date__ = "Mar 5, 2012"
 
 import unittest
 import os
-from pymatgen.alchemy.transmuters import CifTransmuter, PoscarTransmuter
+import gzip
+import json
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+from pymatgen.alchemy.transmuters import CifTransmuter, PoscarTransmuter, \
+    batch_write_vasp_input, bulk_write_vasp_input
+from pymatgen.io.vaspio import Potcar
+from pymatgen.io.vaspio_set import MITVaspInputSet
 from pymatgen.transformations.standard_transformations import SubstitutionTransformation, RemoveSpeciesTransformation, OrderDisorderedStructureTransformation, SuperTransformation
 
 import pymatgen
@@ -61,6 +71,88 @@ class PoscarTransmuterTest(unittest.TestCase):
         for x in tsc:
             self.assertEqual(len(x), 5, 'something might be wrong with the number of transformations in the history') #should be 4 trans + starting structure
 
+
+class BulkWriteVaspInputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.psp_dir = os.environ.get("VASP_PSP_DIR")
+        os.environ["VASP_PSP_DIR"] = self.tmpdir
+        os.mkdir(os.path.join(self.tmpdir, "POT_GGA_PAW_PBE"))
+        potcars = Potcar.from_file(os.path.join(test_dir, "POTCAR"))
+        potcars.extend(Potcar.from_file(os.path.join(test_dir,
+                                                     "POTCAR.Mn_pv")))
+        for (symbol, potcar) in zip(["Fe", "P", "O", "Mn"], potcars):
+            f = gzip.open(os.path.join(self.tmpdir, "POT_GGA_PAW_PBE",
+                                       "POTCAR." + symbol + ".gz"), "wb")
+            f.write(str(potcar))
+            f.close()
+        tsc = PoscarTransmuter.from_filenames([os.path.join(test_dir,
+                                                            "POSCAR")] * 3)
+        tsc[2].append_transformation(SubstitutionTransformation({"Fe": "Mn"}))
+        self.structures = tsc.get_transformed_structures()
+        self.input_set = MITVaspInputSet()
+        self.expected = os.path.join(self.tmpdir, "expected")
+        batch_write_vasp_input(self.structures, self.input_set, self.expected)
+
+    def tearDown(self):
+        if self.psp_dir is None:
+            del os.environ["VASP_PSP_DIR"]
+        else:
+            os.environ["VASP_PSP_DIR"] = self.psp_dir
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def normalize(files):
+        #The transformations.json differ in their last_modified time.
+        for (k, v) in files.items():
+            if k.endswith("transformations.json"):
+                d = json.loads(v)
+                del d["last_modified"]
+                files[k] = d
+        return files
+
+    def get_expected_files(self):
+        files = {}
+        for (parent, subdirs, filenames) in os.walk(self.expected):
+            for filename in filenames:
+                path = os.path.join(parent, filename)
+                with open(path) as f:
+                    files[os.path.relpath(path, self.tmpdir)] = f.read()
+        return self.normalize(files)
+
+    def test_write(self):
+        expected = self.get_expected_files()
+        self.assertEqual(len(expected), 15)
+        for nproc in [1, 2]:
+            output_dir = os.path.join(self.tmpdir, "expected")
+            shutil.rmtree(output_dir)
+            dirnames = bulk_write_vasp_input(self.structures, self.input_set,
+                                             output_dir, nproc=nproc)
+            self.assertEqual([os.path.basename(d) for d in dirnames],
+                             ["Fe4P4O16_1", "Fe4P4O16_2", "Mn4P4O16_1"])
+            self.assertEqual(self.get_expected_files(), expected)
+
+    def test_archive(self):
+        expected = self.get_expected_files()
+        output_dir = os.path.join(self.tmpdir, "expected")
+        bulk_write_vasp_input(self.structures, self.input_set, output_dir,
+                              nproc=2, archive_format="zip")
+        archive = zipfile.ZipFile(output_dir + ".zip")
+        self.assertEqual(self.normalize({n: archive.read(n)
+                                         for n in archive.namelist()}),
+                         expected)
+        archive.close()
+        bulk_write_vasp_input(self.structures, self.input_set, output_dir,
+                              archive_format="gztar")
+        archive = tarfile.open(output_dir + ".tar.gz")
+        self.assertEqual(self.normalize({m.name: archive.extractfile(m).read()
+                                         for m in archive.getmembers()}),
+                         expected)
+        archive.close()
+        self.assertRaises(ValueError, bulk_write_vasp_input, self.structures,
+                          self.input_set, output_dir, archive_format="rar")
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
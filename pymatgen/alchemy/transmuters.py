@@ -6,8 +6,9 @@ Transmuters are essentially classes that generate TransformedStructures from
 various data sources. They enable the high-throughput generation of new
 structures and input files.
 
-It also includes the helper function, batch_write_vasp_input to generate an 
-entire directory of vasp input files for running.
+It also includes the helper functions, batch_write_vasp_input and
+bulk_write_vasp_input to generate an entire directory of vasp input files for
+running.
 '''
 
 from __future__ import division
@@ -22,6 +23,12 @@ __date__ = "Mar 4, 2012"
 import os
 import re
 import collections
+import itertools
+import multiprocessing
+import tarfile
+import zipfile
+import StringIO
+import time
 
 from pymatgen.alchemy.materials import TransformedStructure
 
@@ -284,13 +291,170 @@ def batch_write_vasp_input(transformed_structures, vasp_input_set, output_dir, c
             function to create subdirectory name from transformed_structure.
             eg. lambda x: x.other_parameters['tags'][0] to use the first tag
     """
+    for (s, dirname) in _iter_vasp_input_dirnames(transformed_structures,
+                                                  output_dir, subfolder):
+        s.write_vasp_input(vasp_input_set, dirname, create_directory=True)
+
+
+def bulk_write_vasp_input(transformed_structures, vasp_input_set, output_dir,
+                          subfolder=None, nproc=1, archive_format=None,
+                          chunk_size=16):
+    """
+    Bulk write vasp input for a large number of transformed structures,
+    following the same format output_dir/{group}/{formula}_{number} as
+    batch_write_vasp_input. The INCAR, KPOINTS, POSCAR and transformations.json
+    strings are rendered in a pool of processes, while the POTCARs are
+    assembled from a table of POTCAR strings shared by all structures, so that
+    each POTCAR is only read once from the VASP_PSP_DIR. Each file is written
+    with a single buffered write.
+
+    Note that only the get_all_vasp_input, get_potcar and get_potcar_symbols
+    methods of the vasp_input_set are used, i.e., a customized write_input is
+    ignored.
+
+    Args:
+        transformed_structures:
+            Sequence of TransformedStructures.
+        vasp_input_set:
+            pymatgen.io.vaspio_set.VaspInputSet like object that creates
+            vasp input files from structures. It has to be picklable if
+            nproc > 1.
+        output_dir:
+            Directory to output files. If an archive_format is given, this is
+            the name of the archive without the extension, and the paths in
+            the archive start with the basename of output_dir.
+        subfolder:
+            function to create subdirectory name from transformed_structure.
+            eg. lambda x: x.other_parameters['tags'][0] to use the first tag
+        nproc:
+            Number of processes used to render the input files. Defaults to
+            1, i.e., no process pool.
+        archive_format:
+            Set to "tar", "gztar", "bztar" or "zip" to write all input files
+            into a single archive, output_dir + ".tar", ".tar.gz", ".tar.bz2"
+            or ".zip", instead of thousands of small files. Defaults to None.
+        chunk_size:
+            Number of structures sent to a process at a time.
+
+    Returns:
+        List of the directory names written, in the order of the structures.
+    """
+    if archive_format is not None:
+        writer = _VaspInputArchiveWriter(output_dir, archive_format)
+    else:
+        writer = _VaspInputDirectoryWriter()
+    potcars = {}
+    dirnames = []
+    pool = multiprocessing.Pool(nproc) if nproc > 1 else None
+    try:
+        tasks = ((s.to_dict, vasp_input_set) for s in transformed_structures)
+        if pool is not None:
+            results = pool.imap(_get_vasp_input_strings, tasks, chunk_size)
+        else:
+            results = itertools.imap(_get_vasp_input_strings, tasks)
+        named = _iter_vasp_input_dirnames(transformed_structures, output_dir,
+                                          subfolder)
+        for ((s, dirname), files) in itertools.izip(named, results):
+            symbols = files.pop("POTCAR.spec").split("\n")
+            if any([sym not in potcars for sym in symbols]):
+                potcar = vasp_input_set.get_potcar(s.final_structure)
+                potcars.update(zip(symbols, [str(p) for p in potcar]))
+            files["POTCAR"] = "".join([potcars[sym] for sym in symbols]) + \
+                "\n"
+            writer.write(dirname, files)
+            dirnames.append(dirname)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        writer.close()
+    return dirnames
+
+
+def _iter_vasp_input_dirnames(transformed_structures, output_dir, subfolder):
+    """
+    Generator of (transformed structure, directory name) following the
+    format output_dir/{group}/{formula}_{number}.
+    """
     dnames_count = collections.defaultdict(int)
     for s in transformed_structures:
         formula = re.sub("\s+", "", s.final_structure.formula)
         if subfolder is not None:
             subdir = subfolder(s)
-            dirname = os.path.join(output_dir, subdir, '{}_{}'.format(formula, dnames_count[subdir + formula] + 1))
+            key = subdir + formula
+            dirname = os.path.join(output_dir, subdir, '{}_{}'.format(formula, dnames_count[key] + 1))
         else:
-            dirname = os.path.join(output_dir, '{}_{}'.format(formula, dnames_count[formula] + 1))
-        s.write_vasp_input(vasp_input_set, dirname, create_directory=True)
-        dnames_count[formula] += 1
+            key = formula
+            dirname = os.path.join(output_dir, '{}_{}'.format(formula, dnames_count[key] + 1))
+        dnames_count[key] += 1
+        yield (s, dirname)
+
+
+def _get_vasp_input_strings(args):
+    """
+    Renders the vasp input of a transformed structure, given as a dict, as a
+    dict of {filename: file contents}, with the POTCAR symbols in POTCAR.spec
+    instead of the POTCAR. This is a module level function and takes python
+    primitives, so that it can be used with a multiprocessing pool.
+    """
+    (d, vasp_input_set) = args
+    s = TransformedStructure.from_dict(d)
+    files = s.get_vasp_input(vasp_input_set, generate_potcar=False)
+    for (k, v) in files.items():
+        if k not in ("POTCAR.spec", "transformations.json"):
+            files[k] = str(v) + "\n"
+    return files
+
+
+class _VaspInputDirectoryWriter(object):
+    """
+    Writes vasp input files to directories.
+    """
+
+    def write(self, dirname, files):
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        for (k, v) in files.items():
+            with open(os.path.join(dirname, k), "w") as f:
+                f.write(v)
+
+    def close(self):
+        pass
+
+
+class _VaspInputArchiveWriter(object):
+    """
+    Writes vasp input files into a single tar or zip archive.
+    """
+
+    modes = {"tar": (".tar", "w"), "gztar": (".tar.gz", "w:gz"),
+             "bztar": (".tar.bz2", "w:bz2")}
+
+    def __init__(self, output_dir, archive_format):
+        output_dir = os.path.normpath(output_dir)
+        self.root = os.path.dirname(output_dir)
+        if archive_format == "zip":
+            self.filename = output_dir + ".zip"
+            self.archive = zipfile.ZipFile(self.filename, "w",
+                                           zipfile.ZIP_DEFLATED)
+        elif archive_format in self.modes:
+            (ext, mode) = self.modes[archive_format]
+            self.filename = output_dir + ext
+            self.archive = tarfile.open(self.filename, mode)
+        else:
+            raise ValueError("Unknown archive format {}".format(archive_format))
+
+    def write(self, dirname, files):
+        arcdir = os.path.relpath(os.path.normpath(dirname), self.root or ".")
+        for (k, v) in sorted(files.items()):
+            arcname = os.path.join(arcdir, k)
+            if isinstance(self.archive, zipfile.ZipFile):
+                self.archive.writestr(arcname, v)
+            else:
+                info = tarfile.TarInfo(arcname)
+                info.size = len(v)
+                info.mtime = time.time()
+                self.archive.addfile(info, StringIO.StringIO(v))
+
+    def close(self):
+        self.archive.close()
@@ -95,6 +95,9 @@ class StructureFitter(object):
         self._supercells_allowed = supercells_allowed
         self._anonymized = anonymized
         self._max_rotations = fitting_accuracy
+        #Specie mapping used for anonymized fitting. None means species must
+        #match exactly.
+        self._species_mapping = None
         #Sort structures first so that they have the same arrangement of species
         self._structure_a = structure_a.get_sorted_structure()
         self._structure_b = structure_b.get_sorted_structure()
@@ -114,26 +117,45 @@ class StructureFitter(object):
                 comp_a = structure_a.composition
                 comp_b = structure_b.composition
                 if len(comp_a.elements) == len(comp_b.elements):
-                    el_a = comp_a.elements
-                    #Create permutations of the specie/elements in structure A 
-                    for p in itertools.permutations(el_a):
-                        # Create mapping of the specie/elements in structure B to that of A.
-                        # Then create a modified structure with those elements and try to fit it.
-                        el_mapping = dict(zip(comp_b.elements, p))
-                        logger.debug("Using specie mapping " + str(el_mapping))
-                        mod = StructureEditor(self._structure_b)
-                        mod.replace_species(el_mapping)
-                        self.fit(self._structure_a, mod.modified_structure)
+                    if self._structure_a.is_ordered and self._structure_b.is_ordered:
+                        # Fit the framework once, ignoring species, and derive
+                        # the element mapping from the site correspondence.
+                        self._species_mapping = {}
+                        self.fit(self._structure_a, self._structure_b)
                         if self._mapping_op != None:
-                            #Store successful element mapping
-                            self.el_mapping = {el_a:el_b for el_b, el_a in el_mapping.items()}
-                            break
+                            mapping = self._species_mapping
+                            if self.fixed_is_a:
+                                self.el_mapping = {sp_a:sp_b for sp_b, sp_a in mapping.items()}
+                            else:
+                                self.el_mapping = dict(mapping)
+                    else:
+                        self._fit_species_permutations(comp_a, comp_b)
                 else:
                     logger.debug("No. of elements in structures are unequal.")
         else:
             self._mapping_op = None
             logger.debug("Symmetry is different.")
 
+    def _fit_species_permutations(self, comp_a, comp_b):
+        """
+        Brute force anonymized fitting by trying every permutation of the
+        elements. Only used for disordered structures, where a single
+        specie-agnostic fit cannot derive the mapping.
+        """
+        el_a = comp_a.elements
+        #Create permutations of the specie/elements in structure A 
+        for p in itertools.permutations(el_a):
+            # Create mapping of the specie/elements in structure B to that of A.
+            # Then create a modified structure with those elements and try to fit it.
+            el_mapping = dict(zip(comp_b.elements, p))
+            logger.debug("Using specie mapping " + str(el_mapping))
+            mod = StructureEditor(self._structure_b)
+            mod.replace_species(el_mapping)
+            self.fit(self._structure_a, mod.modified_structure)
+            if self._mapping_op != None:
+                #Store successful element mapping
+                self.el_mapping = {el_a:el_b for el_b, el_a in el_mapping.items()}
+                break
 
     def fit(self, a, b):
         """
@@ -147,7 +169,11 @@ class StructureFitter(object):
         logger.debug(str(b))
 
         # Check composition first.  If compositions are not the same, do not need to fit further.
-        if a.composition.reduced_formula != b.composition.reduced_formula or ((a.num_sites != b.num_sites) and not self._supercells_allowed):
+        if self._species_mapping is None:
+            comp_match = a.composition.reduced_formula == b.composition.reduced_formula
+        else:
+            comp_match = np.allclose(anonymized_fractions(a.composition), anonymized_fractions(b.composition))
+        if not comp_match or ((a.num_sites != b.num_sites) and not self._supercells_allowed):
             logger.debug('Compositions do not match')
             return None
 
@@ -242,9 +268,17 @@ class StructureFitter(object):
     def _test_rot(self, rot, origin, fixed, to_fit, tol_atoms, tol_atoms_plus):
         found_map = False
         mapping_op = None
+        if self._species_mapping is not None:
+            origin_frac = to_fit.composition.get_atomic_fraction(origin.specie)
         for site in fixed:
             logger.debug("Trying candidate rotation : \n" + str(rot))
-            if site.species_and_occu == origin.species_and_occu:
+            if self._species_mapping is None:
+                sp_mapping = None
+                origin_match = site.species_and_occu == origin.species_and_occu
+            else:
+                sp_mapping = {origin.specie: site.specie}
+                origin_match = abs(fixed.composition.get_atomic_fraction(site.specie) - origin_frac) < 1e-8
+            if origin_match:
                 shift = site.coords
                 op = SymmOp.from_rotation_matrix_and_translation_vector(rot.rotation_matrix, shift)
                 nstruct = apply_operation(to_fit, op)
@@ -260,7 +294,7 @@ class StructureFitter(object):
                         break
                     cands = sorted(cands, key=lambda a: a[1])
                     (closest, closest_dist) = cands[0]
-                    if closest_dist > tol_atoms or closest.species_and_occu != trans.species_and_occu:
+                    if closest_dist > tol_atoms or not species_match(trans.species_and_occu, closest.species_and_occu, sp_mapping):
                         logger.debug("Closest dist too large! closest dist = {}".format(closest_dist))
                         all_match = False
                         break
@@ -298,7 +332,7 @@ class StructureFitter(object):
                     cands = sorted(cands, key=lambda a: a[1])
                     (closest, closest_dist) = cands[0]
 
-                    if closest_dist > tol_atoms or closest.species_and_occu != fixed_site.species_and_occu:
+                    if closest_dist > tol_atoms or not species_match(closest.species_and_occu, fixed_site.species_and_occu, sp_mapping):
                         all_match = False
                         logger.debug("Rejected because inverse mapping does not fit - Step 2")
                         break
@@ -327,6 +361,8 @@ class StructureFitter(object):
                     found_map = True
                     mapping_op = op
                     self.correspondance = correspondance
+                    if sp_mapping is not None:
+                        self._species_mapping = sp_mapping
                     break
 
         return (found_map, mapping_op)
@@ -468,6 +504,40 @@ def sqrt_matrix(input_matrix):
 def shear_invariant(matrix):
     return (matrix[0][0] - matrix[1][1]) ** 2 + (matrix[1][1] - matrix[2][2]) ** 2 + (matrix[0][0] - matrix[2][2]) ** 2 + 6 * (matrix[0][1] * matrix[0][1] + matrix[0][2] * matrix[0][2] + matrix[1][2] * matrix[1][2])
 
+def anonymized_fractions(comp):
+    """
+    Sorted atomic fractions of a composition, i.e., a representation of the
+    composition that ignores the identity of the species.
+    """
+    return sorted([comp.get_atomic_fraction(el) for el in comp.elements])
+
+def species_match(sp_fit, sp_fixed, mapping):
+    """
+    Checks if the species_and_occu of a site being fitted matches that of a
+    site in the fixed structure.
+    
+    Args:
+        sp_fit:
+            species_and_occu of site in the structure being fitted.
+        sp_fixed:
+            species_and_occu of site in the fixed structure.
+        mapping:
+            None if species must match exactly. Otherwise, a dict of
+            {specie in fitted structure: specie in fixed structure} for
+            ordered sites, which is extended in place and must remain one to
+            one.
+    """
+    if mapping is None:
+        return sp_fit == sp_fixed
+    fit_sp = sp_fit.keys()[0]
+    fixed_sp = sp_fixed.keys()[0]
+    if fit_sp in mapping:
+        return mapping[fit_sp] == fixed_sp
+    if fixed_sp in mapping.values():
+        return False
+    mapping[fit_sp] = fixed_sp
+    return True
+
 def are_sites_unique(sites, allow_periodic_image=True):
     for (site1, site2) in itertools.combinations(sites, 2):
         if (allow_periodic_image and site1.is_periodic_image(site2)) or (site1.species_and_occu == site2.species_and_occu and (abs(site1.coords - site2.coords) < 0.1).all()):
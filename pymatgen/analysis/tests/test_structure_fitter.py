@@ -80,6 +80,13 @@ class StructureFitterTest(unittest.TestCase):
         self.assertTrue(fitter.mapping_op != None, "Fit should be found when NaFePO4 and LiFePo4 are fitted in anonymized mode!")
         self.assertEqual({el1.symbol:el2.symbol for el1, el2 in fitter.el_mapping.items()}, {"O":"O", "Fe":"Fe", "Na":"Li", "P":"P"})
 
+        #Relabel every specie so that no element is shared.
+        editor = StructureEditor(a)
+        editor.replace_species({Element("Li"):Element("Na"), Element("Fe"):Element("Mn"), Element("P"):Element("As"), Element("O"):Element("S")})
+        fitter = StructureFitter(editor.modified_structure, a, anonymized=True)
+        self.assertTrue(fitter.mapping_op != None, "Fit should be found for a relabeled structure in anonymized mode!")
+        self.assertEqual({el1.symbol:el2.symbol for el1, el2 in fitter.el_mapping.items()}, {"S":"O", "Mn":"Fe", "Na":"Li", "As":"P"})
+
 class SupportFunctionTest(unittest.TestCase):
 
     def test_shear_invariant(self):
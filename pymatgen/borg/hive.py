@@ -73,6 +73,25 @@ class AbstractDrone(object):
         """
         return
 
+    def get_signature_files(self, path):
+        """
+        Returns the files which determine the data assimilated from a path.
+        These are used to detect which paths have changed when data is
+        assimilated incrementally. By default, these are all files in a
+        directory path, or the path itself for a file path.
+
+        Args:
+            path:
+                directory or file path, as returned by get_valid_paths.
+
+        Returns:
+            List of file paths
+        """
+        if os.path.isfile(path):
+            return [path]
+        return sorted([os.path.join(path, f) for f in os.listdir(path)
+                       if os.path.isfile(os.path.join(path, f))])
+
     @abc.abstractmethod
     def convert(self, d):
         """
@@ -151,7 +170,9 @@ class VaspToComputedEntryDrone(AbstractDrone):
                     filepath = fname
 
         try:
-            vasprun = Vasprun(filepath)
+            #Only the final step and input parameters are needed up front.
+            #Anything else requested in parameters or data is parsed lazily.
+            vasprun = Vasprun(filepath, parse_sections=[])
         except Exception as ex:
             logger.debug("error in {}: {}".format(filepath, ex))
             return None
@@ -169,6 +190,10 @@ class VaspToComputedEntryDrone(AbstractDrone):
                                    vasprun.final_energy, parameters=param, data=data)
         return entry.to_dict
 
+    def get_signature_files(self, path):
+        return sorted(glob.glob(os.path.join(path, "vasprun.xml*")) +
+                      glob.glob(os.path.join(path, "relax2", "vasprun.xml*")))
+
     def get_valid_paths(self, path):
         (parent, subdirs, files) = path
         if 'relax1' in subdirs and 'relax2' in subdirs:
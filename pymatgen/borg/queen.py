@@ -19,9 +19,10 @@ import os
 import json
 import logging
 
-from pymatgen.util.io_utils import file_open_zip_aware
+from pymatgen.core.structure import Composition
+from pymatgen.util.io_utils import file_open_zip_aware, get_file_sha1
 
-from multiprocessing import Manager, Pool
+from multiprocessing import Pool
 
 logger = logging.getLogger("BorgQueen")
 
@@ -30,6 +31,17 @@ class BorgQueen(object):
     The Borg Queen controls the drones to assimilate data in an entire directory
     substructure. Uses multiprocessing to speed up things considerably. It also
     contains convenience methods to save and load data between sessions.
+
+    The path each piece of data was assimilated from is kept. With
+    incremental_assimilate, a manifest of the size, modification time and
+    sha1 hash of the files of every path is kept as well, so that only new or
+    changed paths have to be assimilated again. The manifest is saved and
+    loaded together with the data.
+
+    Data can also be stored as JSON lines (see JsonLinesStore) by using a
+    filename containing ".jsonl", e.g., "data.jsonl.gz". Records can then be
+    appended to the file as they are assimilated with assimilate_to_file, and
+    loaded lazily and selectively with iter_data.
     """
 
     def __init__(self, drone, rootpath=None, number_of_drones=1):
@@ -52,41 +64,196 @@ class BorgQueen(object):
         self._drone = drone
         self._num_drones = number_of_drones
         self._data = []
+        self._paths = []
+        self._manifest = {}
 
         if rootpath:
             self.parallel_assimilate(rootpath)
 
-    def parallel_assimilate(self, rootpath):
+    def parallel_assimilate(self, rootpath, chunk_size=8):
         """
         Assimilate the entire subdirectory structure in rootpath.
-        """
-        logger.info('Scanning for valid paths...')
-        valid_paths = []
-        for (parent, subdirs, files) in os.walk(rootpath):
-            valid_paths.extend(self._drone.get_valid_paths((parent, subdirs, files)))
 
-        manager = Manager()
-        data = manager.list()
-        status = manager.dict()
-        status['count'] = 0
-        status['total'] = len(valid_paths)
-        logger.info('{} valid paths found.'.format(len(valid_paths)))
-
-        p = Pool(self._num_drones)
-        p.map(order_assimilation, ((path, self._drone, data, status) for path in valid_paths))
-        self._data.extend(data)
+        Args:
+            rootpath:
+                The root directory to start assimilation.
+            chunk_size:
+                Number of paths sent to a drone at a time.
+        """
+        for (path, newdata) in self._iter_assimilate(rootpath, chunk_size):
+            if newdata:
+                self._data.append(newdata)
+                self._paths.append(path)
 
     def serial_assimilate(self, rootpath):
         """
         Assimilate the entire subdirectory structure in rootpath serially.
         """
-        valid_paths = []
+        for path in self.iter_valid_paths(rootpath):
+            newdata = self._drone.assimilate(path)
+            if newdata:
+                self._data.append(newdata)
+                self._paths.append(path)
+
+    def iter_valid_paths(self, rootpath):
+        """
+        Generator over the paths in the subdirectory structure of rootpath
+        which are valid for assimilation by the drone, in the order they are
+        found.
+        """
         for (parent, subdirs, files) in os.walk(rootpath):
-            valid_paths.extend(self._drone.get_valid_paths((parent, subdirs, files)))
-        data = []
-        for path in valid_paths:
-            order_assimilation((path, self._drone, data))
-        self._data.extend(data)
+            for path in self._drone.get_valid_paths((parent, subdirs, files)):
+                yield path
+
+    def iter_assimilate(self, rootpath, chunk_size=8):
+        """
+        Generator over the data assimilated from the subdirectory structure
+        in rootpath, which is yielded as soon as it has been assimilated and
+        not in any particular order. The assimilated data is not stored in the
+        BorgQueen.
+
+        Directory discovery and assimilation are pipelined: the directory
+        tree is walked lazily by the process pool's task feeder, while the
+        drones pull chunks of paths as soon as they are idle. Only the paths
+        and the assimilated data are sent between processes.
+
+        Args:
+            rootpath:
+                The root directory to start assimilation.
+            chunk_size:
+                Number of paths sent to a drone at a time. Small chunks
+                balance the load better, large chunks reduce the overhead for
+                cheap assimilations.
+        """
+        for (path, newdata) in self._iter_assimilate(rootpath, chunk_size):
+            if newdata:
+                yield newdata
+
+    def _iter_assimilate(self, rootpath, chunk_size, func=None, paths=None):
+        """
+        Generator over the (path, result) of func applied to the valid paths
+        in rootpath (or the given sequence of paths) by the drones. The
+        default func returns the assimilated data.
+        """
+        pool = Pool(self._num_drones, _init_drone, (self._drone,))
+        try:
+            if paths is None:
+                paths = self.iter_valid_paths(rootpath)
+            count = 0
+            for result in pool.imap_unordered(func or _assimilate_path, paths,
+                                              chunk_size):
+                count += 1
+                logger.info('{} paths done'.format(count))
+                yield result
+            logger.info('{} valid paths assimilated.'.format(count))
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def incremental_assimilate(self, rootpath, chunk_size=8):
+        """
+        Assimilate only the paths in the subdirectory structure of rootpath
+        which are new or have changed since they were last assimilated with
+        incremental_assimilate, and merge the results into the existing data.
+        Data of paths which no longer exist is dropped.
+
+        A path is unchanged if its signature files (see
+        AbstractDrone.get_signature_files) have the same sizes and
+        modification times as recorded in the manifest. Otherwise, the
+        sha1 hashes of the files are compared by the drones before the path
+        is assimilated again, so that touched or copied files are not
+        reparsed. Paths have to be given in the same form, e.g., relative to
+        the same working directory, every time.
+
+        Data without a path in the manifest, e.g., loaded from a file saved
+        before manifests were kept, is assimilated again.
+
+        Args:
+            rootpath:
+                The root directory to start assimilation.
+            chunk_size:
+                Number of paths sent to a drone at a time.
+
+        Returns:
+            (List of paths assimilated again, list of paths removed).
+        """
+        found = set()
+
+        def iter_candidates():
+            for path in self.iter_valid_paths(rootpath):
+                found.add(path)
+                signature = self._manifest.get(path)
+                if signature is None or \
+                        _get_stat_signature(self._drone, path) != \
+                        {f: v[:2] for (f, v) in signature.items()}:
+                    yield (path, signature)
+
+        updated = {}
+        for (path, signature, changed, newdata) in self._iter_assimilate(
+                rootpath, chunk_size, _reassimilate_path, iter_candidates()):
+            self._manifest[path] = signature
+            if changed:
+                updated[path] = newdata
+        removed = [p for p in self._manifest if p not in found]
+        for path in removed:
+            del self._manifest[path]
+        (data, paths) = ([], [])
+        for (d, p) in zip(self._data, self._paths):
+            if p in self._manifest and p not in updated:
+                data.append(d)
+                paths.append(p)
+        for (p, d) in updated.items():
+            if d:
+                data.append(d)
+                paths.append(p)
+        if None in self._paths:
+            logger.warning('{} entries without a path were discarded.'.format(
+                self._paths.count(None)))
+        (self._data, self._paths) = (data, paths)
+        logger.info('{} paths assimilated again, {} paths removed.'.format(
+            len(updated), len(removed)))
+        return (sorted(updated.keys()), sorted(removed))
+
+    def assimilate_to_file(self, rootpath, filename, chunk_size=8):
+        """
+        Assimilate the entire subdirectory structure in rootpath, appending
+        the data to a JSON lines file as soon as it has been assimilated.
+        The assimilated data is not stored in the BorgQueen.
+
+        Args:
+            rootpath:
+                The root directory to start assimilation.
+            filename:
+                JSON lines file to append the data to, e.g.,
+                "data.jsonl" or "data.jsonl.gz".
+            chunk_size:
+                Number of paths sent to a drone at a time.
+
+        Returns:
+            Number of records appended.
+        """
+        return JsonLinesStore(filename).extend(
+            (path, newdata) for (path, newdata)
+            in self._iter_assimilate(rootpath, chunk_size) if newdata)
+
+    def iter_data(self, filename, paths=None, formulas=None):
+        """
+        Generator over the objects stored in a JSON lines file, which are
+        only read and converted by the drone when needed.
+
+        Args:
+            filename:
+                JSON lines file, e.g., "data.jsonl" or "data.jsonl.gz".
+            paths:
+                Only load the data assimilated from these paths. Defaults to
+                None, i.e., all paths.
+            formulas:
+                Only load the data with these reduced formulas. Defaults to
+                None, i.e., all formulas.
+        """
+        store = JsonLinesStore(filename)
+        for (path, d) in store.iter_records(paths, formulas):
+            yield self._drone.convert(d)
 
     def get_assimilated_data(self):
         """
@@ -102,26 +269,251 @@ class BorgQueen(object):
             filename:
                 filename to save the assimilated data to. Note that if the
                 filename ends with gz or bz2, the relevant gzip or bz2
-                compression will be applied.
+                compression will be applied. If the filename contains
+                ".jsonl", the data is saved as JSON lines with an index, and
+                only gzip compression is supported.
         """
-        with file_open_zip_aware(filename, "w") as f:
-            json.dump(list(self._data), f)
+        if JsonLinesStore.is_json_lines(filename):
+            store = JsonLinesStore(filename)
+            store.clear()
+            store.extend(zip(self._paths, self._data))
+        else:
+            with file_open_zip_aware(filename, "w") as f:
+                json.dump(list(self._data), f)
+        if self._manifest:
+            with open(BorgQueen.get_manifest_filename(filename), "w") as f:
+                json.dump({"paths": self._paths,
+                           "manifest": self._manifest}, f)
 
     def load_data(self, filename):
         """
-        Load assimilated data from a file
+        Load assimilated data from a file, together with its manifest if
+        present.
+        """
+        if JsonLinesStore.is_json_lines(filename):
+            records = list(JsonLinesStore(filename).iter_records())
+            self._paths = [path for (path, d) in records]
+            self._data = [d for (path, d) in records]
+        else:
+            with file_open_zip_aware(filename, "r") as f:
+                self._data = json.load(f)
+            self._paths = [None] * len(self._data)
+        self._manifest = {}
+        manifest_filename = BorgQueen.get_manifest_filename(filename)
+        if os.path.exists(manifest_filename):
+            with open(manifest_filename) as f:
+                d = json.load(f)
+            if len(d["paths"]) == len(self._data):
+                self._paths = d["paths"]
+                self._manifest = d["manifest"]
+            else:
+                logger.warning('Ignoring manifest {}, which does not match '
+                               'the data.'.format(manifest_filename))
+
+    @staticmethod
+    def get_manifest_filename(filename):
+        """
+        Returns the filename of the manifest saved alongside a data file,
+        e.g., "data.json.gz.manifest.json" for "data.json.gz".
+        """
+        return filename + ".manifest.json"
+
+
+class JsonLinesStore(object):
+    """
+    Append-only store of assimilated data as JSON lines, i.e., one
+    {"path": path, "data": data} record per line, optionally gzip-compressed.
+
+    An index of the (offset, length, path, formula) of every record is kept
+    in a separate JSON lines file, so that records can be selected by path or
+    reduced formula and read without parsing the rest of the file. The
+    index is rebuilt from the data if it is missing or older than the data.
+    Note that seeking in a gzipped file decompresses everything before the
+    offset, so selective loading mainly saves the parsing and conversion.
+    """
+
+    def __init__(self, filename):
+        """
+        Args:
+            filename:
+                Filename of the store, e.g., "data.jsonl" or "data.jsonl.gz".
+                Gzip compression is applied if the filename ends with gz.
+                Bz2 compression is not supported, since bz2 files cannot be
+                appended to.
+        """
+        if filename.split(".")[-1].upper() == "BZ2":
+            raise ValueError("JSON lines stores do not support bz2 "
+                             "compression. Use gzip instead.")
+        self.filename = filename
+        self._index = None
+
+    @staticmethod
+    def is_json_lines(filename):
+        """
+        Returns True if filename refers to JSON lines, i.e., contains
+        ".jsonl".
+        """
+        return ".jsonl" in os.path.basename(filename)
+
+    @staticmethod
+    def get_index_filename(filename):
+        """
+        Returns the filename of the index of a store.
+        """
+        return filename + ".index"
+
+    @property
+    def index(self):
+        """
+        List of (offset, length, path, formula) of the records, with offsets
+        and lengths in the uncompressed data.
+        """
+        if self._index is None:
+            self._index = self._load_index()
+        return self._index
+
+    def _load_index(self):
+        index_filename = JsonLinesStore.get_index_filename(self.filename)
+        if not os.path.exists(self.filename):
+            return []
+        if os.path.exists(index_filename) and \
+                os.path.getmtime(index_filename) >= \
+                os.path.getmtime(self.filename):
+            with open(index_filename) as f:
+                return [tuple(json.loads(line)) for line in f]
+        logger.info('Rebuilding index {}'.format(index_filename))
+        index = []
+        offset = 0
+        with file_open_zip_aware(self.filename, "rb") as f:
+            for line in iter(f.readline, ""):
+                record = json.loads(line)
+                index.append((offset, len(line), record["path"],
+                              _get_formula(record["data"])))
+                offset += len(line)
+        with open(index_filename, "w") as f:
+            for entry in index:
+                f.write(json.dumps(entry) + "\n")
+        return index
+
+    def extend(self, records):
+        """
+        Appends records to the store.
+
+        Args:
+            records:
+                Iterable of (path, data) tuples.
+
+        Returns:
+            Number of records appended.
         """
-        with file_open_zip_aware(filename, "r") as f:
-            self._data = json.load(f)
+        index = self.index
+        index_filename = JsonLinesStore.get_index_filename(self.filename)
+        offset = index[-1][0] + index[-1][1] if index else 0
+        count = 0
+        with file_open_zip_aware(self.filename, "ab") as f, \
+                open(index_filename, "a") as f_index:
+            for (path, d) in records:
+                line = json.dumps({"path": path, "data": d}) + "\n"
+                entry = (offset, len(line), path, _get_formula(d))
+                f.write(line)
+                f_index.write(json.dumps(entry) + "\n")
+                index.append(entry)
+                offset += len(line)
+                count += 1
+        #The index has to be at least as recent as the data to be used.
+        os.utime(index_filename, None)
+        return count
 
+    def iter_records(self, paths=None, formulas=None):
+        """
+        Generator over the (path, data) of the records in the store, in the
+        order they were appended.
+
+        Args:
+            paths:
+                Only yield the records of these paths. Defaults to None,
+                i.e., all paths.
+            formulas:
+                Only yield the records with these reduced formulas. Defaults
+                to None, i.e., all formulas.
+        """
+        if not os.path.exists(self.filename):
+            return
+        paths = set(paths) if paths is not None else None
+        formulas = set(formulas) if formulas is not None else None
+        with file_open_zip_aware(self.filename, "rb") as f:
+            if paths is None and formulas is None:
+                for line in iter(f.readline, ""):
+                    record = json.loads(line)
+                    yield (record["path"], record["data"])
+                return
+            for (offset, length, path, formula) in self.index:
+                if (paths is None or path in paths) and \
+                        (formulas is None or formula in formulas):
+                    f.seek(offset)
+                    record = json.loads(f.read(length))
+                    yield (record["path"], record["data"])
+
+    def clear(self):
+        """
+        Removes all records, i.e., the data and index files.
+        """
+        for filename in [self.filename,
+                         JsonLinesStore.get_index_filename(self.filename)]:
+            if os.path.exists(filename):
+                os.remove(filename)
+        self._index = []
+
+
+def _get_formula(d):
+    """
+    Returns the reduced formula of the composition in a dict representation
+    of an entry, or None.
+    """
+    if isinstance(d, dict) and "composition" in d:
+        return Composition.from_dict(d["composition"]).reduced_formula
+    return None
+
+
+_drone = None
 
-def order_assimilation(args):
-    (path, drone, data, status) = args
-    newdata = drone.assimilate(path)
-    if newdata:
-        data.append(newdata)
-    status['count'] += 1
-    count = status['count']
-    total = status['total']
-    logger.info('{}/{} ({:.2f}%) done'.format(count, total, count / total * 100))
 
+def _init_drone(drone):
+    """
+    Sets the drone of a worker process. The drone is only sent once to each
+    worker, instead of with every path.
+    """
+    global _drone
+    _drone = drone
+
+
+def _assimilate_path(path):
+    return (path, _drone.assimilate(path))
+
+
+def _get_stat_signature(drone, path):
+    """
+    Returns {file: [size, mtime]} of the signature files of a path.
+    """
+    signature = {}
+    for f in drone.get_signature_files(path):
+        st = os.stat(f)
+        signature[f] = [st.st_size, st.st_mtime]
+    return signature
+
+
+def _reassimilate_path(args):
+    """
+    Returns (path, signature, changed, data) for a path whose files may have
+    changed since its previous signature {file: [size, mtime, sha1]}. The
+    path is only assimilated if the hashes of the files have changed.
+    """
+    (path, old_signature) = args
+    signature = _get_stat_signature(_drone, path)
+    for (f, v) in signature.items():
+        v.append(get_file_sha1(f))
+    if old_signature is not None and \
+            {f: v[2] for (f, v) in signature.items()} == \
+            {f: v[2] for (f, v) in old_signature.items()}:
+        return (path, signature, False, None)
+    return (path, signature, True, _drone.assimilate(path))
@@ -15,14 +15,38 @@ __date__ = "Mar 18, 2012"
 
 import unittest
 import os
+import json
+import shutil
+import tempfile
 import pymatgen
 
-from pymatgen.borg.hive import VaspToComputedEntryDrone
-from pymatgen.borg.queen import BorgQueen
+from pymatgen.borg.hive import AbstractDrone, VaspToComputedEntryDrone
+from pymatgen.borg.queen import BorgQueen, JsonLinesStore
 
 test_dir = os.path.join(os.path.dirname(os.path.abspath(pymatgen.__file__)), '..', 'test_files')
 
 
+class JsonDrone(AbstractDrone):
+    """
+    Drone which assimilates the dict in every data.json.
+    """
+
+    def assimilate(self, path):
+        with open(os.path.join(path, "data.json")) as f:
+            return json.load(f)
+
+    def get_valid_paths(self, path):
+        (parent, subdirs, files) = path
+        return [parent] if "data.json" in files else []
+
+    def convert(self, d):
+        return d
+
+    @property
+    def to_dict(self):
+        return {"name": self.__class__.__name__, "init_args": {}}
+
+
 class BorgQueenTest(unittest.TestCase):
 
     def setUp(self):
@@ -39,6 +63,129 @@ class BorgQueenTest(unittest.TestCase):
         queen.load_data(os.path.join(test_dir, "assimilated.json"))
         self.assertEqual(len(queen.get_assimilated_data()), 1)
 
+
+class PipelinedAssimilationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for i in xrange(20):
+            path = os.path.join(self.tmpdir, str(i % 3), "run{}".format(i))
+            os.makedirs(path)
+            if i % 5:
+                with open(os.path.join(path, "data.json"), "w") as f:
+                    json.dump({"index": i}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_assimilate(self):
+        expected = [i for i in xrange(20) if i % 5]
+        queen = BorgQueen(JsonDrone())
+        self.assertEqual(len(list(queen.iter_valid_paths(self.tmpdir))), 16)
+        queen.serial_assimilate(self.tmpdir)
+        self.assertEqual(sorted([d["index"] for d in queen.get_assimilated_data()]),
+                         expected)
+        for chunk_size in [1, 8]:
+            queen = BorgQueen(JsonDrone(), number_of_drones=2)
+            queen.parallel_assimilate(self.tmpdir, chunk_size)
+            self.assertEqual(sorted([d["index"] for d in queen.get_assimilated_data()]),
+                             expected)
+        #Results are streamed without being stored.
+        results = list(queen.iter_assimilate(self.tmpdir))
+        self.assertEqual(sorted([d["index"] for d in results]), expected)
+        self.assertEqual(len(queen.get_assimilated_data()), 16)
+
+    def test_incremental_assimilate(self):
+        path = lambda i: os.path.join(self.tmpdir, str(i % 3), "run{}".format(i))
+        queen = BorgQueen(JsonDrone(), number_of_drones=2)
+        (updated, removed) = queen.incremental_assimilate(self.tmpdir)
+        self.assertEqual(len(updated), 16)
+        self.assertEqual(removed, [])
+        #Nothing is assimilated again if nothing has changed, even if a
+        #file is only touched.
+        os.utime(os.path.join(path(1), "data.json"), (0, 0))
+        self.assertEqual(queen.incremental_assimilate(self.tmpdir), ([], []))
+        with open(os.path.join(path(2), "data.json"), "w") as f:
+            json.dump({"index": 102}, f)
+        shutil.rmtree(path(3))
+        with open(os.path.join(path(5), "data.json"), "w") as f:
+            json.dump({"index": 5}, f)
+        (updated, removed) = queen.incremental_assimilate(self.tmpdir)
+        self.assertEqual(updated, sorted([path(2), path(5)]))
+        self.assertEqual(removed, [path(3)])
+        expected = sorted([i for i in xrange(20) if i % 5 and i not in [2, 3]]
+                          + [5, 102])
+        self.assertEqual(sorted([d["index"] for d in queen.get_assimilated_data()]),
+                         expected)
+        #The manifest is saved and loaded with the data.
+        filename = os.path.join(self.tmpdir, "data.json.gz")
+        queen.save_data(filename)
+        self.assertTrue(os.path.exists(BorgQueen.get_manifest_filename(filename)))
+        queen = BorgQueen(JsonDrone(), number_of_drones=2)
+        queen.load_data(filename)
+        with open(os.path.join(path(4), "data.json"), "w") as f:
+            json.dump({"index": 104}, f)
+        self.assertEqual(queen.incremental_assimilate(self.tmpdir), ([path(4)], []))
+        expected[expected.index(4)] = 104
+        self.assertEqual(sorted([d["index"] for d in queen.get_assimilated_data()]),
+                         sorted(expected))
+
+
+class JsonLinesStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for i in xrange(10):
+            path = os.path.join(self.tmpdir, "run{}".format(i))
+            os.makedirs(path)
+            with open(os.path.join(path, "data.json"), "w") as f:
+                json.dump({"index": i, "composition": {"Li": 2, "O": i % 2 + 1}}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_store(self):
+        for filename in ["data.jsonl", "data.jsonl.gz"]:
+            filename = os.path.join(self.tmpdir, filename)
+            store = JsonLinesStore(filename)
+            self.assertEqual(store.extend([("a", {"x": 1}), ("b", {"x": 2})]), 2)
+            store = JsonLinesStore(filename)
+            self.assertEqual(store.extend([("c", {"x": 3})]), 1)
+            self.assertEqual(list(store.iter_records()),
+                             [("a", {"x": 1}), ("b", {"x": 2}), ("c", {"x": 3})])
+            self.assertEqual(list(store.iter_records(paths=["c", "a"])),
+                             [("a", {"x": 1}), ("c", {"x": 3})])
+            #The index is rebuilt if it is missing.
+            index = store.index
+            os.remove(JsonLinesStore.get_index_filename(filename))
+            self.assertEqual(JsonLinesStore(filename).index, index)
+            store.clear()
+            self.assertEqual(list(store.iter_records()), [])
+        self.assertRaises(ValueError, JsonLinesStore,
+                          os.path.join(self.tmpdir, "data.jsonl.bz2"))
+
+    def test_assimilate_to_file(self):
+        filename = os.path.join(self.tmpdir, "data.jsonl.gz")
+        queen = BorgQueen(JsonDrone(), number_of_drones=2)
+        self.assertEqual(queen.assimilate_to_file(self.tmpdir, filename), 10)
+        self.assertEqual(queen.get_assimilated_data(), [])
+        data = queen.iter_data(filename)
+        self.assertEqual(next(data)["composition"]["Li"], 2)
+        self.assertEqual(len(list(data)), 9)
+        self.assertEqual(sorted([d["index"] for d in
+                                 queen.iter_data(filename, formulas=["Li2O"])]),
+                         [0, 2, 4, 6, 8])
+        path = os.path.join(self.tmpdir, "run3")
+        self.assertEqual([d["index"] for d in queen.iter_data(filename, paths=[path])],
+                         [3])
+        #Data saved as JSON lines is loaded with its paths.
+        queen.load_data(filename)
+        self.assertEqual(len(queen.get_assimilated_data()), 10)
+        filename = os.path.join(self.tmpdir, "saved.jsonl")
+        queen.save_data(filename)
+        self.assertEqual([d["index"] for d in queen.iter_data(filename, paths=[path])],
+                         [3])
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
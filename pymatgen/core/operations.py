@@ -14,7 +14,10 @@ __email__ = "shyue@mit.edu"
 __status__ = "Production"
 __date__ = "Sep 23, 2011"
 
+import itertools
+
 import numpy as np
+from scipy.spatial import cKDTree
 from math import sin, cos, pi, sqrt
 
 class SymmOp (object):
@@ -93,6 +96,20 @@ class SymmOp (object):
         affine_point[0:3] = point
         return np.dot(self._matrix, affine_point)[0:3]
 
+    def operate_multi(self, points):
+        """
+        Apply the operation on a list of points.
+        
+        Args:
+            points - a list of cartesian coordinates, or a numpy array of 
+            shape (n, 3).
+        
+        Returns:
+            A numpy array of shape (n, 3) of the transformed points.
+        """
+        points = np.array(points, dtype=float)
+        return np.dot(points, self.rotation_matrix.transpose()) + self.translation_vector
+
     def apply_rotation_only(self, vector):
         """
         Vectors should only be operated by the rotation matrix and not the translation vector
@@ -239,3 +256,219 @@ class SymmOp (object):
     @staticmethod
     def from_dict(d):
         return SymmOp(d['matrix'], d['tolerance'])
+
+
+class SymmOpSet(object):
+    """
+    A collection of symmetry operations stored as stacked arrays, i.e., an
+    (n_ops, 3, 3) array of rotations and an (n_ops, 3) array of translations.
+    All operations are applied to all points at once, which is much faster
+    than looping over SymmOp.operate. The orbit and equivalence methods treat
+    coordinates as fractional coordinates, i.e., points that differ by a
+    lattice translation are considered to be the same.
+    """
+
+    def __init__(self, rotations, translations, tol=0.01):
+        """
+        Args:
+            rotations:
+                A (n_ops, 3, 3) array of rotation matrices.
+            translations:
+                A (n_ops, 3) array of translation vectors.
+            tol:
+                Tolerance for determining if SymmOps are equal.
+        """
+        rotations = np.array(rotations, dtype=float).reshape((-1, 3, 3))
+        translations = np.array(translations, dtype=float).reshape((-1, 3))
+        if len(rotations) != len(translations):
+            raise ValueError("Number of rotations and translations must be the same.")
+        self._rotations = rotations
+        self._translations = translations
+        self._tol = tol
+
+    @staticmethod
+    def from_symmops(symmops, tol=0.01):
+        """
+        Creates a SymmOpSet from a sequence of SymmOps.
+        """
+        rots = [op.rotation_matrix for op in symmops]
+        trans = [op.translation_vector for op in symmops]
+        return SymmOpSet(rots, trans, tol)
+
+    @property
+    def rotations(self):
+        """
+        A (n_ops, 3, 3) numpy.array of rotation matrices.
+        """
+        return self._rotations
+
+    @property
+    def translations(self):
+        """
+        A (n_ops, 3) numpy.array of translation vectors.
+        """
+        return self._translations
+
+    @property
+    def symmops(self):
+        """
+        The operations as a list of SymmOps.
+        """
+        return [SymmOp.from_rotation_matrix_and_translation_vector(r, t, self._tol) for r, t in zip(self._rotations, self._translations)]
+
+    def __len__(self):
+        return len(self._rotations)
+
+    def __iter__(self):
+        return iter(self.symmops)
+
+    def __getitem__(self, i):
+        return SymmOp.from_rotation_matrix_and_translation_vector(self._rotations[i], self._translations[i], self._tol)
+
+    def __str__(self):
+        return "\n".join([str(op) for op in self])
+
+    def operate(self, points):
+        """
+        Applies all operations to all points.
+        
+        Args:
+            points:
+                A single point, or a list of points / (n, 3) numpy.array.
+        
+        Returns:
+            A (n_ops, 3) numpy.array for a single point, or a (n_ops, n, 3)
+            numpy.array for a list of points.
+        """
+        points = np.array(points, dtype=float)
+        if points.ndim == 1:
+            return np.einsum("kij,j->ki", self._rotations, points) + self._translations
+        return np.einsum("kij,nj->kni", self._rotations, points) + self._translations[:, None, :]
+
+    def get_orbit(self, frac_coords, tol=1e-5):
+        """
+        Returns the orbit of a point in fractional coordinates, i.e., all
+        symmetrically distinct images of the point brought into the unit cell.
+        
+        Args:
+            frac_coords:
+                Fractional coordinates of the point.
+            tol:
+                Tolerance in fractional coordinates for two images to be
+                considered the same.
+        
+        Returns:
+            A (n, 3) numpy.array of fractional coordinates.
+        """
+        images = self.operate(frac_coords)
+        images -= np.floor(images)
+        match = periodic_match(images, images, tol)
+        first = np.argmax(match, axis=1)
+        return images[first == np.arange(len(images))]
+
+    def get_site_permutations(self, frac_coords, tol=1e-5):
+        """
+        Returns the permutation of sites induced by each operation.
+        
+        Args:
+            frac_coords:
+                A (n, 3) array of fractional coordinates of sites.
+            tol:
+                Tolerance in fractional coordinates for two sites to be
+                considered the same.
+        
+        Returns:
+            A (n_ops, n) integer numpy.array, where element [k, i] is the
+            index of the site that site i is mapped onto by operation k, or
+            -1 if it is not mapped onto any site.
+        """
+        frac_coords = np.array(frac_coords, dtype=float)
+        return find_periodic_images(self.operate(frac_coords), frac_coords, tol)
+
+    def are_symmetrically_equivalent(self, frac_coords1, frac_coords2, tol=1e-8):
+        """
+        Checks if two sets of points in fractional coordinates are
+        symmetrically equivalent, i.e., there is an operation that maps every
+        point in the second set onto a point in the first set.
+        
+        Args:
+            frac_coords1:
+                1st set of fractional coordinates.
+            frac_coords2:
+                2nd set of fractional coordinates.
+            tol:
+                Tolerance in fractional coordinates for two points to be
+                considered the same.
+        
+        Returns:
+            Boolean indicating whether the two sets are symmetrically
+            equivalent.
+        """
+        frac_coords1 = np.array(frac_coords1, dtype=float).reshape((-1, 3))
+        frac_coords2 = np.array(frac_coords2, dtype=float).reshape((-1, 3))
+        inds = find_periodic_images(self.operate(frac_coords2), frac_coords1, tol)
+        return bool((inds >= 0).all(axis=-1).any())
+
+
+def periodic_match(fcoords1, fcoords2, tol=1e-8):
+    """
+    Tests which fractional coordinates are periodic images of each other.
+    
+    Args:
+        fcoords1:
+            A (..., n, 3) array of fractional coordinates.
+        fcoords2:
+            A (m, 3) array of fractional coordinates.
+        tol:
+            Tolerance in fractional coordinates.
+    
+    Returns:
+        A boolean array of shape (..., n, m), which is True where
+        fcoords1[..., i, :] is a periodic image of fcoords2[j].
+    """
+    diff = np.abs(fcoords1[..., :, None, :] - fcoords2) % 1
+    return np.logical_or(diff < tol, diff > 1 - tol).all(axis=-1)
+
+
+def find_periodic_images(fcoords1, fcoords2, tol=1e-8):
+    """
+    Finds, for every point in fcoords1, a point in fcoords2 of which it is a
+    periodic image, with the same criterion as periodic_match. Unlike
+    periodic_match, the points are matched with a kd-tree instead of
+    comparing all pairs, so memory and time scale with the number of points
+    rather than the number of pairs.
+    
+    Args:
+        fcoords1:
+            A (..., n, 3) array of fractional coordinates.
+        fcoords2:
+            A (m, 3) array of fractional coordinates.
+        tol:
+            Tolerance in fractional coordinates.
+    
+    Returns:
+        An integer array of shape (..., n) with the index of the matching
+        point in fcoords2, or -1 if there is none.
+    """
+    fcoords1 = np.array(fcoords1, dtype=float)
+    fcoords2 = np.array(fcoords2, dtype=float).reshape((-1, 3))
+    if len(fcoords2) == 0:
+        return -np.ones(fcoords1.shape[:-1], dtype=int)
+    fcoords2 = fcoords2 - np.floor(fcoords2)
+    #Points within tol of a cell face also have to be found through their
+    #images in the neighboring cells.
+    near = np.nonzero(np.logical_or(fcoords2 < tol, fcoords2 > 1 - tol).any(axis=1))[0]
+    points = [fcoords2]
+    indices = [np.arange(len(fcoords2))]
+    if len(near):
+        for shift in itertools.product([-1, 0, 1], repeat=3):
+            if shift != (0, 0, 0):
+                points.append(fcoords2[near] + shift)
+                indices.append(near)
+    indices = np.concatenate(indices + [[-1]])
+    tree = cKDTree(np.concatenate(points))
+    queries = fcoords1.reshape((-1, 3))
+    queries = queries - np.floor(queries)
+    (dist, found) = tree.query(queries, p=np.inf, distance_upper_bound=tol)
+    #Points without a match within tol get index tree.n, i.e., -1.
+    return indices[found].reshape(fcoords1.shape[:-1])
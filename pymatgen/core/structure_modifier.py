@@ -221,11 +221,12 @@ class StructureEditor(StructureModifier):
             symmop:
                 Symmetry operation to apply.
         """
-        self._lattice = Lattice([symmop.apply_rotation_only(row) for row in self._lattice.matrix])
-        def operate_site(site):
-            new_cart = symmop.operate(site.coords)
-            return PeriodicSite(site.species_and_occu, self._lattice.get_fractional_coords(new_cart), self._lattice)
-        self._sites = map(operate_site, self._sites)
+        self._lattice = Lattice(np.dot(self._lattice.matrix, symmop.rotation_matrix.transpose()))
+        if len(self._sites) == 0:
+            return
+        new_cart = symmop.operate_multi([site.coords for site in self._sites])
+        new_frac = self._lattice.get_fractional_coords(new_cart)
+        self._sites = [PeriodicSite(site.species_and_occu, fcoords, self._lattice) for site, fcoords in zip(self._sites, new_frac)]
 
     def modify_lattice(self, new_lattice):
         """
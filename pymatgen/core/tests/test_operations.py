@@ -1,7 +1,8 @@
 #!/usr/bin/python
 
 import unittest
-from pymatgen.core.operations import SymmOp
+from pymatgen.core.operations import SymmOp, SymmOpSet, periodic_match, \
+    find_periodic_images
 import numpy as np
 
 class  SymmOpTestCase(unittest.TestCase):
@@ -44,6 +45,69 @@ class  SymmOpTestCase(unittest.TestCase):
         newcoord = self.op.operate(point)
         self.assertTrue(op.are_symmetrically_related(point, newcoord))
 
+    def test_operate_multi(self):
+        points = np.random.rand(5, 3)
+        newcoords = self.op.operate_multi(points)
+        for point, newcoord in zip(points, newcoords):
+            self.assertTrue(np.allclose(self.op.operate(point), newcoord))
+
+
+class SymmOpSetTestCase(unittest.TestCase):
+
+    def setUp(self):
+        #Operations of P-1 and a mirror.
+        rots = [np.eye(3), -np.eye(3), np.diag([1, 1, -1])]
+        trans = [[0, 0, 0], [0, 0, 0], [0, 0, 0.5]]
+        self.opset = SymmOpSet(rots, trans)
+
+    def test_from_symmops(self):
+        opset = SymmOpSet.from_symmops(self.opset.symmops)
+        self.assertEqual(len(opset), 3)
+        self.assertTrue(np.allclose(opset.rotations, self.opset.rotations))
+        self.assertTrue(np.allclose(opset.translations, self.opset.translations))
+        self.assertEqual(opset[1], SymmOp.from_rotation_matrix_and_translation_vector(-np.eye(3)))
+
+    def test_operate(self):
+        points = np.random.rand(4, 3)
+        newcoords = self.opset.operate(points)
+        self.assertEqual(newcoords.shape, (3, 4, 3))
+        for op, opcoords in zip(self.opset, newcoords):
+            for point, newcoord in zip(points, opcoords):
+                self.assertTrue(np.allclose(op.operate(point), newcoord))
+        self.assertEqual(self.opset.operate([0.1, 0.2, 0.3]).shape, (3, 3))
+
+    def test_get_orbit(self):
+        self.assertEqual(len(self.opset.get_orbit([0.1, 0.2, 0.3])), 3)
+        self.assertEqual(len(self.opset.get_orbit([0, 0, 0.25])), 2)
+        self.assertEqual(len(self.opset.get_orbit([0, 0, 0])), 2)
+
+    def test_get_site_permutations(self):
+        fcoords = [[0.1, 0.2, 0.3], [0.9, 0.8, 0.7], [0.5, 0.5, 0.5]]
+        perms = self.opset.get_site_permutations(fcoords)
+        self.assertEqual(perms.tolist(), [[0, 1, 2], [1, 0, 2], [-1, -1, -1]])
+
+    def test_are_symmetrically_equivalent(self):
+        fcoords = [[0.1, 0.2, 0.3], [0.9, 0.8, 0.7], [0.3, 0.2, 0.3]]
+        self.assertTrue(self.opset.are_symmetrically_equivalent(fcoords[:1], fcoords[1:2]))
+        self.assertTrue(self.opset.are_symmetrically_equivalent(fcoords[:1], [[0.1, 0.2, 1.2]]))
+        self.assertFalse(self.opset.are_symmetrically_equivalent(fcoords[:1], fcoords[2:]))
+
+    def test_find_periodic_images(self):
+        fcoords = np.random.rand(50, 3)
+        fcoords[:5] = [[0, 0, 0], [1 - 1e-9, 0.5, 0.5], [0.5, 0.999995, 1e-6],
+                       [0.3, 0.3, 0.3], [0.3, 0.3, 0.30002]]
+        images = np.array([fcoords + [1, -2, 3], np.random.rand(50, 3),
+                           fcoords[::-1] - 1e-6])
+        for tol in [1e-8, 1e-5, 1e-4]:
+            match = periodic_match(images, fcoords, tol)
+            inds = find_periodic_images(images, fcoords, tol)
+            self.assertEqual(inds.shape, (3, 50))
+            self.assertTrue(((inds >= 0) == match.any(axis=-1)).all())
+            for (m, i) in zip(match.reshape((-1, 50)), inds.flatten()):
+                if i >= 0:
+                    self.assertTrue(m[i])
+        self.assertEqual(find_periodic_images(fcoords, [], 0.1).tolist(), [-1] * 50)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,11 +1,21 @@
 #!/usr/bin/python
 import unittest
+import itertools
 import os
-
-from pymatgen.io.vaspio import Poscar, Potcar, Kpoints, Incar, Vasprun, Outcar, Oszicar, PotcarSingle
+import gzip
+import tempfile
+import json
+import shutil
+import warnings
+import threading
+
+from pymatgen.io.vaspio import Poscar, Xdatcar, Potcar, Kpoints, Incar, Vasprun, Outcar, Oszicar, update_oszicars, PotcarSingle, VasprunTail, Chgcar, Locpot, VolumetricData, Procar
 from pymatgen.core.lattice import Lattice
 from pymatgen.core.structure import Composition, Structure
+from pymatgen.electronic_structure.core import Spin
+from pymatgen.util.io_utils import SectionIndex
 from numpy import array
+import numpy as np
 
 import pymatgen
 
@@ -59,6 +69,23 @@ direct
         poscar = Poscar.from_string(poscar_string)
         self.assertEqual(poscar.selective_dynamics, [[True, True, True], [False, False, False]])
 
+        #Ragged coordinate lines whose total token count is a multiple of
+        #the first line's.
+        poscar_string = """Test4
+1.0
+3.840198 0.000000 0.000000
+1.920099 3.325710 0.000000
+0.000000 -2.217138 3.135509
+Si O
+1 2
+direct
+0.000000 0.000000 0.000000 Si
+0.500000 0.500000 0.500000
+0.250000 0.250000 0.250000 7.0 O"""
+        poscar = Poscar.from_string(poscar_string)
+        self.assertTrue(np.allclose([site.frac_coords for site in poscar.struct],
+                                    [[0, 0, 0], [0.5, 0.5, 0.5], [0.25, 0.25, 0.25]]))
+
     def test_str(self):
         si = 14
         coords = list()
@@ -82,6 +109,70 @@ direct
 
         self.assertEquals(str(poscar), expected_str, "Wrong POSCAR output!")
 
+        #Selective dynamics and cartesian coordinates.
+        poscar = Poscar(struct, selective_dynamics=[[True, False, True],
+                                                    [False, False, False]])
+        expected_str = '\n'.join(expected_str.split('\n')[:7]) + \
+            """
+Selective dynamics
+cartesian
+0.000000 0.000000 0.000000 T F T Si
+3.840198 0.000001 2.351632 F F F Si"""
+        self.assertEquals(poscar.get_string(direct=False), expected_str)
+        poscar = Poscar.from_string(expected_str)
+        self.assertEqual(poscar.selective_dynamics, [[True, False, True],
+                                                     [False, False, False]])
+        self.assertTrue(np.allclose(poscar.struct[1].frac_coords,
+                                    [0.75, 0.5, 0.75], atol=1e-6))
+
+class XdatcarTest(unittest.TestCase):
+
+    def setUp(self):
+        #Variable cell run with 3 frames, in which the c lattice parameter of
+        #frame i is 4 + i and the coordinates of site j are 0.1 * (i + j).
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir, 'XDATCAR')
+        lines = []
+        for i in xrange(3):
+            lines.extend(["LiO", "1.0", "4.0 0.0 0.0", "0.0 4.0 0.0",
+                          "0.0 0.0 %.1f" % (4 + i), "Li O", "1 1",
+                          "Direct configuration=     %d" % (i + 1)])
+            for j in xrange(2):
+                lines.append(" ".join(["%.8f" % (0.1 * (i + j))] * 3))
+        with open(self.filepath, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_init(self):
+        xdatcar = Xdatcar(self.filepath)
+        self.assertEqual(xdatcar.comment, "LiO")
+        self.assertEqual(xdatcar.site_symbols, ["Li", "O"])
+        self.assertEqual(xdatcar.natoms, [1, 1])
+        self.assertTrue(np.allclose(xdatcar.lattice.abc, 4))
+        frames = list(xdatcar.iter_frames())
+        self.assertEqual([m[2][2] for (m, coords) in frames], [4, 5, 6])
+        coords = xdatcar.get_frac_coords()
+        self.assertEqual(coords.shape, (3, 2, 3))
+        self.assertTrue(np.allclose(coords[2, 1], 0.3))
+        structures = list(xdatcar.iter_structures())
+        self.assertEqual(structures[-1].composition,
+                         Composition.from_formula("LiO"))
+        self.assertAlmostEqual(structures[-1].volume, 96)
+
+    def test_ragged(self):
+        #Extra columns on some coordinate lines are ignored.
+        with open(self.filepath) as f:
+            lines = f.read().split("\n")
+        lines[8] += " 0.7"
+        lines[19] += " 0.8 0.9"
+        with open(self.filepath, "w") as f:
+            f.write("\n".join(lines))
+        coords = Xdatcar(self.filepath).get_frac_coords()
+        self.assertTrue(np.allclose(coords[:, 0], [[0] * 3, [0.1] * 3, [0.2] * 3]))
+        self.assertTrue(np.allclose(coords[:, 1], [[0.1] * 3, [0.2] * 3, [0.3] * 3]))
+
 class  IncarTest(unittest.TestCase):
 
     def test_init(self):
@@ -217,6 +308,43 @@ class PotcarTest(unittest.TestCase):
         potcar = Potcar(["V"], sym_potcar_map={"V": fe_potcar})
         self.assertEqual(potcar.symbols, ["Fe"], "Wrong symbols read in for POTCAR")
 
+    def test_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        psp_dir = os.environ.get("VASP_PSP_DIR")
+        os.environ["VASP_PSP_DIR"] = tmpdir
+        try:
+            os.mkdir(os.path.join(tmpdir, "POT_GGA_PAW_PBE"))
+            potcar = Potcar.from_file(os.path.join(test_dir, 'POTCAR'))
+            for p in potcar:
+                f = gzip.open(os.path.join(tmpdir, "POT_GGA_PAW_PBE",
+                                           "POTCAR." + p.symbol + ".gz"), "wb")
+                f.write(str(p))
+                f.close()
+            self.assertEqual(Potcar.preload_potcars(symbols=["Fe"]), 1)
+            #Cached POTCARs are shared and not read from disk again.
+            os.remove(os.path.join(tmpdir, "POT_GGA_PAW_PBE", "POTCAR.Fe.gz"))
+            fe = Potcar.get_potcar_single("Fe")
+            self.assertIs(Potcar(["Fe", "O"])[0], fe)
+            self.assertEqual(str(Potcar(["Fe", "P", "O"])), str(potcar))
+            self.assertRaises(IOError, Potcar, ["Fe"], functional="LDA")
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(
+                Potcar.get_potcar_single("P"))) for i in xrange(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(len(set([id(p) for p in results])), 1)
+            self.assertEqual(Potcar.preload_potcars(), 3)
+            Potcar.clear_cache()
+            self.assertRaises(IOError, Potcar.get_potcar_single, "Fe")
+        finally:
+            if psp_dir is None:
+                del os.environ["VASP_PSP_DIR"]
+            else:
+                os.environ["VASP_PSP_DIR"] = psp_dir
+            shutil.rmtree(tmpdir)
+
 class VasprunTest(unittest.TestCase):
 
     def test_properties(self):
@@ -259,6 +387,199 @@ class VasprunTest(unittest.TestCase):
         self.assertTrue(vasprun_ggau.is_hubbard)
         self.assertEqual(vasprun_ggau.hubbards["Fe"], 4.3)
 
+    def test_parse_sections(self):
+        filepath = os.path.join(test_dir, 'vasprun.xml')
+        vasprun = Vasprun(filepath)
+        vasprun_min = Vasprun(filepath, parse_sections=[])
+        self.assertEqual(vasprun_min.final_energy, vasprun.final_energy)
+        self.assertEqual(vasprun_min.final_structure, vasprun.final_structure)
+        self.assertEqual(vasprun_min.initial_structure, vasprun.initial_structure)
+        self.assertEqual(vasprun_min.nionic_steps, 29)
+        self.assertEqual(vasprun_min.converged, vasprun.converged)
+        self.assertEqual(vasprun_min.potcar_symbols, vasprun.potcar_symbols)
+        #Skipped sections are parsed on first access.
+        self.assertNotIn('eigenvalue_array', vasprun_min.__dict__)
+        self.assertEqual(vasprun_min.eigenvalues, vasprun.eigenvalues)
+        self.assertAlmostEqual(vasprun_min.tdos.get_gap(), 2.0589, 4)
+        self.assertEqual(len(vasprun_min.pdos), len(vasprun.pdos))
+        self.assertEqual(len(vasprun_min.ionic_steps), 29)
+        self.assertEqual(len(vasprun_min.structures), len(vasprun.structures))
+        self.assertEqual(vasprun_min.to_dict, vasprun.to_dict)
+
+        vasprun_skip = Vasprun(filepath, 3, parse_sections=['dos'])
+        self.assertEqual(len(vasprun_skip.ionic_steps), int(len(vasprun.ionic_steps) / 3) + 1)
+        self.assertIsNotNone(vasprun_skip.pdos)
+        self.assertRaises(ValueError, Vasprun, filepath, parse_sections=['bands'])
+
+    def test_eigenvalue_and_pdos_arrays(self):
+        filepath = os.path.join(test_dir, 'vasprun.xml')
+        vasprun = Vasprun(filepath)
+        (nspin, nkpt, nband, ncol) = vasprun.eigenvalue_array.shape
+        self.assertEqual(nkpt, len(vasprun.actual_kpoints))
+        self.assertEqual(ncol, 2)
+        self.assertEqual(len(vasprun.eigenvalues), nspin * nkpt)
+        self.assertEqual(vasprun.eigenvalues[(nkpt, Spin.up)],
+                         vasprun.eigenvalue_array[0, -1].tolist())
+        self.assertRaises(KeyError, vasprun.eigenvalues.__getitem__,
+                          (nkpt + 1, Spin.up))
+        (nspin, natom, norb, nedos) = vasprun.pdos_array.shape
+        self.assertEqual(natom, len(vasprun.final_structure))
+        self.assertEqual(nedos, len(vasprun.dos_energies))
+        self.assertEqual(len(vasprun.pdos), natom)
+        self.assertEqual(len(vasprun.pdos[-1]), norb)
+        self.assertTrue(np.array_equal(vasprun.pdos[1][2].densities[Spin.up],
+                                       vasprun.pdos_array[0, 1, 2]))
+        site_dos = vasprun.complete_dos.get_site_dos(vasprun.final_structure[1])
+        self.assertTrue(np.allclose(site_dos.densities[Spin.up],
+                                    vasprun.pdos_array[0, 1].sum(axis=0)))
+
+    def test_iterparse(self):
+        for f in ['vasprun.xml', 'lifepo4.xml']:
+            filepath = os.path.join(test_dir, f)
+            vasprun = Vasprun(filepath)
+            vasprun_iter = Vasprun(filepath, parser="iterparse")
+            self.assertEqual(vasprun_iter.to_dict, vasprun.to_dict)
+            self.assertEqual(vasprun_iter.structures, vasprun.structures)
+            self.assertTrue(np.array_equal(vasprun_iter.tdos.energies, vasprun.tdos.energies))
+            for spin, dos in vasprun.tdos.densities.items():
+                self.assertTrue(np.array_equal(vasprun_iter.tdos.densities[spin], dos))
+            for (pdos, pdos_iter) in zip(vasprun.pdos, vasprun_iter.pdos):
+                for (orbital_dos, orbital_dos_iter) in zip(pdos, pdos_iter):
+                    for spin, dos in orbital_dos.densities.items():
+                        self.assertTrue(np.array_equal(orbital_dos_iter.densities[spin], dos))
+        self.assertRaises(ValueError, Vasprun, filepath, parser="dom")
+
+    def test_iter_ionic_steps(self):
+        filepath = os.path.join(test_dir, 'vasprun.xml')
+        vasprun = Vasprun(filepath)
+        steps = list(Vasprun.iter_ionic_steps(filepath))
+        self.assertEqual(len(steps), 29)
+        self.assertEqual(steps[-1]['structure'], vasprun.final_structure)
+        self.assertEqual(steps[-1]['electronic_steps'], vasprun.ionic_steps[-1]['electronic_steps'])
+        steps = list(Vasprun.iter_ionic_steps(filepath, start=2, stop=20, step=4))
+        self.assertEqual([s['electronic_steps'] for s in steps],
+                         [s['electronic_steps'] for s in vasprun.ionic_steps[2:20:4]])
+        self.assertRaises(ValueError, list,
+                          Vasprun.iter_ionic_steps(filepath, step=0))
+
+    def test_save_trajectory(self):
+        filepath = os.path.join(test_dir, 'vasprun.xml')
+        vasprun = Vasprun(filepath)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            output = os.path.join(tmpdir, 'traj.npz')
+            self.assertEqual(Vasprun.save_trajectory(filepath, output, step=2), 15)
+            data = np.load(output)
+            self.assertEqual(data['frac_coords'].shape, (15, 25, 3))
+            self.assertEqual(list(data['steps']), range(0, 29, 2))
+            self.assertAlmostEqual(data['energies'][-1], vasprun.final_energy)
+            self.assertTrue(np.allclose(data['forces'][0], vasprun.ionic_steps[0]['forces']))
+            output = os.path.join(tmpdir, 'empty.npz')
+            self.assertRaises(ValueError, Vasprun.save_trajectory, filepath,
+                              output, start=100)
+            self.assertRaises(ValueError, Vasprun.save_trajectory, filepath,
+                              output, step=-1)
+            self.assertFalse(os.path.exists(output))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_use_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(tmpdir, 'vasprun.xml')
+            shutil.copy(os.path.join(test_dir, 'vasprun.xml'), filepath)
+            vasprun = Vasprun(filepath)
+            cache_filename = Vasprun.get_cache_filename(filepath)
+            self.assertFalse(os.path.exists(cache_filename))
+            Vasprun(filepath, use_cache=True)
+            self.assertTrue(os.path.exists(cache_filename))
+            cached = Vasprun(filepath, use_cache=True)
+            self.assertIsNotNone(cached._cache)
+            self.assertEqual(cached.final_energy, vasprun.final_energy)
+            self.assertEqual(cached.final_structure, vasprun.final_structure)
+            self.assertEqual(cached.incar, vasprun.incar)
+            self.assertEqual(cached.nionic_steps, vasprun.nionic_steps)
+            self.assertEqual(cached.structures, vasprun.structures)
+            self.assertTrue(np.allclose(cached.ionic_steps[3]['forces'],
+                                        vasprun.ionic_steps[3]['forces']))
+            self.assertEqual(cached.eigenvalues, vasprun.eigenvalues)
+            self.assertTrue(np.allclose(cached.complete_dos.get_densities(),
+                                        vasprun.complete_dos.get_densities()))
+            self.assertTrue(np.allclose(cached.pdos[0][1].get_densities(),
+                                        vasprun.pdos[0][1].get_densities()))
+            self.assertEqual(cached.to_dict, vasprun.to_dict)
+            #The cache holds no pickles, only json and plain arrays.
+            cache = np.load(cache_filename)
+            self.assertEqual(json.loads(cache['metadata'].tostring())['nionic_steps'],
+                             vasprun.nionic_steps)
+            self.assertFalse(any([cache[k].dtype.hasobject for k in cache.files]))
+            cache.close()
+            #A different ionic_step_skip or modified file invalidates the cache.
+            self.assertIsNone(Vasprun(filepath, ionic_step_skip=2,
+                                      use_cache=True)._cache)
+            with open(filepath, 'a') as f:
+                f.write("\n")
+            self.assertIsNone(Vasprun(filepath, use_cache=True)._cache)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_use_index(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(tmpdir, 'vasprun.xml')
+            shutil.copy(os.path.join(test_dir, 'vasprun.xml'), filepath)
+            vasprun = Vasprun(filepath, parse_sections=[])
+            for i in xrange(2):
+                indexed = Vasprun(filepath, parse_sections=[], use_index=True)
+                self.assertTrue(os.path.exists(SectionIndex.get_index_filename(filepath)))
+                self.assertEqual(indexed.final_energy, vasprun.final_energy)
+                self.assertEqual(indexed.nionic_steps, vasprun.nionic_steps)
+                self.assertEqual(indexed.structures, vasprun.structures)
+                self.assertTrue(np.allclose(indexed.ionic_steps[3]['forces'],
+                                            vasprun.ionic_steps[3]['forces']))
+        finally:
+            shutil.rmtree(tmpdir)
+
+class VasprunTailTest(unittest.TestCase):
+
+    def test_init(self):
+        for f in ['vasprun.xml', 'lifepo4.xml']:
+            filepath = os.path.join(test_dir, f)
+            vasprun = Vasprun(filepath)
+            tail = VasprunTail(filepath, chunk_size=4096)
+            self.assertEqual(tail.final_energy, vasprun.final_energy)
+            self.assertEqual(tail.final_structure, vasprun.final_structure)
+            self.assertEqual(tail.parameters, vasprun.parameters)
+            self.assertEqual(tail.potcar_symbols, vasprun.potcar_symbols)
+            self.assertEqual(tail.hubbards, vasprun.hubbards)
+            self.assertEqual(tail.run_type, vasprun.run_type)
+
+    def test_compressed(self):
+        filepath = os.path.join(test_dir, 'vasprun.xml')
+        vasprun = Vasprun(filepath)
+        with open(filepath) as f:
+            data = f.read()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            #Single member, which has to be streamed.
+            gzpath = os.path.join(tmpdir, 'vasprun.xml.gz')
+            with gzip.open(gzpath, 'wb') as f:
+                f.write(data)
+            tail = VasprunTail(gzpath)
+            self.assertEqual(tail.final_energy, vasprun.final_energy)
+            self.assertEqual(tail.final_structure, vasprun.final_structure)
+            #Independently compressed members, as written by bgzip.
+            with open(gzpath, 'wb') as f:
+                for i in xrange(0, len(data), 65536):
+                    g = gzip.GzipFile(fileobj=f, mode='wb')
+                    g.write(data[i:i + 65536])
+                    g.close()
+            tail = VasprunTail(gzpath, chunk_size=4096)
+            self.assertEqual(tail.final_energy, vasprun.final_energy)
+            self.assertEqual(tail.final_structure, vasprun.final_structure)
+        finally:
+            shutil.rmtree(tmpdir)
+
 class OutcarTest(unittest.TestCase):
 
     def test_init(self):
@@ -281,6 +602,58 @@ class OutcarTest(unittest.TestCase):
         outcar = Outcar(filepath)
         self.assertTrue(outcar.is_stopped)
 
+    def test_parse_sections(self):
+        outcar_string = """ POSITION                                       TOTAL-FORCE (eV/Angst)
+ -----------------------------------------------------------------------------------
+      0.00000      0.00000      0.00000         0.100000      0.000000     -0.200000
+      1.80837      1.16785     -3.14487         0.033522     -1.611234      0.058296
+ -----------------------------------------------------------------------------------
+    total drift:                                0.000000      0.000000      0.000000
+
+  FREE ENERGIE OF THE ION-ELECTRON SYSTEM (eV)
+  ---------------------------------------------------
+  free  energy   TOTEN  =       -20.66323714 eV
+
+  energy  without entropy=      -20.66323000  energy(sigma->0) =      -20.66323500
+
+ total charge
+
+# of ion     s       p       d       tot
+----------------------------------------
+  1        0.416   0.151   6.224   6.790
+
+ MACROSCOPIC STATIC DIELECTRIC TENSOR (including local field effects in DFT)
+ ------------------------------------------------------
+           5.11226    -0.00000     0.00000
+          -0.00000     5.11226     0.00000
+           0.00000     0.00000     6.22222
+ ------------------------------------------------------
+   Spin component 1  e<r>_ev=(  0.12300E+01  0.45600E+00 -0.78900E+00 )
+ e<r>_bp=(  0.11100E+01  0.22200E+00  0.33300E+00 )
+   Spin component 2  e<r>_ev=(  0.10000E+01  0.20000E+00 -0.30000E+00 )
+ e<r>_bp=(  0.40000E+00  0.50000E+00  0.60000E+00 )
+"""
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(tmpdir, 'OUTCAR')
+            with open(filepath, 'w') as f:
+                f.write(outcar_string)
+            outcar = Outcar(filepath, parse_sections=["charge", "ionic_steps", "lepsilon"])
+            self.assertEqual(outcar.charge, ({'s': 0.416, 'p': 0.151, 'd': 6.224, 'tot': 6.790},))
+            self.assertFalse(hasattr(outcar, "magnetization"))
+            self.assertEqual(outcar.forces.shape, (1, 2, 3))
+            self.assertAlmostEqual(outcar.forces[0, 1, 1], -1.611234)
+            self.assertAlmostEqual(outcar.positions[0, 1, 2], -3.14487)
+            self.assertAlmostEqual(outcar.ionic_energies["e_fr_energy"][0], -20.66323714)
+            self.assertAlmostEqual(outcar.ionic_energies["e_0_energy"][0], -20.663235)
+            self.assertAlmostEqual(outcar.dielectric_tensor[2, 2], 6.22222)
+            outcar.read_igpar()
+            self.assertTrue(np.allclose(outcar.er_ev_tot, [2.23, 0.656, -1.089]))
+            self.assertTrue(np.allclose(outcar.er_bp[Spin.down], [0.4, 0.5, 0.6]))
+            self.assertRaises(ValueError, Outcar, filepath, parse_sections=["dos"])
+        finally:
+            shutil.rmtree(tmpdir)
+
 class OszicarTest(unittest.TestCase):
 
     def test_init(self):
@@ -290,6 +663,264 @@ class OszicarTest(unittest.TestCase):
         self.assertEqual(len(oszicar.all_energies), 60)
         self.assertAlmostEqual(oszicar.final_energy, -526.63928)
 
+    def test_update(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(tmpdir, 'OSZICAR')
+            header = "       N       E                     dE             d eps" \
+                "       ncg     rms          rms(c)\n"
+            with open(filepath, 'w') as f:
+                f.write(header)
+                f.write("DAV:   1    -0.20E+03   -0.20E+03   -0.12E+04  1224   "
+                        "0.13E+03\n")
+                f.write("DAV:   2    -0.21E+03   -0.10E+02   -0.12E+02  1224")
+            oszicar = Oszicar(filepath)
+            other = Oszicar(filepath)
+            self.assertEqual(oszicar.electronic_step_counts.tolist(), [1])
+            self.assertEqual(oszicar.electronic_dE.tolist(), [-200])
+            self.assertEqual(oszicar.update(), 0)
+            #The incomplete line is parsed once it has been written.
+            with open(filepath, 'a') as f:
+                f.write("   0.13E+02\n")
+                f.write("   1 F= -.21E+03 E0= -.21E+03  d E =-.21E+03\n")
+                f.write("DAV:   1    -0.22E+03   -0.10E+02   -0.12E+04  1224   "
+                        "0.13E+03\n")
+            self.assertEqual(oszicar.update(), 3)
+            self.assertEqual(oszicar.electronic_step_counts.tolist(), [2, 1])
+            self.assertEqual(oszicar.electronic_steps[0][1]['ncg'], 1224)
+            self.assertEqual(oszicar.ionic_dE.tolist(), [-210])
+            self.assertEqual(oszicar.electronic_dE.tolist(), [-10])
+            self.assertEqual(oszicar.final_energy, -210)
+            self.assertEqual(update_oszicars([oszicar, other]), [other])
+            self.assertEqual(other.electronic_steps, oszicar.electronic_steps)
+            #A restarted run is parsed from the start.
+            os.remove(filepath)
+            with warnings.catch_warnings(record=True) as w:
+                warnings.simplefilter("always")
+                self.assertEqual(update_oszicars([oszicar]), [])
+                self.assertEqual(len(w), 1)
+            with open(filepath, 'w') as f:
+                f.write(header)
+            self.assertEqual(oszicar.update(), 1)
+            self.assertEqual(oszicar.electronic_steps, [])
+            self.assertEqual(oszicar.ionic_steps, [])
+            #A run restarted in place, i.e., truncated and rewritten past the
+            #previous offset with the same inode, is also parsed again.
+            with open(filepath, 'a') as f:
+                for n in xrange(1, 5):
+                    f.write("DAV:   %d    -0.10E+03   -0.10E+02   -0.12E+02  "
+                            "1224   0.13E+02\n" % n)
+                f.write("   1 F= -.10E+03 E0= -.10E+03  d E =-.10E+03\n")
+            oszicar.update()
+            self.assertEqual(oszicar.electronic_step_counts.tolist(), [4])
+            inode = os.stat(filepath).st_ino
+            with open(filepath, 'r+') as f:
+                f.truncate(0)
+                f.write(header)
+                for n in xrange(1, 6):
+                    f.write("DAV:   %d    -0.20E+03   -0.20E+02   -0.12E+02  "
+                            "1224   0.13E+03\n" % n)
+                f.write("   1 F= -.20E+03 E0= -.20E+03  d E =-.20E+03\n")
+            self.assertEqual(os.stat(filepath).st_ino, inode)
+            oszicar.update()
+            fresh = Oszicar(filepath)
+            self.assertEqual(oszicar.ionic_steps, fresh.ionic_steps)
+            self.assertEqual(oszicar.electronic_step_counts.tolist(), [5])
+            self.assertEqual(oszicar.electronic_steps, fresh.electronic_steps)
+        finally:
+            shutil.rmtree(tmpdir)
+
+class ChgcarTest(unittest.TestCase):
+
+    def setUp(self):
+        #Small spin polarized CHGCAR with the grid index as the total density
+        #and the negative grid index as the magnetization density.
+        self.tmpdir = tempfile.mkdtemp()
+        lines = ["LiO", "1.0", "4.0 0.0 0.0", "0.0 4.0 0.0", "0.0 0.0 4.0",
+                 "Li O", "1 1", "Direct", "0.0 0.0 0.0", "0.5 0.5 0.5", ""]
+        for sign in [1, -1]:
+            lines.append("    2    3    4")
+            values = ["{:.11E}".format(sign * i) for i in xrange(24)]
+            for i in xrange(0, 24, 5):
+                lines.append(" ".join(values[i:i + 5]))
+            lines.append("augmentation occupancies   1   2")
+            lines.append("  0.1234567E+00 -0.1234567E-01")
+        self.filepath = os.path.join(self.tmpdir, 'CHGCAR')
+        with open(self.filepath, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        with open(self.filepath, 'rb') as f_in:
+            f_out = gzip.open(self.filepath + '.gz', 'wb')
+            f_out.write(f_in.read())
+            f_out.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_init(self):
+        for filepath in [self.filepath, self.filepath + '.gz']:
+            chgcar = Chgcar(filepath)
+            self.assertEqual(chgcar.dim, (2, 3, 4))
+            self.assertEqual(chgcar.ngridpts, 24)
+            self.assertTrue(chgcar.spinpolarized)
+            self.assertEqual(chgcar.poscar.struct.composition, Composition.from_formula("LiO"))
+            expected = np.arange(24, dtype=float).reshape((2, 3, 4), order='F')
+            self.assertEqual(chgcar.data[Spin.down][1, 2, 3], 23)
+            self.assertTrue(np.array_equal(chgcar.data[Spin.up], np.zeros((2, 3, 4))))
+            self.assertTrue(np.array_equal(chgcar.data[Spin.down], expected))
+
+    def test_write_file(self):
+        chgcar = Chgcar(self.filepath)
+        filepath = os.path.join(self.tmpdir, 'CHGCAR.out')
+        chgcar.write_file(filepath, chunk_size=7)
+        chgcar2 = Chgcar(filepath)
+        self.assertEqual(chgcar2.poscar.struct, chgcar.poscar.struct)
+        for spin in [Spin.up, Spin.down]:
+            self.assertTrue(np.array_equal(chgcar2.data[spin], chgcar.data[spin]))
+
+    def test_binary(self):
+        chgcar = Chgcar(self.filepath)
+        filepath = os.path.join(self.tmpdir, 'CHGCAR.npz')
+        chgcar.write_binary(filepath)
+        chgcar2 = VolumetricData.from_binary(filepath)
+        self.assertIsInstance(chgcar2, Chgcar)
+        self.assertEqual(chgcar2.dim, (2, 3, 4))
+        self.assertEqual(chgcar2.ngridpts, 24)
+        self.assertTrue(chgcar2.spinpolarized)
+        self.assertEqual(chgcar2.poscar.struct, chgcar.poscar.struct)
+        for spin in [Spin.up, Spin.down]:
+            self.assertIsInstance(chgcar2.data[spin], np.memmap)
+            self.assertTrue(np.array_equal(chgcar2.data[spin], chgcar.data[spin]))
+        self.assertEqual(chgcar2.data[Spin.down][1, 2, 3], 23)
+        diff = chgcar2 - chgcar
+        self.assertIsInstance(diff, Chgcar)
+        self.assertTrue(np.array_equal(diff.data[Spin.down], np.zeros((2, 3, 4))))
+
+    def test_get_diff_int_charge(self):
+        chgcar = Chgcar(self.filepath)
+        struct = chgcar.poscar.struct
+        for radius in [0.5, 1.5, 2.5, 5.0]:
+            charges = chgcar.get_diff_int_charges(radius)
+            for ind in xrange(len(struct)):
+                expected = 0
+                for (x, y, z) in itertools.product(xrange(2), xrange(3), xrange(4)):
+                    fcoords = [x / 2.0, y / 3.0, z / 4.0]
+                    if struct[ind].distance_and_image_from_frac_coords(fcoords)[0] < radius:
+                        expected -= x + 2 * y + 6 * z
+                self.assertAlmostEqual(chgcar.get_diff_int_charge(ind, radius), expected / 24.0)
+                self.assertAlmostEqual(charges[ind], expected / 24.0)
+        self.assertEqual(len(chgcar.get_diff_int_charges(1.5, indices=[1])), 1)
+
+    def test_get_bader_charges(self):
+        chgcar = Chgcar(self.filepath)
+        #The only density maximum is at grid point (1, 2, 3), nearest to O.
+        partition = chgcar.get_bader_partition()
+        self.assertEqual(partition.shape, (2, 3, 4))
+        self.assertTrue(np.all(partition == 1))
+        charges = chgcar.get_bader_charges()
+        self.assertAlmostEqual(charges[0], 0)
+        self.assertAlmostEqual(charges[1], 276 / 24.0)
+
+    def test_profiles(self):
+        data = VolumetricData(self.filepath)
+        expected = 2.5 + 6 * np.arange(4)
+        self.assertTrue(np.allclose(data.get_average_along_axis(2), expected))
+        locpot = Locpot(self.filepath)
+        avg = locpot.get_avg_potential_along_axis(2)
+        self.assertEqual(avg.shape, (4, 1))
+        self.assertTrue(np.allclose(avg[:, 0], expected))
+        (distances, averages) = data.get_planar_average((0, 0, 1))
+        self.assertTrue(np.allclose(distances, [0, 1, 2, 3]))
+        self.assertTrue(np.allclose(averages, expected))
+        (distances, averages) = data.get_planar_average((0, 1, 1))
+        self.assertEqual(len(distances), 12)
+        self.assertAlmostEqual(np.mean(averages), 11.5)
+        (distances, averages) = data.get_macroscopic_average((0, 0, 1), 4.0)
+        self.assertTrue(np.allclose(averages, 11.5))
+        (distances, averages) = data.get_macroscopic_average((0, 0, 1), 1.0)
+        self.assertTrue(np.allclose(averages, expected))
+        (distances, averages) = data.get_radial_profile(0, 1.5, nbins=3)
+        self.assertTrue(np.allclose(distances, [0.25, 0.75, 1.25]))
+        self.assertEqual(averages[0], 0)
+        self.assertTrue(np.isnan(averages[1]))
+        self.assertAlmostEqual(averages[2], 7.5)
+
+class ProcarTest(unittest.TestCase):
+
+    def setUp(self):
+        #Spin polarized PROCAR with 2 k-points, 2 bands and 2 ions, with
+        #the projection onto orbital j of ion i of band b set to
+        #spin + b + 0.1 * i + 0.01 * j.
+        self.tmpdir = tempfile.mkdtemp()
+        orbitals = ["s", "py", "pz", "px", "dxy", "dyz", "dz2", "dxz", "dx2"]
+        lines = ["PROCAR lm decomposed"]
+        for spin in range(2):
+            lines.append("# of k-points:  2         # of bands:   2         "
+                         "# of ions:   2")
+            for (k, coords) in enumerate(["0.00000000-0.50000000 0.25000000",
+                                          "0.50000000 0.50000000 0.00000000"]):
+                lines.extend(["", " k-point    %d :    %s     weight = 0.50000000"
+                              % (k + 1, coords), ""])
+                for b in range(2):
+                    lines.extend(["band   %d # energy  %.8f # occ.  %.8f"
+                                  % (b + 1, b - 1 + spin, 1 - b), "",
+                                  "ion " + " ".join(orbitals) + " tot"])
+                    for i in range(2):
+                        proj = [spin + b + 0.1 * i + 0.01 * j for j in range(9)]
+                        lines.append(" ".join(["%d" % (i + 1)] +
+                                              ["%.3f" % p for p in proj] +
+                                              ["%.3f" % sum(proj)]))
+                    lines.extend(["tot" + " 0.000" * 10, ""])
+        self.filepath = os.path.join(self.tmpdir, "PROCAR")
+        with open(self.filepath, "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_init(self):
+        procar = Procar(self.filepath)
+        self.assertEqual(procar.name, "PROCAR lm decomposed")
+        self.assertEqual(procar.orbitals[4], "dxy")
+        self.assertEqual(procar.projections.shape, (2, 2, 2, 2, 9))
+        self.assertTrue(np.allclose(procar.kpoints, [[0, -0.5, 0.25],
+                                                     [0.5, 0.5, 0]]))
+        self.assertTrue(np.allclose(procar.weights, [0.5, 0.5]))
+        self.assertTrue(np.allclose(procar.eigenvalues[1, 0], [0, 1]))
+        self.assertTrue(np.allclose(procar.occupations[0, 1], [1, 0]))
+        self.assertAlmostEqual(procar.projections[1, 0, 1, 1, 2], 2.12)
+        self.assertAlmostEqual(procar.data[2][0], 3.2)
+        self.assertAlmostEqual(procar.data[2][9], 3.2 * 9 + 0.72)
+        self.assertAlmostEqual(procar.get_d_occupation(1), 3 * 5 + 0.6)
+        weights = procar.get_fatband_weights(ions=[0], orbitals=["s", "px"])
+        self.assertEqual(weights.shape, (2, 2, 2))
+        self.assertTrue(np.allclose(weights[0, :, 1], 2.03))
+        self.assertTrue(np.allclose(procar.get_fatband_weights(),
+                                    procar.projections.sum(axis=(3, 4))))
+
+    def test_x2_y2(self):
+        #Newer VASP versions name the last d orbital x2-y2.
+        with open(self.filepath) as f:
+            contents = f.read()
+        with open(self.filepath, "w") as f:
+            f.write(contents.replace(" dx2 ", " x2-y2 "))
+        procar = Procar(self.filepath)
+        self.assertEqual(procar.orbitals[8], "x2-y2")
+        self.assertAlmostEqual(procar.get_d_occupation(1), 3 * 5 + 0.6)
+        self.assertTrue(np.allclose(procar.get_fatband_weights(orbitals="d"),
+                                    procar.projections[..., 4:9].sum(axis=(3, 4))))
+
+    def test_storage(self):
+        procar = Procar(self.filepath)
+        for kwargs in [{"use_index": True}, {"use_index": True},
+                       {"dtype": np.float32},
+                       {"mmap_filename": os.path.join(self.tmpdir, "proj")}]:
+            other = Procar(self.filepath, **kwargs)
+            self.assertTrue(np.allclose(other.projections, procar.projections))
+        self.assertEqual(other.projections.dtype, np.float64)
+        self.assertIsInstance(other.projections, np.memmap)
+        self.assertEqual(Procar(self.filepath, dtype=np.float32)
+                         .projections.dtype, np.float32)
+
 if __name__ == '__main__':
     unittest.main()
 
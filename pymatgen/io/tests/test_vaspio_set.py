@@ -23,6 +23,11 @@ class MITMaterialsProjectVaspInputSetTest(unittest.TestCase):
         self.mithseparamset = MITHSEVaspInputSet()
         self.paramset = MaterialsProjectVaspInputSet()
 
+    def test_shared_config(self):
+        self.assertIs(MITVaspInputSet()._config, self.paramset._config)
+        self.assertIsNot(MITVaspInputSet().incar_settings,
+                         self.mitparamset.incar_settings)
+
     def test_get_potcar_symbols(self):
         syms = self.paramset.get_potcar_symbols(self.struct)
         self.assertEquals(syms, ['Fe_pv', 'P', 'O'])
@@ -23,6 +23,17 @@ import itertools
 import warnings
 import xml.sax.handler
 import StringIO
+import zlib
+import bz2
+import tempfile
+import json
+import threading
+from fractions import gcd
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+import collections
 from collections import defaultdict
 import ConfigParser
 
@@ -32,17 +43,39 @@ from numpy.linalg import det
 from pymatgen.core.design_patterns import Enum
 from pymatgen.io.io_abc import VaspInput
 from pymatgen.util.string_utils import str_aligned, str_delimited
-from pymatgen.util.io_utils import file_open_zip_aware, clean_lines, micro_pyawk, clean_json
+from pymatgen.util.io_utils import file_open_zip_aware, clean_lines, clean_json, \
+    load_npz_mmap, get_file_sha1, NpzRowWriter, SectionIndex
 from pymatgen.core.structure import Structure, Composition
-from pymatgen.core.periodic_table import Element
+from pymatgen.core.periodic_table import Element, smart_element_or_specie
 from pymatgen.electronic_structure.core import Spin, Orbital
 from pymatgen.electronic_structure.dos import CompleteDos, Dos, PDos
 from pymatgen.electronic_structure.band_structure.band_structure import BandStructureSymmLine, get_reconstructed_band_structure
 from pymatgen.core.lattice import Lattice
 import pymatgen
 
+#Version of the binary cache written by Vasprun with use_cache=True. Caches
+#with a different version are ignored.
+_CACHE_VERSION = 3
+
 coord_pattern = re.compile("^\s*([\d+\.\-Ee]+)\s+([\d+\.\-Ee]+)\s+([\d+\.\-Ee]+)")
 
+
+def _read_coord_table(lines):
+    """
+    Splits a block of coordinate lines into a 2D numpy array of strings, with
+    one row per line. If the lines have different numbers of columns, only the
+    columns common to all lines are kept.
+    """
+    if not lines:
+        return np.zeros((0, 3), dtype=str)
+    rows = [l.split() for l in lines]
+    lengths = set([len(row) for row in rows])
+    if len(lengths) == 1:
+        return np.array(rows)
+    ncols = min(lengths)
+    return np.array([row[:ncols] for row in rows])
+
+
 class Poscar(VaspInput):
     """
     Object for representing the data in a POSCAR or CONTCAR file.
@@ -130,15 +163,7 @@ class Poscar(VaspInput):
             Poscar object.
         """
 
-        dirname = os.path.dirname(os.path.abspath(filename))
-        names = None
-        for f in os.listdir(dirname):
-            if f == "POTCAR":
-                try:
-                    potcar = Potcar.from_file(os.path.join(dirname, f))
-                    names = [sym.split("_")[0] for sym in potcar.symbols]
-                except:
-                    names = None
+        names = _get_potcar_names(filename)
         with file_open_zip_aware(filename, "r") as f:
             return Poscar.from_string(f.read(), names)
 
@@ -216,11 +241,14 @@ class Poscar(VaspInput):
                 vasp5_symbols = True
             except:
                 pass
+        #Read the coordinate block in bulk.
+        table = _read_coord_table(lines[ipos + 1:ipos + 1 + nsites])
+
         if not vasp5_symbols:
             ind = 3 if not sdynamics else 6
             try: #check if names are appended at the end of the POSCAR coordinates
-                atomic_symbols = [l.split()[ind] for l in lines[ipos + 1:ipos + 1 + nsites]]
-                [Element(sym) for sym in atomic_symbols] #Ensure symbols are valid elements
+                atomic_symbols = table[:, ind].tolist()
+                [Element(sym) for sym in set(atomic_symbols)] #Ensure symbols are valid elements
                 vasp5_symbols = True
             except:
                 #Defaulting to false names.
@@ -231,15 +259,16 @@ class Poscar(VaspInput):
                 warnings.warn("Elements in POSCAR cannot be determined. Defaulting to false names, " + " ".join(atomic_symbols) + ".")
 
         # read the atomic coordinates
-        coords = []
-        selective_dynamics = list() if sdynamics else None
-        for i in xrange(nsites):
-            toks = lines[ipos + 1 + i].split()
-            coords.append([float(s) for s in toks[:3]])
-            if sdynamics:
-                selective_dynamics.append([True if tok.upper()[0] == 'T' else False for tok in toks[3:6]])
+        coords = table[:, :3].astype(float)
+        selective_dynamics = None
+        if sdynamics:
+            flags = np.char.upper(table[:, 3:6])
+            selective_dynamics = np.char.startswith(flags, 'T').tolist()
 
-        struct = Structure(lattice, atomic_symbols, coords, False, False, cart)
+        #Convert each distinct symbol only once.
+        species = {sym: smart_element_or_specie(sym) for sym in set(atomic_symbols)}
+        struct = Structure(lattice, [species[sym] for sym in atomic_symbols],
+                           coords, False, False, cart)
 
         return Poscar(struct, comment, selective_dynamics, vasp5_symbols)
 
@@ -273,15 +302,21 @@ class Poscar(VaspInput):
             lines.append("Selective dynamics")
         lines.append('direct' if direct else 'cartesian')
 
-        for i in xrange(len(self._struct)):
-            site = self._struct[i]
-            coords = site.frac_coords if direct else site.coords
-            line = "%.6f %.6f %.6f" % (coords[0], coords[1], coords[2])
+        if len(self._struct) > 0:
+            coords = self._struct.frac_coords if direct else self._struct.cart_coords
+            columns = list(np.transpose(coords))
+            fmt = "%.6f %.6f %.6f"
             if self._selective_dynamics:
-                sd = ['T' if j else 'F' for j in self._selective_dynamics[i]]
-                line += " %s %s %s" % (sd[0], sd[1], sd[2])
-            line += " " + site.species_string
-            lines.append(line)
+                sd = np.array(self._selective_dynamics, dtype=bool)
+                columns.extend(np.where(sd, 'T', 'F').T)
+                fmt += " %s %s %s"
+            columns.append([site.species_string for site in self._struct])
+            fmt += " %s"
+            #Format the whole block at once.
+            table = np.empty((len(self._struct), len(columns)), dtype=object)
+            for (i, column) in enumerate(columns):
+                table[:, i] = column
+            lines.append("\n".join([fmt] * len(table)) % tuple(table.ravel()))
 
         return "\n".join(lines)
 
@@ -304,6 +339,101 @@ class Poscar(VaspInput):
         with open(filename, 'w') as f:
             f.write(str(self) + "\n")
 
+class Xdatcar(object):
+    """
+    Reader for a vasp 5 XDATCAR, which contains the coordinates of the sites
+    at every ionic step of a run. The frames are read one at a time and
+    returned as numpy arrays, so that long trajectories of large cells can be
+    processed without creating a Structure for every step. Runs with a
+    variable cell, in which the header is repeated before every frame, are
+    supported.
+
+    Attributes:
+        comment:
+            The first line of the XDATCAR.
+        lattice:
+            Lattice of the first frame.
+        site_symbols:
+            Symbols of the species, e.g., ["Li", "O"].
+        natoms:
+            Number of sites of each species, e.g., [2, 1].
+    """
+
+    def __init__(self, filename):
+        """
+        Args:
+            filename:
+                Filename of XDATCAR. May be gzipped or bzipped.
+        """
+        self.filename = filename
+        with file_open_zip_aware(filename, "r") as f:
+            header = [f.readline() for i in xrange(7)]
+        (self.comment, self.lattice, self.site_symbols, self.natoms) = \
+            Xdatcar._parse_header(header)
+
+    @staticmethod
+    def _parse_header(lines):
+        comment = lines[0].strip()
+        scale = float(lines[1])
+        lattice = np.array([[float(s) for s in line.split()]
+                            for line in lines[2:5]])
+        if scale < 0:
+            lattice *= (-scale / abs(det(lattice))) ** (1 / 3)
+        else:
+            lattice *= scale
+        return (comment, Lattice(lattice), lines[5].split(),
+                [int(s) for s in lines[6].split()])
+
+    def iter_frames(self):
+        """
+        Generator over the frames, which yields (lattice matrix, fractional
+        coordinates) of every ionic step, as a 3x3 and a (nsites, 3) numpy
+        array. Each block of coordinates is converted in bulk.
+        """
+        nsites = sum(self.natoms)
+        lattice = self.lattice
+        with file_open_zip_aware(self.filename, "r") as f:
+            header = []
+            for line in f:
+                if "configuration" not in line or \
+                        not re.match("\s*(direct|cartesian)", line, re.I):
+                    header.append(line)
+                    continue
+                if len(header) >= 7:
+                    lattice = Xdatcar._parse_header(header[-7:])[1]
+                header = []
+                block = list(itertools.islice(f, nsites))
+                coords = np.fromstring("".join(block), sep=" ")
+                #Only a block with exactly 3 columns on every line can be
+                #reshaped directly.
+                if coords.size == 3 * nsites and \
+                        all([len(l.split()) == 3 for l in block]):
+                    coords = coords.reshape((nsites, 3))
+                else:
+                    table = _read_coord_table(block)
+                    coords = table[:, :3].astype(float)
+                if line.strip()[0] in 'cC':
+                    coords = lattice.get_fractional_coords(coords)
+                yield (lattice.matrix, coords)
+
+    def get_frac_coords(self):
+        """
+        Returns the fractional coordinates of all frames as a (nframes,
+        nsites, 3) numpy array.
+        """
+        return np.array([coords for (matrix, coords) in self.iter_frames()])
+
+    def iter_structures(self):
+        """
+        Generator over the frames as Structures.
+        """
+        species = []
+        for (symbol, n) in zip(self.site_symbols, self.natoms):
+            species.extend([Element(symbol)] * n)
+        for (matrix, coords) in self.iter_frames():
+            yield Structure(Lattice(matrix), species, coords)
+
+
 """**Non-exhaustive** list of valid INCAR tags"""
 VALID_INCAR_TAGS = ('NGX', 'NGY', 'NGZ', 'NGXF', 'NGYF', 'NGZF', 'NBANDS',
                     'NBLK', 'SYSTEM', 'NWRITE', 'ENCUT', 'ENAUG', 'PREC',
@@ -954,6 +1084,12 @@ class Potcar(list, VaspInput):
                       'PW91':'POT_GGA_PAW_PW91'}
     DEFAULT_FUNCTIONAL = "PBE"
 
+    #Process-wide cache of {(psp dir, symbol): PotcarSingle}, and the psp dir
+    #read from pymatgen.cfg.
+    _potcar_cache = {}
+    _config_psp_dir = None
+    _cache_lock = threading.Lock()
+
     def __init__(self, symbols=None, functional=DEFAULT_FUNCTIONAL,
                  sym_potcar_map=None):
         """
@@ -1019,6 +1155,7 @@ class Potcar(list, VaspInput):
         Initialize the POTCAR from a set of symbols. Currently, the POTCARs can
         be fetched from a location specified in the environment variable 
         VASP_PSP_DIR or in a pymatgen.cfg or specified explicitly in a map.
+        POTCARs fetched from a location are cached (see get_potcar_single).
         
         Args:
             elements:
@@ -1034,19 +1171,96 @@ class Potcar(list, VaspInput):
             for el in elements:
                 self.append(PotcarSingle(sym_potcar_map[el]))
         else:
-            if 'VASP_PSP_DIR' in os.environ:
-                VASP_PSP_DIR = os.path.join(os.environ['VASP_PSP_DIR'], Potcar.functional_dir[functional])
-            else:
-                module_dir = os.path.dirname(pymatgen.__file__)
-                if not os.path.exists(os.path.join(module_dir, "pymatgen.cfg")):
-                    raise IOError("You have not set your VASP_PSP_DIR environment variable, or have a pymatgen.cfg file.")
-                config = ConfigParser.SafeConfigParser()
-                config.readfp(open(os.path.join(module_dir, "pymatgen.cfg")))
-                VASP_PSP_DIR = os.path.join(config.get('VASP', 'pspdir'), Potcar.functional_dir[functional])
             del self[:]
             for el in elements:
-                with file_open_zip_aware(os.path.join(VASP_PSP_DIR, "POTCAR." + el + ".gz"), 'rb') as f:
-                    self.append(PotcarSingle(f.read()))
+                self.append(Potcar.get_potcar_single(el, functional))
+
+    @staticmethod
+    def get_psp_dir(functional=DEFAULT_FUNCTIONAL):
+        """
+        Returns the directory containing the POTCARs of a functional, which is
+        located in the environment variable VASP_PSP_DIR or in a pymatgen.cfg.
+        The pymatgen.cfg is only read once per process.
+
+        Args:
+            functional:
+                The functional, e.g., "PBE".
+        """
+        if 'VASP_PSP_DIR' in os.environ:
+            psp_dir = os.environ['VASP_PSP_DIR']
+        else:
+            with Potcar._cache_lock:
+                if Potcar._config_psp_dir is None:
+                    module_dir = os.path.dirname(pymatgen.__file__)
+                    if not os.path.exists(os.path.join(module_dir, "pymatgen.cfg")):
+                        raise IOError("You have not set your VASP_PSP_DIR environment variable, or have a pymatgen.cfg file.")
+                    config = ConfigParser.SafeConfigParser()
+                    with open(os.path.join(module_dir, "pymatgen.cfg")) as f:
+                        config.readfp(f)
+                    Potcar._config_psp_dir = config.get('VASP', 'pspdir')
+                psp_dir = Potcar._config_psp_dir
+        return os.path.join(psp_dir, Potcar.functional_dir[functional])
+
+    @staticmethod
+    def get_potcar_single(symbol, functional=DEFAULT_FUNCTIONAL):
+        """
+        Returns the PotcarSingle of a POTCAR symbol from a process-wide
+        cache, which is safe to use from multiple threads. The POTCAR is read
+        from the directory given by get_psp_dir the first time it is needed,
+        and the same PotcarSingle is returned afterwards, i.e., it should not
+        be modified.
+
+        Args:
+            symbol:
+                POTCAR symbol, e.g., "Fe_pv".
+            functional:
+                The functional, e.g., "PBE".
+        """
+        key = (Potcar.get_psp_dir(functional), symbol)
+        with Potcar._cache_lock:
+            if key in Potcar._potcar_cache:
+                return Potcar._potcar_cache[key]
+        #Read outside the lock, so that other threads are not blocked by I/O.
+        with file_open_zip_aware(os.path.join(key[0], "POTCAR." + symbol + ".gz"), 'rb') as f:
+            potcar = PotcarSingle(f.read())
+        with Potcar._cache_lock:
+            return Potcar._potcar_cache.setdefault(key, potcar)
+
+    @staticmethod
+    def preload_potcars(functional=DEFAULT_FUNCTIONAL, symbols=None):
+        """
+        Loads POTCARs into the process-wide cache used by get_potcar_single,
+        e.g., before generating inputs for many structures.
+
+        Args:
+            functional:
+                The functional, e.g., "PBE".
+            symbols:
+                Sequence of POTCAR symbols to load. Defaults to None, which
+                loads every POTCAR in the directory of the functional.
+
+        Returns:
+            Number of POTCARs in the cache for the functional.
+        """
+        psp_dir = Potcar.get_psp_dir(functional)
+        if symbols is None:
+            matches = [re.match("POTCAR\.(.+)\.gz$", f)
+                       for f in sorted(os.listdir(psp_dir))]
+            symbols = [m.group(1) for m in matches if m]
+        for symbol in symbols:
+            Potcar.get_potcar_single(symbol, functional)
+        with Potcar._cache_lock:
+            return len([k for k in Potcar._potcar_cache if k[0] == psp_dir])
+
+    @staticmethod
+    def clear_cache():
+        """
+        Clears the cache of POTCARs and of the pymatgen.cfg, e.g., after the
+        POTCARs have been changed on disk.
+        """
+        with Potcar._cache_lock:
+            Potcar._potcar_cache.clear()
+            Potcar._config_psp_dir = None
 
 
 class Vasprun(object):
@@ -1071,17 +1285,23 @@ class Vasprun(object):
             Total dos calculated at the end of run.
         idos: 
             Integrated dos calculated at the end of run.
+        pdos_array:
+            Projected dos as a (nspin, natom, norb, nedos) numpy array, with
+            Spin.up first and orbitals in vasp order, or None if the run has
+            no projected dos.
         pdos: 
             List of list of PDos objects. Access as pdos[atomindex][orbitalindex]
+            The PDos objects are created from pdos_array on access.
         efermi: 
             Fermi energy
+        eigenvalue_array:
+            Final eigenvalues as a (nspin, nkpt, nband, 2) numpy array of
+            [eigenvalue, occu], with Spin.up first, or None if the run has
+            no eigenvalues.
         eigenvalues: 
-            Final eigenvalues as a dict of
-            {(kpoint index, Spin.up):[[eigenvalue, occu]]}. 
-            This representation is probably not ideal, but since this is not
-            used anywhere else for now, I leave it as such.
-            Future developers who need to work with this should refactored the
-            object into a sensible structure.
+            Read-only view of eigenvalue_array as a dict of
+            {(kpoint index, Spin.up):[[eigenvalue, occu]]}, with 1-based
+            kpoint indices.
         
         **Vasp inputs**
         
@@ -1121,17 +1341,50 @@ class Vasprun(object):
             Indicates if a run is a GGA+U run.
         hubbards:
             Returns the U values, if any, used in the run.
-            
+        nionic_steps:
+            Number of ionic steps in the run, including any that were skipped.
+
+    Parsing can be restricted to the sections of vasprun.xml that are actually
+    needed using the parse_sections argument. Sections that are not parsed are
+    dropped before they reach the sax parser, and are parsed on first access
+    of an attribute that depends on them by seeking back into the file, e.g.::
+
+        vasprun = Vasprun("vasprun.xml", parse_sections=[])
+        vasprun.final_energy #Fast. Only the final ionic step is parsed.
+        vasprun.tdos #Parses the dos section.
+
     Author: Shyue Ping Ong
     """
     supported_properties = ['lattice_rec', 'vasp_version', 'incar',
                             'parameters', 'potcar_symbols', 'atomic_symbols',
                             'kpoints', 'actual_kpoints', 'structures',
                             'actual_kpoints_weights', 'dos_energies',
-                            'eigenvalues', 'tdos', 'idos', 'pdos', 'efermi',
-                            'ionic_steps', 'dos_has_errors']
-
-    def __init__(self, filename, ionic_step_skip=None):
+                            'eigenvalue_array', 'tdos', 'idos', 'pdos_array',
+                            'efermi', 'ionic_steps', 'dos_has_errors']
+
+    #Available parser backends.
+    parsers = ('sax', 'iterparse')
+
+    #Optional sections of a vasprun.xml. "ionic_steps" refers to all ionic
+    #steps except the final one, which is always parsed.
+    optional_sections = ('ionic_steps', 'eigenvalues', 'dos', 'pdos')
+
+    #Properties that are populated when a section is parsed. Skipping the dos
+    #section implies skipping the projected dos, which is nested within it.
+    section_properties = {'ionic_steps': ('ionic_steps', 'structures'),
+                          'eigenvalues': ('eigenvalue_array',),
+                          'dos': ('tdos', 'idos', 'pdos_array', 'efermi',
+                                  'dos_energies', 'dos_has_errors'),
+                          'pdos': ('pdos_array',)}
+
+    #Elements of vasprun.xml making up each optional section. The projected
+    #element holds a second copy of the eigenvalues, which the parser reads.
+    _section_tags = {'ionic_steps': ('calculation',),
+                     'eigenvalues': ('eigenvalues', 'projected'),
+                     'dos': ('dos',), 'pdos': ('partial',)}
+
+    def __init__(self, filename, ionic_step_skip=None, parse_sections=None,
+                 parser="sax", use_cache=False, use_index=False):
         """
         Args:
             filename:
@@ -1143,41 +1396,518 @@ class Vasprun(object):
                 you are not interested in every single ionic step. Note that the
                 initial and final structure of all runs will always be read,
                 regardless of the ionic_step_skip. 
+            parse_sections:
+                Sequence of optional sections to parse up front. Must be a
+                subset of Vasprun.optional_sections, i.e., "ionic_steps"
+                (all ionic steps but the final one), "eigenvalues", "dos" and
+                "pdos". Sections which are not listed are skipped and parsed
+                lazily when first needed. Defaults to None, which means all
+                sections are parsed. Use parse_sections=[] if you only need
+                the input parameters, final structure and final energy.
+            parser:
+                Parser backend. Either "sax" (default), which uses the sax
+                parser, or "iterparse", which uses iterparse_vasprun and is
+                considerably faster for files with large dos and
+                eigenvalue sections. Both give identical results.
+            use_cache:
+                Set to True to store the parsed results in a binary sidecar
+                file next to the vasprun.xml (see Vasprun.get_cache_filename)
+                and to load them from there on subsequent runs. The cache is
+                only used if it was written for the same file, i.e., one
+                with the same size and either the same path and modification
+                time or the same sha1 hash, and the same ionic_step_skip.
+                Arrays are memory-mapped from the cache, and the ionic steps,
+                eigenvalues and dos are only read when they are accessed. If
+                there is no valid cache, all sections are parsed regardless
+                of parse_sections and the cache is written. Defaults to
+                False.
+            use_index:
+                Set to True to index the offsets of the calculation elements
+                in a file next to the vasprun.xml (see
+                pymatgen.util.io_utils.SectionIndex). Once the index exists,
+                the intermediate ionic steps are skipped by seeking straight
+                to the final one if "ionic_steps" is not in parse_sections,
+                instead of being read and discarded. Defaults to False.
         """
         self.filename = filename
+        self._use_index = use_index
+        self._ionic_step_skip = ionic_step_skip
+        if parser not in Vasprun.parsers:
+            raise ValueError("Unknown parser {}".format(parser))
+        self._parser = parser
+        if parse_sections is None:
+            parse_sections = Vasprun.optional_sections
+        invalid = set(parse_sections).difference(Vasprun.optional_sections)
+        if invalid:
+            raise ValueError("Unknown vasprun sections {}".format(
+                                                            sorted(invalid)))
+        self._cache = None
+        if use_cache:
+            cache = self._load_cache()
+            if cache is not None:
+                self._init_from_cache(cache)
+                return
+            #Record the state of the file before parsing, in case it is
+            #still being written to.
+            key = _get_cache_key(filename)
+            parse_sections = Vasprun.optional_sections
+        self._parse(parse_sections)
+        if use_cache:
+            self._write_cache(key)
+
+    def _parse(self, parse_sections):
+        """
+        Parses the vasprun file, skipping the optional sections that are not
+        in parse_sections.
+        """
+        filename = self.filename
+        ionic_step_skip = self._ionic_step_skip
+        skip_tags = []
+        if "eigenvalues" not in parse_sections:
+            skip_tags.extend(["eigenvalues", "projected"])
+        if "dos" not in parse_sections:
+            skip_tags.append("dos")
+        elif "pdos" not in parse_sections:
+            skip_tags.append("partial")
+        skip_intermediate = "ionic_steps" not in parse_sections
+
+        calculation_offsets = None
+        if skip_intermediate and self._use_index:
+            index = SectionIndex(filename, ["<calculation>"], persist=True)
+            calculation_offsets = index.offsets["<calculation>"]
+
         with file_open_zip_aware(filename) as f:
             self._handler = VasprunHandler(filename, ionic_step_skip=ionic_step_skip)
-            self._parser = xml.sax.parse(f, self._handler)
-            for k in Vasprun.supported_properties:
+            if skip_tags or skip_intermediate:
+                stream = _VasprunSectionFilter(
+                    f, skip_tags, skip_intermediate,
+                    calculation_offsets=calculation_offsets)
+                self._parse_stream(stream, self._handler)
+                self._sections = stream.sections
+                nskipped = stream.nskipped_calculations
+            else:
+                self._parse_stream(f, self._handler)
+                self._sections = {}
+                nskipped = 0
+
+        #Map the properties of skipped sections that are actually present in
+        #the file to the section that has to be parsed to obtain them.
+        self._lazy_properties = {}
+        for section in ['pdos', 'dos', 'eigenvalues', 'ionic_steps']:
+            if any([t in self._sections for t in Vasprun._section_tags[section]]):
+                for k in Vasprun.section_properties[section]:
+                    self._lazy_properties[k] = section
+        for k in Vasprun.supported_properties:
+            if k not in self._lazy_properties:
                 setattr(self, k, getattr(self._handler, k))
 
+        self.nionic_steps = self._handler.step_count + nskipped
+        self._initial_structure = self._handler.structures[0]
+        self._final_structure = self._handler.structures[-1]
+        self._final_ionic_step = self._handler.ionic_steps[-1]
+
+    def __getattr__(self, name):
+        lazy = self.__dict__.get('_lazy_properties', {})
+        if name in lazy:
+            self._parse_section(lazy[name])
+            return getattr(self, name)
+        raise AttributeError("'{}' object has no attribute '{}'".format(
+                                            self.__class__.__name__, name))
+
+    def _parse_stream(self, stream, handler):
+        if self._parser == "iterparse":
+            iterparse_vasprun(stream, handler)
+        else:
+            xml.sax.parse(stream, handler)
+
+    def _parse_section(self, section):
+        """
+        Parses a section that was skipped on initialization by seeking back
+        into the vasprun file, and populates the associated properties.
+        """
+        if self._cache is not None:
+            self._load_cached_section(section)
+            return
+        handler = VasprunHandler(self.filename,
+                                 ionic_step_skip=self._ionic_step_skip)
+        handler.input_read = True
+        handler.atomic_symbols = self._handler.atomic_symbols
+        if section != 'ionic_steps':
+            handler.all_calculations_read = True
+        if section == 'pdos':
+            handler.read_dos = True
+            handler.efermi = self.efermi
+            handler.dos_energies = self.dos_energies
+        tags = Vasprun._section_tags[section]
+        ranges = [self._sections[t] for t in tags if t in self._sections]
+        start = min([r[0] for r in ranges])
+        end = max([r[1] for r in ranges])
+        #Drop anything between the elements that belongs to other sections.
+        skip_tags = [t for t in ['eigenvalues', 'projected', 'dos']
+                     if t not in tags]
+        with file_open_zip_aware(self.filename) as f:
+            f.seek(start)
+            stream = _VasprunSectionFilter(f, skip_tags, offset=start, end=end,
+                                           wrap=True)
+            self._parse_stream(stream, handler)
+
+        if section == 'ionic_steps':
+            #Splice the intermediate steps in front of the final one.
+            structures = self._handler.structures
+            ids = [id(s) for s in structures]
+            ind = ids.index(id(self._final_ionic_step['structure']))
+            self.structures = structures[:ind] + handler.structures + \
+                                structures[ind + 1:]
+            self.ionic_steps = handler.ionic_steps
+        else:
+            for k in Vasprun.section_properties[section]:
+                if k == 'dos_has_errors':
+                    self.dos_has_errors = self._handler.dos_has_errors or \
+                                            handler.dos_has_errors
+                else:
+                    setattr(self, k, getattr(handler, k))
+        for k in Vasprun.section_properties[section]:
+            self._lazy_properties.pop(k, None)
+
+    @staticmethod
+    def get_cache_filename(filename):
+        """
+        Returns the filename of the binary cache used for a vasprun file with
+        use_cache=True, i.e., a hidden .npz file in the same directory.
+        """
+        (dirname, basename) = os.path.split(os.path.abspath(filename))
+        return os.path.join(dirname, "." + basename + ".pmgcache.npz")
+
+    def _load_cache(self):
+        """
+        Returns the arrays in the cache of the vasprun file, with the
+        decoded metadata under "metadata", or None if there is no valid
+        cache.
+        """
+        cache_filename = Vasprun.get_cache_filename(self.filename)
+        if not os.path.exists(cache_filename):
+            return None
+        try:
+            cache = load_npz_mmap(cache_filename)
+            metadata = json.loads(cache["metadata"].tostring())
+        except Exception:
+            return None
+        if metadata.get("version") != _CACHE_VERSION or \
+                metadata["ionic_step_skip"] != self._ionic_step_skip:
+            return None
+        (path, size, mtime, sha1) = metadata["key"]
+        if os.path.getsize(self.filename) != size:
+            return None
+        if (path, mtime) != (os.path.abspath(self.filename),
+                             os.path.getmtime(self.filename)):
+            if get_file_sha1(self.filename) != sha1:
+                return None
+        cache["metadata"] = metadata
+        return cache
+
+    def _write_cache(self, key):
+        """
+        Writes the parsed results to the cache of the vasprun file. Fails
+        with a warning if the results cannot be cached, e.g., because the
+        directory is not writable.
+        """
+        for k in self._lazy_properties.keys():
+            getattr(self, k)
+        try:
+            (metadata, arrays) = self._get_cache_data()
+        except Exception as ex:
+            warnings.warn("Unable to cache {}: {}".format(self.filename, ex))
+            return
+        metadata["version"] = _CACHE_VERSION
+        metadata["key"] = key
+        metadata["ionic_step_skip"] = self._ionic_step_skip
+        arrays["metadata"] = np.fromstring(json.dumps(metadata),
+                                           dtype=np.uint8)
+        cache_filename = Vasprun.get_cache_filename(self.filename)
+        tmp_filename = None
+        try:
+            (fd, tmp_filename) = tempfile.mkstemp(
+                dir=os.path.dirname(cache_filename), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.chmod(tmp_filename, 0644)
+            os.rename(tmp_filename, cache_filename)
+        except (IOError, OSError) as ex:
+            warnings.warn("Unable to write cache {}: {}".format(
+                                                    cache_filename, ex))
+            if tmp_filename is not None and os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    def _get_cache_data(self):
+        """
+        Packs the parsed results into a dict of metadata, which is stored as
+        json, and a dict of numpy arrays. Nothing is pickled, so that loading
+        a cache never executes code.
+        """
+        metadata = {k: getattr(self, k) for k in
+                    ["vasp_version", "potcar_symbols", "atomic_symbols",
+                     "actual_kpoints", "actual_kpoints_weights", "efermi",
+                     "dos_has_errors", "nionic_steps"]}
+        #The handler sets the plain attributes of Kpoints, including the
+        #optional genvec and shift ones, which from_dict does not restore.
+        metadata["kpoints"] = dict(self.kpoints.__dict__)
+        metadata["lattice_rec"] = self.lattice_rec.matrix.tolist() \
+            if isinstance(self.lattice_rec, Lattice) else None
+        metadata["incar"] = dict(self.incar)
+        metadata["parameters"] = dict(self.parameters)
+        arrays = {}
+
+        indices = {id(s): i for (i, s) in enumerate(self.structures)}
+        metadata["structure_indices"] = [indices[id(step["structure"])]
+                                         for step in self.ionic_steps]
+        metadata["final_electronic_steps"] = \
+            self._final_ionic_step["electronic_steps"]
+        arrays["lattices"] = np.array([s.lattice.matrix
+                                       for s in self.structures])
+        arrays["frac_coords"] = np.array([s.frac_coords
+                                          for s in self.structures])
+        electronic_steps = [step["electronic_steps"]
+                            for step in self.ionic_steps]
+        arrays["electronic_steps"] = np.fromstring(
+            json.dumps(electronic_steps), dtype=np.uint8)
+        for (k, name, shape) in [("forces", "forces",
+                                  (len(self.atomic_symbols), 3)),
+                                 ("stress", "stresses", (3, 3))]:
+            values = [step[k] for step in self.ionic_steps]
+            arrays["has_" + name] = np.array([v is not None for v in values])
+            arrays[name] = np.array([np.zeros(shape) if v is None else v
+                                     for v in values], dtype=float)
+
+        for k in ["eigenvalue_array", "pdos_array"]:
+            if getattr(self, k) is not None:
+                arrays[k] = getattr(self, k)
+        metadata["dos_energies"] = self.dos_energies is not None
+        if self.dos_energies is not None:
+            arrays["dos_energies"] = np.array(self.dos_energies)
+        for k in ["tdos", "idos"]:
+            dos = getattr(self, k)
+            if isinstance(dos, Dos):
+                spins = sorted(dos.densities.keys(), key=int, reverse=True)
+                metadata[k + "_spins"] = [int(spin) for spin in spins]
+                arrays[k] = np.array([dos.densities[spin] for spin in spins])
+            elif dos:
+                raise ValueError("Incomplete {}".format(k))
+            else:
+                metadata[k + "_spins"] = None
+        return (metadata, arrays)
+
+    def _init_from_cache(self, cache):
+        """
+        Sets up the object from a cache returned by _load_cache. Only the
+        input parameters and the initial and final structures and ionic step
+        are read immediately. Everything else is read from the cache when
+        accessed.
+        """
+        self._cache = cache
+        metadata = cache["metadata"]
+        for k in ["vasp_version", "potcar_symbols", "atomic_symbols",
+                  "actual_kpoints", "actual_kpoints_weights", "efermi",
+                  "dos_has_errors", "nionic_steps"]:
+            setattr(self, k, metadata[k])
+        self.kpoints = Kpoints()
+        for (k, v) in metadata["kpoints"].items():
+            setattr(self.kpoints, k, v)
+        self.lattice_rec = Lattice(metadata["lattice_rec"]) \
+            if metadata["lattice_rec"] is not None else []
+        self.incar = Incar(metadata["incar"])
+        self.parameters = Incar(metadata["parameters"])
+        self._cached_structures = {}
+        self._initial_structure = self._get_cached_structure(0)
+        self._final_structure = self._get_cached_structure(
+                                                len(cache["lattices"]) - 1)
+        self._final_ionic_step = self._get_cached_ionic_step(
+                                    len(metadata["structure_indices"]) - 1,
+                                    metadata["final_electronic_steps"])
+        self._lazy_properties = {}
+        for section in ["ionic_steps", "eigenvalues", "dos"]:
+            for k in Vasprun.section_properties[section]:
+                if k not in self.__dict__:
+                    self._lazy_properties[k] = section
+
+    def _get_cached_structure(self, index):
+        if index not in self._cached_structures:
+            self._cached_structures[index] = Structure(
+                        Lattice(np.array(self._cache["lattices"][index])),
+                        self.atomic_symbols,
+                        np.array(self._cache["frac_coords"][index]))
+        return self._cached_structures[index]
+
+    def _get_cached_ionic_step(self, index, electronic_steps):
+        cache = self._cache
+        step = {"electronic_steps": electronic_steps,
+                "structure": self._get_cached_structure(
+                            cache["metadata"]["structure_indices"][index])}
+        for (k, name) in [("forces", "forces"), ("stress", "stresses")]:
+            step[k] = np.array(cache[name][index]) \
+                if cache["has_" + name][index] else None
+        return step
+
+    def _load_cached_section(self, section):
+        """
+        Populates the properties associated with a section from the cache.
+        """
+        cache = self._cache
+        metadata = cache["metadata"]
+        if section == "ionic_steps":
+            self.structures = [self._get_cached_structure(i)
+                               for i in xrange(len(cache["lattices"]))]
+            electronic_steps = json.loads(
+                                    cache["electronic_steps"].tostring())
+            self.ionic_steps = [self._get_cached_ionic_step(i, steps)
+                                for (i, steps) in
+                                enumerate(electronic_steps[:-1])]
+            self.ionic_steps.append(self._final_ionic_step)
+        elif section == "eigenvalues":
+            self.eigenvalue_array = _get_cached_array(cache, "eigenvalue_array")
+        else:
+            self.dos_energies = cache["dos_energies"].tolist() \
+                if metadata["dos_energies"] else None
+            for k in ["tdos", "idos"]:
+                spins = metadata[k + "_spins"]
+                if spins is None:
+                    setattr(self, k, {})
+                else:
+                    densities = {Spin.from_int(spin): np.array(d)
+                                 for (spin, d) in zip(spins, cache[k])}
+                    setattr(self, k, Dos(self.efermi, self.dos_energies,
+                                         densities))
+            self.pdos_array = _get_cached_array(cache, "pdos_array")
+        for k in [k for (k, v) in self._lazy_properties.items()
+                  if v == section]:
+            self._lazy_properties.pop(k)
+
+    @staticmethod
+    def iter_ionic_steps(filename, start=0, stop=None, step=1):
+        """
+        Generator over the ionic steps of a vasprun.xml which parses one step
+        at a time, e.g., for huge molecular dynamics runs which do not fit
+        into memory with Vasprun. Steps which are not selected are never
+        parsed.
+
+        Args:
+            filename:
+                Filename of vasprun.xml.
+            start:
+                Index of the first ionic step to yield. Defaults to 0.
+            stop:
+                Index of the ionic step to stop at (exclusive). Defaults to
+                None, i.e., all steps to the end of the run.
+            step:
+                Yield only every step-th ionic step. Must be a positive
+                integer. Defaults to 1.
+
+        Yields:
+            Ionic steps in the same format as Vasprun.ionic_steps, i.e.,
+            {'structure': structure, 'electronic_steps': [...],
+            'forces': forces, 'stress': stress}.
+        """
+        for (index, handler) in _iter_calculations(filename, start, stop, step):
+            yield handler.ionic_steps[-1]
+
+    @staticmethod
+    def save_trajectory(filename, output_filename, start=0, stop=None,
+                        step=1):
+        """
+        Writes the trajectory of a vasprun.xml to a compact numpy .npz
+        archive, without creating Structure objects for each ionic step. Each
+        step is streamed to disk as it is parsed, so memory use does not grow
+        with the length of the trajectory. The archive can be read with
+        numpy.load (or io_utils.load_npz_mmap) and contains the arrays
+
+            species: (natoms,) atomic symbols.
+            steps: (nsteps,) indices of the ionic steps in the run.
+            lattices: (nsteps, 3, 3) lattice matrices.
+            frac_coords: (nsteps, natoms, 3) fractional coordinates.
+            energies: (nsteps,) final energies (e_wo_entrp) of each step.
+            forces: (nsteps, natoms, 3) forces, if present in the run.
+            stresses: (nsteps, 3, 3) stresses, if present in the run.
+
+        Args:
+            filename:
+                Filename of vasprun.xml.
+            output_filename:
+                Filename of the .npz archive to write.
+            start, stop, step:
+                Selection of ionic steps. See iter_ionic_steps.
+
+        Returns:
+            Number of ionic steps written. A ValueError is raised, and no
+            archive is written, if no ionic steps are selected.
+        """
+        nsteps = 0
+        species = []
+        missing = set()
+        with NpzRowWriter(output_filename) as writer:
+            for (index, handler) in _iter_calculations(filename, start, stop,
+                                                       step, make_structures=False):
+                ionic_step = handler.ionic_steps[-1]
+                species = handler.atomic_symbols
+                row = {'steps': index, 'lattices': handler.lattice,
+                       'frac_coords': handler.pos,
+                       'energies': ionic_step['electronic_steps'][-1]['e_wo_entrp'],
+                       'forces': ionic_step['forces'],
+                       'stresses': ionic_step['stress']}
+                for k, v in row.items():
+                    if v is None:
+                        missing.add(k)
+                        writer.discard(k)
+                    elif k not in missing:
+                        writer.append(k, v)
+                nsteps += 1
+            if nsteps == 0:
+                raise ValueError("No ionic steps in {} are selected by start="
+                                 "{}, stop={}, step={}.".format(
+                                     filename, start, stop, step))
+            writer.add('species', np.array(species))
+        return nsteps
+
     @property
     def converged(self):
         """
         True if a relaxation run is converged.  Always True for a static run.
         """
-        return len(self.structures) - 2 < self.parameters['NSW'] or self.parameters['NSW'] == 0
+        return self.nionic_steps < self.parameters['NSW'] or self.parameters['NSW'] == 0
 
     @property
     def final_energy(self):
         """
         Final energy from the vasp run.
         """
-        return self.ionic_steps[-1]['electronic_steps'][-1]['e_wo_entrp']
+        return self._final_ionic_step['electronic_steps'][-1]['e_wo_entrp']
 
     @property
     def final_structure(self):
         """
         Final structure from vasprun.
         """
-        return self.structures[-1]
+        return self._final_structure
 
     @property
     def initial_structure(self):
         """
         Initial structure from vasprun.
         """
-        return self.structures[0]
+        return self._initial_structure
+
+    @property
+    def eigenvalues(self):
+        """
+        Read-only dict view of eigenvalue_array, i.e.,
+        {(kpoint index, Spin.up):[[eigenvalue, occu]]}.
+        """
+        return _EigenvalueView(self.eigenvalue_array)
+
+    @property
+    def pdos(self):
+        """
+        List of list of PDos objects. Access as pdos[atomindex][orbitalindex]
+        """
+        return _PDosView(self.pdos_array, self.efermi, self.dos_energies)
 
     @property
     def complete_dos(self):
@@ -1185,8 +1915,8 @@ class Vasprun(object):
         A complete dos object which incorporates the total dos and all projected dos.
         """
         final_struct = self.final_structure
-        pdoss = {final_struct[i]:{Orbital.from_vasp_index(j) : self.pdos[i][j]
-                    for j in range(len(self.pdos[i]))} for i in range(len(self.pdos))}
+        pdoss = {final_struct[i]: {pdos.orbital: pdos for pdos in atom_pdos}
+                 for (i, atom_pdos) in enumerate(self.pdos)}
         return CompleteDos(self.final_structure, self.tdos, pdoss)
 
     @property
@@ -1313,14 +2043,17 @@ class Vasprun(object):
         vbm_kpoint = None
         cbm = float('inf')
         cbm_kpoint = None
-        for k, val in self.eigenvalues.items():
-            for (eigenval, occu) in val:
-                if occu > 1e-8 and eigenval > vbm:
-                    vbm = eigenval
-                    vbm_kpoint = k[0]
-                elif occu <= 1e-8 and eigenval < cbm:
-                    cbm = eigenval
-                    cbm_kpoint = k[0]
+        if self.eigenvalue_array is not None:
+            eigenvals = self.eigenvalue_array[..., 0]
+            occupied = self.eigenvalue_array[..., 1] > 1e-8
+            if occupied.any():
+                ind = np.argmax(np.where(occupied, eigenvals, -np.inf))
+                vbm = float(eigenvals.flat[ind])
+                vbm_kpoint = np.unravel_index(ind, eigenvals.shape)[1] + 1
+            if not occupied.all():
+                ind = np.argmin(np.where(occupied, np.inf, eigenvals))
+                cbm = float(eigenvals.flat[ind])
+                cbm_kpoint = np.unravel_index(ind, eigenvals.shape)[1] + 1
         return (cbm - vbm, cbm, vbm, vbm_kpoint == cbm_kpoint)
 
     @property
@@ -1390,6 +2123,131 @@ class Vasprun(object):
         return d
 
 
+class _EigenvalueView(collections.Mapping):
+    """
+    Read-only view of a (nspin, nkpt, nband, 2) eigenvalue array as a dict of
+    {(kpoint index, spin): [[eigenvalue, occu]]}, with 1-based kpoint
+    indices. Values are created as lists on access.
+    """
+
+    def __init__(self, eigenvalue_array):
+        self._array = eigenvalue_array
+        nspin = 0 if eigenvalue_array is None else len(eigenvalue_array)
+        self._spins = [Spin.up, Spin.down][:nspin]
+
+    def __getitem__(self, key):
+        (kpoint, spin) = key
+        if spin not in self._spins or not 0 < kpoint <= self._array.shape[1]:
+            raise KeyError(key)
+        return self._array[self._spins.index(spin), kpoint - 1].tolist()
+
+    def __iter__(self):
+        for spin in self._spins:
+            for kpoint in xrange(1, self._array.shape[1] + 1):
+                yield (kpoint, spin)
+
+    def __len__(self):
+        return 0 if self._array is None else \
+            self._array.shape[0] * self._array.shape[1]
+
+
+class _PDosView(collections.Sequence):
+    """
+    Read-only view of a (nspin, natom, norb, nedos) projected dos array as a
+    list of list of PDos objects, i.e., pdos[atomindex][orbitalindex]. The
+    PDos objects for an atom are created on access.
+    """
+
+    def __init__(self, pdos_array, efermi, energies):
+        self._array = pdos_array
+        self._efermi = efermi
+        self._energies = energies
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        if self._array is None:
+            raise IndexError(index)
+        atom_pdos = self._array[:, index]
+        spins = [Spin.up, Spin.down][:len(atom_pdos)]
+        return [PDos(self._efermi, self._energies,
+                     dict(zip(spins, atom_pdos[:, iorbital])),
+                     Orbital.from_vasp_index(iorbital))
+                for iorbital in xrange(atom_pdos.shape[1])]
+
+    def __len__(self):
+        return 0 if self._array is None else self._array.shape[1]
+
+
+class VasprunTail(object):
+    """
+    Fast reader for the final structure and final energy of a vasprun.xml,
+    together with the input parameters. Instead of parsing the whole file, the
+    file is searched backwards from the end for the last structure and
+    electronic step, and only the head of the file up to the atominfo block
+    (which holds the incar, parameters and potcar symbols) is read. This is
+    orders of magnitude faster than Vasprun for large files.
+
+    For gzipped and bzipped files, the tail is decompressed starting from the
+    last independently compressed member (e.g., files written by bgzip or
+    pbzip2) where possible. Otherwise, the file is streamed with bounded
+    memory usage.
+
+    Attributes:
+
+        final_energy:
+            Final energy from the run, as given by Vasprun.final_energy.
+        final_structure:
+            Final structure from the run, as given by Vasprun.final_structure.
+        incar, parameters, kpoints, actual_kpoints, actual_kpoints_weights,
+        potcar_symbols, atomic_symbols, vasp_version:
+            Same as the corresponding Vasprun attributes.
+        hubbards, is_hubbard, run_type, is_spin:
+            Same as the corresponding Vasprun properties.
+    """
+
+    #Share the properties that only depend on the inputs with Vasprun.
+    hubbards = Vasprun.hubbards
+    is_hubbard = Vasprun.is_hubbard
+    run_type = Vasprun.run_type
+    is_spin = Vasprun.is_spin
+
+    def __init__(self, filename, chunk_size=1048576):
+        """
+        Args:
+            filename:
+                Filename of vasprun.xml. May be gzipped or bzipped.
+            chunk_size:
+                Size of the chunks in bytes read when searching backwards.
+        """
+        self.filename = filename
+        with file_open_zip_aware(filename) as f:
+            handler = _parse_vasprun_head(f, filename)
+        for k in ['vasp_version', 'incar', 'parameters', 'kpoints',
+                  'actual_kpoints', 'actual_kpoints_weights',
+                  'potcar_symbols', 'atomic_symbols']:
+            setattr(self, k, getattr(handler, k))
+
+        fragments = _read_vasprun_tail(filename, chunk_size)
+        if fragments is None:
+            raise VaspParserError("No final structure and electronic step "
+                                  "found in {}".format(filename))
+
+        handler = VasprunHandler(filename)
+        handler.input_read = True
+        handler.all_calculations_read = True
+        handler.atomic_symbols = self.atomic_symbols
+        xml.sax.parseString(_wrap_fragment(fragments['structure']), handler)
+        self.final_structure = handler.structures[-1]
+
+        handler = VasprunHandler(filename)
+        handler.input_read = True
+        handler.read_calculation = True
+        handler.scdata = []
+        xml.sax.parseString(_wrap_fragment(fragments['scstep']), handler)
+        self.final_energy = handler.scdata[-1]['e_wo_entrp']
+
+
 class VasprunHandler(xml.sax.handler.ContentHandler):
     """
     Sax handler for vasprun.xml.
@@ -1416,9 +2274,11 @@ class VasprunHandler(xml.sax.handler.ContentHandler):
         self.actual_kpoints_weights = []
         self.dos_energies = None
         self.eigenvalues = {}#  will  be  {(kpoint index, Spin.up):array(float)}
+        self.eigenvalue_array = None # (nspin, nkpt, nband, 2) array
         self.tdos = {}
         self.idos = {}
         self.pdos = {}
+        self.pdos_array = None # (nspin, natom, norb, nedos) array
         self.efermi = None
         self.ionic_steps = [] # should be a list of dict
         self.structures = []
@@ -1441,6 +2301,7 @@ class VasprunHandler(xml.sax.handler.ContentHandler):
         self.idos_val = []
         self.raw_data = []
         self.dos_has_errors = False #will be set to true if there is an error parsing the Dos.
+        self.make_structures = True #set to false to keep only the raw lattice and positions.
         self.state = defaultdict(bool)
 
     def in_all(self, xml_tags):
@@ -1451,6 +2312,12 @@ class VasprunHandler(xml.sax.handler.ContentHandler):
         self.state[name] = True if 'name' not in attributes else attributes['name']
         self.read_val = False
 
+        #Eigenvalues and dos are only written for the final ionic step, and
+        #either one may have been filtered out of the stream.
+        if self.input_read and not self.all_calculations_read and \
+                (name == "eigenvalues" or name == "dos"):
+            self.all_calculations_read = True
+
         #Nested if loops makes reading much faster.
         if not self.input_read: #reading input parameters
             if (name == "i" or name == "v") and (self.state['incar'] or self.state['parameters']):
@@ -1490,6 +2357,8 @@ class VasprunHandler(xml.sax.handler.ContentHandler):
                     del self.structures[-1]
 
                 self.scdata = []
+                self.forces = None
+                self.stress = None
                 self.read_calculation = True
             elif name == "scstep":
                 self.scstep = {}
@@ -1500,8 +2369,6 @@ class VasprunHandler(xml.sax.handler.ContentHandler):
                 self.read_structure = True
             elif name == 'varray' and (self.state['varray'] == "forces" or self.state['varray'] == "stress"):
                 self.posstr = StringIO.StringIO()
-            elif name == "eigenvalues":
-                self.all_calculations_read = True
         else: #Read last part of vasprun, which is dos and eigenvalues if any.
             if self.read_structure:
                 if name == "v" and self.state['varray'] == 'basis':
@@ -1542,6 +2409,7 @@ class VasprunHandler(xml.sax.handler.ContentHandler):
                 self.tdos = {}
                 self.idos = {}
                 self.pdos = {}
+                self.pdos_array = None
                 self.efermi = None
                 self.read_dos = True
             elif name == "eigenvalues":
@@ -1631,7 +2499,10 @@ class VasprunHandler(xml.sax.handler.ContentHandler):
                     self.lattice.shape = (3, 3)
                     self.pos = np.array([float(x) for x in re.split("\s+", self.posstr.getvalue().strip())])
                     self.pos.shape = (len(self.atomic_symbols), 3)
-                    self.structures.append(Structure(self.lattice, self.atomic_symbols, self.pos))
+                    if self.make_structures:
+                        self.structures.append(Structure(self.lattice, self.atomic_symbols, self.pos))
+                    else:
+                        self.structures.append(None)
                     self.lattice_rec = Lattice([float(x) for x in re.split("\s+", self.latticerec.getvalue().strip())])
                     self.read_structure = False
             elif self.read_dos:
@@ -1656,23 +2527,11 @@ class VasprunHandler(xml.sax.handler.ContentHandler):
                         self.idos_val = []
                     elif name == "set" and self.state["partial"] and str(self.state["set"]).startswith("spin"):
                         spin = Spin.up if self.state["set"] == "spin 1" else Spin.down
-                        self.norbitals = len(self.raw_data[0])
-                        for i in xrange(self.norbitals):
-                            self.pdos[(self.pdos_ion, i, spin)] = [row[i] for row in self.raw_data]
+                        self.pdos[(self.pdos_ion, spin)] = self.raw_data
                         self.raw_data = []
                     elif name == "partial":
-                        all_pdos = []
-                        natom = len(self.atomic_symbols)
-                        for iatom in xrange(1, natom + 1):
-                            all_pdos.append(list())
-                            for iorbital in xrange(self.norbitals):
-                                updos = self.pdos[(iatom, iorbital, Spin.up)]
-                                downdos = None if (iatom, iorbital, Spin.down) not in self.pdos else self.pdos[(iatom, iorbital, Spin.down)]
-                                if downdos:
-                                    all_pdos[-1].append(PDos(self.efermi, self.dos_energies, {Spin.up:updos, Spin.down:downdos}, Orbital.from_vasp_index(iorbital)))
-                                else:
-                                    all_pdos[-1].append(PDos(self.efermi, self.dos_energies, {Spin.up:updos}, Orbital.from_vasp_index(iorbital)))
-                        self.pdos = all_pdos
+                        self.pdos_array = _get_pdos_array(self.pdos, len(self.atomic_symbols))
+                        self.pdos = {}
                     elif name == "total":
                         self.tdos = Dos(self.efermi, self.dos_energies, self.tdos)
                         self.idos = Dos(self.efermi, self.dos_energies, self.idos)
@@ -1688,101 +2547,740 @@ class VasprunHandler(xml.sax.handler.ContentHandler):
                     self.eigenvalues[(self.eigen_kpoint, self.eigen_spin)] = self.raw_data
                     self.raw_data = []
                 elif name == "eigenvalues":
+                    self.eigenvalue_array = _get_eigenvalue_array(self.eigenvalues)
+                    self.eigenvalues = {}
                     self.read_eigen = False
 
         self.state[name] = False
 
-def parse_parameters(val_type, val):
+def iterparse_vasprun(source, handler):
     """
-    Helper function to convert a Vasprun parameter into the proper type.
-    Boolean, int and float types are converted.
-    
+    Faster drop-in replacement for xml.sax.parse(source, handler) with a
+    VasprunHandler. The document is tokenized by expat through
+    ElementTree.iterparse. The input parameters and electronic steps are
+    passed on to the handler as sax events, while the numeric bulk of the
+    file, i.e., structures, forces, stresses, eigenvalues and dos, is
+    collected as complete elements and converted in one go with numpy
+    instead of per row. The resulting handler attributes are identical to
+    those obtained with the sax parser.
+
     Args:
-        val_type : Value type parsed from vasprun.xml.
-        val : Actual string value parsed for vasprun.xml.
+        source:
+            Filename or file-like object of vasprun.xml.
+        handler:
+            VasprunHandler to populate.
     """
-    if val_type == "logical":
-        return (val == "T")
-    elif val_type == "int":
-        return int(val)
-    elif val_type == "string":
-        return val.strip()
-    else:
-        return float(val)
+    bulk_root = None
+    elems = []
+    for (event, elem) in ElementTree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            if bulk_root is None:
+                if handler.input_read and _is_bulk_element(elem):
+                    bulk_root = elem
+                else:
+                    attributes = {k: unicode(v) for k, v in elem.attrib.items()}
+                    handler.startElement(elem.tag, attributes)
+            elems.append(elem)
+            continue
+        elems.pop()
+        if bulk_root is None:
+            if len(elem) == 0 and elem.text and elem.text.strip():
+                handler.characters(unicode(elem.text))
+            handler.endElement(elem.tag)
+        elif elem is bulk_root:
+            _process_bulk_element(handler, elem)
+            bulk_root = None
+        else:
+            continue
+        elem.clear()
+        if elems:
+            elems[-1].remove(elem)
 
-def _parse_v_parameters(val_type, val, filename, param_name):
+
+def _is_bulk_element(elem):
+    if elem.tag in ("structure", "eigenvalues", "dos", "partial", "projected"):
+        return True
+    return elem.tag == "varray" and elem.get("name") in ("forces", "stress")
+
+
+def _bulk_floats(texts, shape):
     """
-    Helper function to convert a Vasprun array-type parameter into the proper type.
-    Boolean, int and float types are converted.
-    
-    Args:
-        val_type: 
-            Value type parsed from vasprun.xml.
-        val: 
-            Actual string value parsed for vasprun.xml.
-        filename: 
-            Fullpath of vasprun.xml. Used for robust error handling.  E.g.,
-            if vasprun.xml contains *** for some Incar parameters, the code will try
-            to read from an INCAR file present in the same directory.
-        param_name: 
-            Name of parameter.
-            
-    Returns:
-        Parsed value.
+    Converts the whitespace separated numbers in a list of strings into an
+    array of the given shape in one go. Falls back to float() for the error
+    handling if the data is malformed, e.g., contains ****.
     """
-    if val_type == "logical":
-        val = [True if i == "T" else False for i in re.split("\s+", val)]
-    elif val_type == "int":
-        try:
-            val = [int(i) for i in re.split("\s+", val)]
-        except ValueError:
-            # Fix for stupid error in vasprun sometimes which displays
-            # LDAUL/J as 2****
-            val = _parse_from_incar(filename, param_name)
-            if val == None:
-                raise IOError("Error in parsing vasprun.xml")
-    elif val_type == "string":
-        val = [i for i in re.split("\s+", val)]
-    else:
-        try:
-            val = [float(i) for i in re.split("\s+", val)]
-        except ValueError:
-            # Fix for stupid error in vasprun sometimes which displays
-            # MAGMOM as 2****
-            val = _parse_from_incar(filename, param_name)
-            if val == None:
-                raise IOError("Error in parsing vasprun.xml")
-    return val
+    data = " ".join(texts)
+    arr = np.fromstring(data, sep=" ")
+    if arr.size != np.prod(shape):
+        arr = np.array([float(x) for x in data.split()])
+    return arr.reshape(shape)
 
-def _parse_from_incar(filename, key):
+
+def _bulk_rows(set_elem):
     """
-    Helper function to parse a parameter from the INCAR.
+    Returns the rows of r elements in a set element as a 2D array.
     """
-    dirname = os.path.dirname(filename)
-    for f in os.listdir(dirname):
-        if re.search("INCAR", f):
-            warnings.warn("INCAR found. Using " + key + " from INCAR.")
-            incar = Incar.from_file(os.path.join(dirname, f))
-            if key in incar:
-                return incar[key]
-            else:
-                return None
-    return None
+    texts = [r.text for r in set_elem.findall("r")]
+    if not texts:
+        return np.zeros((0, 0))
+    ncols = len(texts[0].split())
+    return _bulk_floats(texts, (len(texts), ncols))
 
 
-class Outcar(object):
-    """
-    Parser for data in OUTCAR that is not available in Vasprun.xml
+def _set_spin(comment):
+    return Spin.up if comment == "spin 1" else Spin.down
 
-    Note, this class works a bit differently than most of the other VaspObjects,
-    since the OUTCAR can be very different depending on which "type of run"
-    performed.
 
-    Creating the OUTCAR class with a filename reads "regular parameters" that
-    are always present.
-    
-    Default attributes:
-        magnetization:
+def _process_bulk_element(handler, elem):
+    """
+    Updates the handler with a complete structure, varray, eigenvalues, dos,
+    partial dos or projected element, mirroring the sax event processing.
+    """
+    tag = elem.tag
+    if tag in ("eigenvalues", "dos") and not handler.all_calculations_read:
+        handler.all_calculations_read = True
+    if tag == "structure":
+        varrays = {v.get("name"): v for v in elem.iter("varray")}
+        natoms = len(handler.atomic_symbols)
+        handler.lattice = _bulk_floats([v.text for v in varrays["basis"]], (3, 3))
+        handler.pos = _bulk_floats([v.text for v in varrays["positions"]],
+                                   (natoms, 3))
+        if handler.make_structures:
+            handler.structures.append(Structure(handler.lattice,
+                                                handler.atomic_symbols,
+                                                handler.pos))
+        else:
+            handler.structures.append(None)
+        rec = _bulk_floats([v.text for v in varrays["rec_basis"]], (9,))
+        handler.lattice_rec = Lattice(rec.tolist())
+    elif tag == "varray":
+        if handler.read_calculation:
+            texts = [v.text for v in elem.findall("v")]
+            if elem.get("name") == "forces":
+                handler.forces = _bulk_floats(texts, (len(handler.atomic_symbols), 3))
+            else:
+                handler.stress = _bulk_floats(texts, (3, 3))
+    elif tag == "eigenvalues":
+        handler.eigenvalues = {}
+        for spin_set in elem.iter("set"):
+            comment = spin_set.get("comment", "")
+            if not comment.startswith("spin"):
+                continue
+            spin = _set_spin(comment)
+            for kpoint_set in spin_set.findall("set"):
+                comment = kpoint_set.get("comment", "")
+                if comment.startswith("kpoint"):
+                    kpoint = int(comment.split(" ")[1])
+                    handler.eigenvalues[(kpoint, spin)] = _bulk_rows(kpoint_set)
+        handler.eigenvalue_array = _get_eigenvalue_array(handler.eigenvalues)
+        handler.eigenvalues = {}
+    elif tag == "projected":
+        #The projected element holds a copy of the eigenvalues, which
+        #overrides the ones read before.
+        for child in elem.findall("eigenvalues"):
+            _process_bulk_element(handler, child)
+    elif tag == "dos":
+        handler.dos_energies = None
+        handler.tdos = {}
+        handler.idos = {}
+        handler.pdos = {}
+        handler.pdos_array = None
+        handler.efermi = None
+        try:
+            for i in elem.findall("i"):
+                if i.get("name") == "efermi":
+                    handler.efermi = float(i.text.strip())
+            total = elem.find("total")
+            if total is not None:
+                for spin_set in total.iter("set"):
+                    comment = spin_set.get("comment", "")
+                    if comment.startswith("spin"):
+                        rows = _bulk_rows(spin_set)
+                        dos = rows[:, 1].tolist()
+                        handler.tdos[_set_spin(comment)] = dos
+                        handler.idos[_set_spin(comment)] = dos
+                        handler.dos_energies = rows[:, 0].tolist()
+                handler.tdos = Dos(handler.efermi, handler.dos_energies, handler.tdos)
+                handler.idos = Dos(handler.efermi, handler.dos_energies, handler.idos)
+        except Exception:
+            handler.dos_has_errors = True
+        partial = elem.find("partial")
+        if partial is not None:
+            _process_bulk_element(handler, partial)
+    elif tag == "partial":
+        try:
+            pdos = {}
+            handler.pdos = pdos
+            ion_sets = [ion_set for ion_set in elem.iter("set")
+                        if ion_set.get("comment", "").startswith("ion")]
+            for ion_set in ion_sets:
+                ion = int(ion_set.get("comment").split(" ")[1])
+                for spin_set in ion_set.findall("set"):
+                    comment = spin_set.get("comment", "")
+                    if comment.startswith("spin"):
+                        pdos[(ion, _set_spin(comment))] = _bulk_rows(spin_set)[:, 1:]
+            handler.pdos_array = _get_pdos_array(pdos, len(handler.atomic_symbols))
+            handler.pdos = {}
+        except Exception:
+            handler.dos_has_errors = True
+
+
+def _get_eigenvalue_array(eigenvalues):
+    """
+    Converts eigenvalues read as {(kpoint index, spin): rows} into a
+    (nspin, nkpt, nband, 2) array. Kpoint indices are 1-based.
+    """
+    if not eigenvalues:
+        return None
+    spins = [Spin.up, Spin.down] if Spin.down in [k[1] for k in eigenvalues] \
+        else [Spin.up]
+    nkpt = max([k[0] for k in eigenvalues])
+    return np.array([[eigenvalues[(k, spin)] for k in xrange(1, nkpt + 1)]
+                     for spin in spins], dtype=float)
+
+
+def _get_pdos_array(pdos, natom):
+    """
+    Converts a projected dos read as {(ion index, spin): (nedos, norb) rows}
+    into a (nspin, natom, norb, nedos) array. Ion indices are 1-based.
+    """
+    spins = [Spin.up, Spin.down] if Spin.down in [k[1] for k in pdos] \
+        else [Spin.up]
+    return np.array([[np.transpose(pdos[(ion, spin)])
+                      for ion in xrange(1, natom + 1)]
+                     for spin in spins], dtype=float)
+
+
+_START_TAG_REGEX = re.compile(r"\s*<([A-Za-z_][\w.-]*)")
+
+
+class _VasprunSectionFilter(object):
+    """
+    Read-only file-like wrapper around an open vasprun.xml which drops
+    complete sections before they reach the sax parser. vasprun.xml files are
+    written with one element per line, so sections can be located with cheap
+    string comparisons on each line instead of being tokenized by the parser.
+    The offsets of the skipped sections are recorded so that they can be
+    parsed later by seeking back into the file.
+    """
+
+    def __init__(self, stream, skip_tags=(), skip_intermediate=False,
+                 offset=0, end=None, wrap=False, calculation_offsets=None):
+        """
+        Args:
+            stream:
+                Open file object, positioned at offset.
+            skip_tags:
+                Tags of the elements to drop, e.g., ["dos", "eigenvalues"].
+            skip_intermediate:
+                If True, only the last top level calculation element is passed
+                on to the parser.
+            offset:
+                Offset of the current position of stream. Recorded section
+                offsets are relative to the start of the (uncompressed) file.
+            end:
+                Offset at which to stop reading. Defaults to None, i.e.,
+                read to the end of the file.
+            wrap:
+                If True, the data is wrapped in a modeling root element so
+                that a fragment of a vasprun.xml can be parsed on its own.
+            calculation_offsets:
+                Offsets of the lines starting the top level calculation
+                elements, e.g., from a SectionIndex. If given together with
+                skip_intermediate, the stream is seeked from the first
+                calculation straight to the final one.
+        """
+        self._stream = stream
+        self._skip_tags = set(skip_tags)
+        self._skip_intermediate = skip_intermediate
+        self._offset = offset
+        self._end = end
+        self._skipping = None
+        self._skip_end = None
+        self._skip_depth = 0
+        self._skip_start = None
+        self._calculation = None
+        self._calculation_open = False
+        self._first_calculation_start = None
+        self._buffer = []
+        self._buffer_size = 0
+        self._done = False
+        self.sections = {}
+        self.nskipped_calculations = 0
+        self._wrap = wrap
+        self._calculation_offsets = calculation_offsets
+        if wrap:
+            self._write("<?xml version=\"1.0\" encoding=\"ISO-8859-1\"?>\n"
+                        "<modeling>\n")
+
+    def _write(self, data):
+        if self._calculation is not None:
+            self._calculation.append(data)
+        else:
+            self._buffer.append(data)
+            self._buffer_size += len(data)
+
+    def _flush_calculation(self):
+        """
+        Passes on the held back calculation, which is the final one.
+        """
+        if self._calculation is not None:
+            calculation = self._calculation
+            self._calculation = None
+            for data in calculation:
+                self._write(data)
+            if self.nskipped_calculations > 0:
+                self.sections["calculation"] = (self._first_calculation_start,
+                                                self._calculation_end)
+
+    def _process_line(self, line):
+        start = self._offset
+        offsets = self._calculation_offsets
+        if offsets and self._skip_intermediate and start == offsets[0] and \
+                len(offsets) > 1 and self._skipping is None:
+            #Jump to the final calculation, as if the others were skipped.
+            self._first_calculation_start = start
+            self.nskipped_calculations = len(offsets) - 1
+            self._offset = offsets[-1]
+            self._stream.seek(self._offset)
+            return
+        self._offset += len(line)
+        if self._skipping is not None:
+            if self._skip_end in line:
+                self._skip_depth -= 1
+                if self._skip_depth == 0:
+                    self.sections[self._skipping] = (self._skip_start,
+                                                     self._offset)
+                    self._skipping = None
+            elif self._get_tag(line) == self._skipping:
+                self._skip_depth += 1
+            return
+        tag = self._get_tag(line)
+        if tag in self._skip_tags:
+            if "/>" in line or "</" + tag + ">" in line:
+                self.sections[tag] = (start, self._offset)
+            else:
+                self._skipping = tag
+                self._skip_end = "</" + tag + ">"
+                self._skip_depth = 1
+                self._skip_start = start
+            return
+        if self._calculation is not None:
+            if self._calculation_open:
+                if "</calculation>" in line:
+                    self._calculation_open = False
+                    self._calculation_end = self._offset
+            elif tag == "calculation":
+                #The held back calculation is not the final one.
+                self._calculation = None
+                self.nskipped_calculations += 1
+            elif line.strip():
+                self._flush_calculation()
+        if self._skip_intermediate and tag == "calculation" and \
+                self._calculation is None:
+            if self._first_calculation_start is None:
+                self._first_calculation_start = start
+            self._calculation = []
+            self._calculation_open = True
+        self._write(line)
+
+    @staticmethod
+    def _get_tag(line):
+        """
+        Returns the name of the element started on a line, or None.
+        """
+        match = _START_TAG_REGEX.match(line)
+        return match.group(1) if match else None
+
+    def read(self, size=-1):
+        while (size < 0 or self._buffer_size < size) and not self._done:
+            if self._end is not None and self._offset >= self._end:
+                line = ""
+            else:
+                line = self._stream.readline()
+            if not line:
+                self._done = True
+                self._flush_calculation()
+                if self._wrap:
+                    self._write("</modeling>\n")
+                break
+            self._process_line(line)
+        data = "".join(self._buffer)
+        if 0 <= size < len(data):
+            self._buffer = [data[size:]]
+            data = data[:size]
+        else:
+            self._buffer = []
+        self._buffer_size = len(self._buffer[0]) if self._buffer else 0
+        return data
+
+    def close(self):
+        self._stream.close()
+
+
+def _wrap_fragment(fragment):
+    """
+    Wraps a fragment of a vasprun.xml into a parseable document.
+    """
+    return "<?xml version=\"1.0\" encoding=\"ISO-8859-1\"?>\n<modeling>\n" + \
+            fragment + "\n</modeling>\n"
+
+
+def _rfind(f, pattern, end, chunk_size):
+    """
+    Returns the offset of the last occurrence of pattern which lies entirely
+    before offset end in a seekable file, or -1 if there is none. The file is
+    read backwards in chunks, so memory usage is bounded by chunk_size.
+    """
+    overlap = ""
+    pos = end
+    while pos > 0:
+        start = max(0, pos - chunk_size)
+        f.seek(start)
+        data = f.read(pos - start) + overlap
+        ind = data.rfind(pattern)
+        if ind >= 0:
+            return start + ind
+        overlap = data[:len(pattern) - 1]
+        pos = start
+    return -1
+
+
+def _find_last_elements(f, end, chunk_size):
+    """
+    Returns the text of the last structure and scstep elements before end
+    in a seekable file, or None if either one is incomplete or missing.
+    """
+    fragments = {}
+    for (start_tag, end_tag) in [("<structure", "</structure>"),
+                                 ("<scstep>", "</scstep>")]:
+        tag_end = _rfind(f, end_tag, end, chunk_size)
+        if tag_end < 0:
+            return None
+        tag_start = _rfind(f, start_tag, tag_end, chunk_size)
+        if tag_start < 0:
+            return None
+        f.seek(tag_start)
+        fragments[end_tag[2:-1]] = f.read(tag_end + len(end_tag) - tag_start)
+    return fragments
+
+
+#Magic bytes marking the start of a gzip member and of a bzip2 stream. A
+#bzip2 stream header is "BZh" and the block size, followed by the block magic.
+_GZIP_MAGIC = ("\x1f\x8b\x08", 0, None)
+_BZ2_MAGIC = ("1AY&SY", 4, re.compile("BZh[1-9]"))
+
+
+def _decompress_tail(filename, magic, new_decompressor, chunk_size):
+    """
+    Decompresses a compressed file backwards member by member, starting from
+    the last member, until the final structure and electronic step are found.
+    Returns None if the file consists of a single member.
+    """
+    (pattern, lead, lead_regex) = magic
+    pieces = []
+    with open(filename, "rb") as f:
+        f.seek(0, 2)
+        member_end = f.tell()
+        search_end = member_end
+        while True:
+            ind = _rfind(f, pattern, search_end, chunk_size)
+            search_end = ind + len(pattern) - 1
+            start = ind - lead
+            if start <= 0:
+                return None
+            if lead_regex is not None:
+                f.seek(start)
+                if not lead_regex.match(f.read(lead)):
+                    continue
+            f.seek(start)
+            data = f.read(member_end - start)
+            out = []
+            try:
+                while data:
+                    decompressor = new_decompressor()
+                    out.append(decompressor.decompress(data))
+                    data = decompressor.unused_data
+            except (IOError, EOFError, ValueError, zlib.error):
+                #Not a real member boundary.
+                continue
+            pieces.insert(0, "".join(out))
+            member_end = start
+            tail = StringIO.StringIO("".join(pieces))
+            tail.seek(0, 2)
+            fragments = _find_last_elements(tail, tail.tell(), chunk_size)
+            if fragments is not None:
+                return fragments
+
+
+def _stream_last_elements(filename):
+    """
+    Streams through a (compressed) file and returns the text of the last
+    structure and scstep elements, keeping only the current element in memory.
+    """
+    fragments = {}
+    current = None
+    with file_open_zip_aware(filename) as f:
+        for line in f:
+            if current is None:
+                stripped = line.strip()
+                if stripped.startswith("<structure"):
+                    (tag, current) = ("structure", [line])
+                elif stripped == "<scstep>":
+                    (tag, current) = ("scstep", [line])
+            else:
+                current.append(line)
+                if line.strip() == "</" + tag + ">":
+                    fragments[tag] = "".join(current)
+                    current = None
+    if "structure" in fragments and "scstep" in fragments:
+        return fragments
+    return None
+
+
+def _read_vasprun_tail(filename, chunk_size):
+    """
+    Returns the text of the last structure and scstep elements of a
+    vasprun.xml as a dict, or None if they cannot be found.
+    """
+    ext = filename.split(".")[-1]
+    if ext.upper() == "BZ2":
+        fragments = _decompress_tail(filename, _BZ2_MAGIC,
+                                     bz2.BZ2Decompressor, chunk_size)
+    elif ext.upper() == "GZ" or ext == "z":
+        fragments = _decompress_tail(filename, _GZIP_MAGIC,
+                                     lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+                                     chunk_size)
+    else:
+        with open(filename, "rb") as f:
+            f.seek(0, 2)
+            return _find_last_elements(f, f.tell(), chunk_size)
+    if fragments is None:
+        fragments = _stream_last_elements(filename)
+    return fragments
+
+
+def _parse_vasprun_head(f, filename):
+    """
+    Parses the input part of an open vasprun.xml, i.e., everything up to and
+    including the atominfo block, leaving f positioned right after it.
+
+    Returns:
+        VasprunHandler holding the input parameters and atomic symbols.
+    """
+    handler = VasprunHandler(filename)
+    head = []
+    for line in f:
+        head.append(line)
+        if line.strip() == "</atominfo>":
+            break
+    head.append("</modeling>\n")
+    xml.sax.parseString("".join(head), handler)
+    return handler
+
+
+def _iter_calculations(filename, start=0, stop=None, step=1,
+                       make_structures=True):
+    """
+    Generator over the calculation elements (ionic steps) of a vasprun.xml.
+    Each selected calculation is parsed on its own, and the eigenvalues and
+    dos are dropped, so memory usage is bounded by the size of a single
+    ionic step. Calculations which are not selected are only scanned for
+    their start tag and never reach the sax parser.
+
+    Yields:
+        (index, handler) for each selected calculation, where index is the
+        index of the ionic step in the run and handler is the VasprunHandler
+        that parsed it.
+    """
+    if step < 1:
+        raise ValueError("step must be a positive integer, got {}."
+                         .format(step))
+    skip_tags = ("eigenvalues", "projected", "dos")
+    with file_open_zip_aware(filename) as f:
+        head = _parse_vasprun_head(f, filename)
+        index = -1
+        lines = None
+        skipping = None
+        for line in f:
+            if lines is None:
+                if "<calculation>" in line:
+                    index += 1
+                    if stop is not None and index >= stop:
+                        break
+                    if index >= start and (index - start) % step == 0:
+                        lines = [line]
+                continue
+            stripped = line.strip()
+            if skipping is not None:
+                if stripped == "</" + skipping + ">":
+                    skipping = None
+                continue
+            tag = _VasprunSectionFilter._get_tag(line)
+            if tag in skip_tags:
+                skipping = tag
+                continue
+            lines.append(line)
+            if stripped == "</calculation>":
+                handler = VasprunHandler(filename)
+                handler.input_read = True
+                handler.atomic_symbols = head.atomic_symbols
+                handler.make_structures = make_structures
+                xml.sax.parseString(_wrap_fragment("".join(lines)), handler)
+                lines = None
+                yield (index, handler)
+
+
+def _get_potcar_names(filename):
+    """
+    Returns the element names from the POTCAR in the same directory as
+    filename, or None if there is no readable POTCAR.
+    """
+    dirname = os.path.dirname(os.path.abspath(filename))
+    if os.path.exists(os.path.join(dirname, "POTCAR")):
+        try:
+            potcar = Potcar.from_file(os.path.join(dirname, "POTCAR"))
+            return [sym.split("_")[0] for sym in potcar.symbols]
+        except:
+            return None
+    return None
+
+
+def _get_cached_array(cache, name):
+    """
+    Returns an optional array from a Vasprun cache as a plain, read-only
+    ndarray backed by the memory map, or None if it is not in the cache.
+    """
+    return np.asarray(cache[name]) if name in cache else None
+
+
+def _get_cache_key(filename):
+    """
+    Returns the (path, size, mtime, sha1) a Vasprun cache is keyed by.
+    """
+    return (os.path.abspath(filename), os.path.getsize(filename),
+            os.path.getmtime(filename), get_file_sha1(filename))
+
+
+def parse_parameters(val_type, val):
+    """
+    Helper function to convert a Vasprun parameter into the proper type.
+    Boolean, int and float types are converted.
+    
+    Args:
+        val_type : Value type parsed from vasprun.xml.
+        val : Actual string value parsed for vasprun.xml.
+    """
+    if val_type == "logical":
+        return (val == "T")
+    elif val_type == "int":
+        return int(val)
+    elif val_type == "string":
+        return val.strip()
+    else:
+        return float(val)
+
+def _parse_v_parameters(val_type, val, filename, param_name):
+    """
+    Helper function to convert a Vasprun array-type parameter into the proper type.
+    Boolean, int and float types are converted.
+    
+    Args:
+        val_type: 
+            Value type parsed from vasprun.xml.
+        val: 
+            Actual string value parsed for vasprun.xml.
+        filename: 
+            Fullpath of vasprun.xml. Used for robust error handling.  E.g.,
+            if vasprun.xml contains *** for some Incar parameters, the code will try
+            to read from an INCAR file present in the same directory.
+        param_name: 
+            Name of parameter.
+            
+    Returns:
+        Parsed value.
+    """
+    if val_type == "logical":
+        val = [True if i == "T" else False for i in re.split("\s+", val)]
+    elif val_type == "int":
+        try:
+            val = [int(i) for i in re.split("\s+", val)]
+        except ValueError:
+            # Fix for stupid error in vasprun sometimes which displays
+            # LDAUL/J as 2****
+            val = _parse_from_incar(filename, param_name)
+            if val == None:
+                raise IOError("Error in parsing vasprun.xml")
+    elif val_type == "string":
+        val = [i for i in re.split("\s+", val)]
+    else:
+        try:
+            val = [float(i) for i in re.split("\s+", val)]
+        except ValueError:
+            # Fix for stupid error in vasprun sometimes which displays
+            # MAGMOM as 2****
+            val = _parse_from_incar(filename, param_name)
+            if val == None:
+                raise IOError("Error in parsing vasprun.xml")
+    return val
+
+def _parse_from_incar(filename, key):
+    """
+    Helper function to parse a parameter from the INCAR.
+    """
+    dirname = os.path.dirname(filename)
+    for f in os.listdir(dirname):
+        if re.search("INCAR", f):
+            warnings.warn("INCAR found. Using " + key + " from INCAR.")
+            incar = Incar.from_file(os.path.join(dirname, f))
+            if key in incar:
+                return incar[key]
+            else:
+                return None
+    return None
+
+
+_vector_pattern = "\( *([-0-9.Ee+]*) *([-0-9.Ee+]*) *([-0-9.Ee+]*) *\)"
+_igpar_ev_pattern = re.compile("(?:Spin component ([12]))? *e<r>_ev="
+                               + _vector_pattern)
+_igpar_bp_pattern = re.compile("^ *e<r>_bp=" + _vector_pattern)
+_dipole_moment_patterns = {
+    "p[elc]=": re.compile("Total electronic dipole moment: *p\[elc\]="
+                          + _vector_pattern),
+    "ionic dipole moment:": re.compile("ionic dipole moment: *p\[ion\]="
+                                       + _vector_pattern),
+    "Ionic dipole moment:": re.compile("Ionic dipole moment: *p\[ion\]="
+                                       + _vector_pattern)}
+
+
+def _get_vector(match):
+    """
+    Returns the last three groups of a regex match as a numpy array.
+    """
+    return np.array([float(match.group(i))
+                     for i in xrange(match.lastindex - 2,
+                                     match.lastindex + 1)])
+
+
+class Outcar(object):
+    """
+    Parser for data in OUTCAR that is not available in Vasprun.xml
+
+    Note, this class works a bit differently than most of the other VaspObjects,
+    since the OUTCAR can be very different depending on which "type of run"
+    performed.
+
+    The OUTCAR is read in a single streaming pass, and only the sections
+    listed in parse_sections are extracted. Each section registers a few
+    literal anchor strings, and a section's reader only runs on the lines
+    containing one of its anchors, consuming the lines of the block that
+    follows if needed. The file is never held in memory.
+
+    Creating the OUTCAR class with a filename reads "regular parameters" that
+    are always present, i.e., Outcar.default_sections.
+    
+    Default attributes:
+        magnetization:
             Magnetization on each ion as a tuple of dict, e.g.,
             ({'d': 0.0, 'p': 0.003, 's': 0.002, 'tot': 0.005}, ... )
             Note that this data is not always present.  LORBIT must be set to
@@ -1799,56 +3297,213 @@ class Outcar(object):
             'Total CPU time used (sec)', 'Elapsed time (sec)',
             'Maximum memory used (kb)', 'Average memory used (kb)',
             'User time (sec)'.
+
+    Attributes of the "ionic_steps" section:
+        positions:
+            numpy array of the cartesian positions of the ions at each ionic
+            step, of shape (nsteps, nions, 3).
+        forces:
+            numpy array of the total forces on the ions at each ionic step,
+            of shape (nsteps, nions, 3).
+        ionic_energies:
+            Dict of numpy arrays of the energies at each ionic step, with
+            the same keys as the ionic steps of Vasprun, i.e., "e_fr_energy",
+            "e_wo_entrp" and "e_0_energy".
     
     One can then call a specific reader depending on the type of run being
     perfromed. These are currently: read_igpar(), read_lepsilon() and
-    read_lcalcpol().
+    read_lcalcpol(). Each of them makes a separate pass over the file, so
+    if several are needed, it is faster to pass "igpar", "lepsilon" or
+    "lcalcpol" in parse_sections instead.
 
     See the documentation of those methods for more documentation.
     
     Authors: Rickard Armiento, Shyue Ping Ong
     
     """
-    def __init__(self, filename):
+
+    #Sections of an OUTCAR which can be parsed.
+    supported_sections = ('charge', 'magnetization', 'is_stopped', 'run_stats',
+                          'ionic_steps', 'igpar', 'lepsilon', 'lcalcpol')
+
+    default_sections = ('charge', 'magnetization', 'is_stopped', 'run_stats')
+
+    #Literal strings marking the lines handled by the reader of each section.
+    _section_anchors = {
+        'charge': ('total charge',),
+        'magnetization': ('magnetization (x)',),
+        'is_stopped': ('soft stop encountered!  aborting job',),
+        'run_stats': ('(sec):', '(kb):'),
+        'ionic_steps': ('TOTAL-FORCE (eV/Angst)',
+                        'FREE ENERGIE OF THE ION-ELECTRON SYSTEM'),
+        'igpar': ('e<r>_ev=', 'e<r>_bp=', 'p[elc]=', 'ionic dipole moment:'),
+        'lepsilon': ('MACROSCOPIC STATIC DIELECTRIC TENSOR',
+                     'PIEZOELECTRIC TENSOR  for field in x, y, z        '
+                     '(e  Angst)',
+                     'BORN EFFECTIVE CHARGES (in e, cummulative output)'),
+        'lcalcpol': ('p[elc]=', 'Ionic dipole moment:')}
+
+    def __init__(self, filename, parse_sections=None, use_index=False):
+        """
+        Args:
+            filename:
+                Filename of OUTCAR.
+            parse_sections:
+                Sequence of sections to parse. Must be a subset of
+                Outcar.supported_sections. Defaults to None, which means
+                Outcar.default_sections.
+            use_index:
+                Set to True to index the lines holding the anchors of all
+                sections in a file next to the OUTCAR (see
+                pymatgen.util.io_utils.SectionIndex). The index is built on
+                the first use, after which sections are parsed by seeking
+                straight to their anchors, both here and in the read_*
+                methods. Defaults to False.
+        """
         self.filename = filename
-        self.is_stopped = False
-        with file_open_zip_aware(filename, "r") as f:
-            lines = f.readlines()
+        self._index = None
+        if use_index:
+            anchors = set()
+            for section_anchors in Outcar._section_anchors.values():
+                anchors.update(section_anchors)
+            self._index = SectionIndex(filename, anchors, persist=True)
+        if parse_sections is None:
+            parse_sections = Outcar.default_sections
+        invalid = set(parse_sections).difference(Outcar.supported_sections)
+        if invalid:
+            raise ValueError("Unknown outcar sections {}".format(
+                                                            sorted(invalid)))
+        self._scan(parse_sections)
+
+    def _scan(self, parse_sections):
+        """
+        Parses parse_sections in a single pass over the file, or by seeking
+        to the indexed anchors. Lines are only passed to the readers of the
+        anchors they contain. A reader may consume further lines of the file,
+        which are then not seen by any other reader.
+        """
+        readers = defaultdict(list)
+        for section in parse_sections:
+            getattr(self, "_init_" + section)()
+            for anchor in Outcar._section_anchors[section]:
+                readers[anchor].append(getattr(self, "_read_" + section))
+        if self._index is not None:
+            with file_open_zip_aware(self.filename, "rb") as f:
+                for (anchor, line, lines) in \
+                        self._index.iter_sections(f, readers.keys()):
+                    for reader in readers[anchor]:
+                        reader(anchor, line, lines)
+        else:
+            anchors = re.compile("|".join([re.escape(a) for a in readers]))
+            with file_open_zip_aware(self.filename, "r") as f:
+                for line in f:
+                    m = anchors.search(line)
+                    if m:
+                        for reader in readers[m.group(0)]:
+                            reader(m.group(0), line, f)
+        for section in parse_sections:
+            finish = getattr(self, "_finish_" + section, None)
+            if finish is not None:
+                finish()
 
-        read_charge = False
-        read_mag = False
-        charge = []
-        mag = []
+    @staticmethod
+    def _read_ion_table(f):
+        """
+        Reads a table of charges or magnetizations on each ion, returning a
+        tuple of dicts of {orbital: value}. The table ends with the line of
+        totals, which is missing if there is only one ion.
+        """
         header = []
-        run_stats = {}
-        for line in lines:
+        table = []
+        for line in f:
             clean = line.strip()
-            if clean == "total charge":
-                read_charge = True
-                charge = []
-            elif clean == "magnetization (x)":
-                read_mag = True
-                mag = []
-            elif read_charge or read_mag:
-                if clean.startswith("# of ion"):
-                    header = re.split("\s{2,}", line.strip())
-                elif clean.startswith("tot"):
-                    read_charge = False
-                    read_mag = False
-                else:
-                    m = re.match("\s*(\d+)\s+(([\d\.\-]+)\s+)+", clean)
-                    if m:
-                        to_append = charge if read_charge else mag
-                        data = re.findall("[\d\.\-]+", clean)
-                        to_append.append({header[i]:float(data[i]) for i in xrange(1, len(header))})
-            elif line.find('soft stop encountered!  aborting job') != -1:
-                self.is_stopped = True
-            elif re.search("\((sec|kb)\):", line):
-                tok = line.strip().split(":")
-                run_stats[tok[0].strip()] = float(tok[1].strip())
-        self.run_stats = run_stats
-        self.magnetization = tuple(mag)
-        self.charge = tuple(charge)
+            if clean.startswith("# of ion"):
+                header = re.split("\s{2,}", clean)
+            elif clean.startswith("tot") or (header and not clean):
+                break
+            elif clean[:1].isdigit():
+                data = clean.split()
+                table.append({header[i]: float(data[i])
+                              for i in xrange(1, len(header))})
+        return tuple(table)
+
+    def _init_charge(self):
+        self.charge = tuple()
+
+    def _read_charge(self, anchor, line, f):
+        if line.strip() == "total charge":
+            self.charge = Outcar._read_ion_table(f)
+
+    def _init_magnetization(self):
+        self.magnetization = tuple()
+
+    def _read_magnetization(self, anchor, line, f):
+        if line.strip() == "magnetization (x)":
+            self.magnetization = Outcar._read_ion_table(f)
+
+    def _init_is_stopped(self):
+        self.is_stopped = False
+
+    def _read_is_stopped(self, anchor, line, f):
+        self.is_stopped = True
+
+    def _init_run_stats(self):
+        self.run_stats = {}
+
+    def _read_run_stats(self, anchor, line, f):
+        tok = line.strip().split(":")
+        self.run_stats[tok[0].strip()] = float(tok[1].strip())
+
+    def _init_ionic_steps(self):
+        self._ionic_data = []
+        self._ionic_energies = []
+
+    def _read_ionic_steps(self, anchor, line, f):
+        if anchor == "TOTAL-FORCE (eV/Angst)":
+            next(f)
+            rows = []
+            for line in f:
+                if line.strip().startswith("---"):
+                    break
+                rows.append(line)
+            data = np.fromstring(" ".join(rows), sep=" ")
+            self._ionic_data.append(data.reshape((len(rows), 6)))
+        else:
+            energies = {}
+            for line in f:
+                if "TOTEN" in line:
+                    energies["e_fr_energy"] = float(line.split("=")[1].split()[0])
+                elif "energy(sigma->0)" in line:
+                    toks = line.split("=")
+                    energies["e_wo_entrp"] = float(toks[1].split()[0])
+                    energies["e_0_energy"] = float(toks[2])
+                    break
+            self._ionic_energies.append(energies)
+
+    def _finish_ionic_steps(self):
+        if self._ionic_data:
+            data = np.array(self._ionic_data)
+        else:
+            data = np.zeros((0, 0, 6))
+        self.positions = data[:, :, :3]
+        self.forces = data[:, :, 3:]
+        self.ionic_energies = {k: np.array([e.get(k, np.nan)
+                                            for e in self._ionic_energies])
+                               for k in ("e_fr_energy", "e_wo_entrp",
+                                         "e_0_energy")}
+        del self._ionic_data
+        del self._ionic_energies
+
+    def _read_dipole_moment(self, anchor, line):
+        """
+        Sets the electronic or ionic dipole moment from a line.
+        """
+        m = _dipole_moment_patterns[anchor].search(line)
+        if m:
+            if anchor == "p[elc]=":
+                self.p_elc = _get_vector(m)
+            else:
+                self.p_ion = _get_vector(m)
 
     def read_igpar(self):
         """ 
@@ -1863,139 +3518,140 @@ class Outcar(object):
         (See VASP section 'LBERRY,  IGPAR,  NPPSTR,  DIPOL tags' for info on
         what these are).
         """
-
-        # variables to be filled
-        self.er_ev = {}  #  will  be  dict (Spin.up/down) of array(3*float)
-        self.er_bp = {}  #  will  be  dics (Spin.up/down) of array(3*float)
-        self.er_ev_tot = None # will be array(3*float)
-        self.er_bp_tot = None # will be array(3*float)
-        self.p_elec = None
-        self.p_ion = None
         try:
-            search = []
-            # Nonspin cases
-            def er_ev(results, match): results.er_ev[Spin.up] = np.array([float(match.group(1)), float(match.group(2)), float(match.group(3))]) / 2.0; results.er_ev[Spin.down] = results.er_ev[Spin.up]; results.context = 2
-            search.append(['^ *e<r>_ev=\( *([-0-9.Ee+]*) *([-0-9.Ee+]*) *([-0-9.Ee+]*) *\)', None, er_ev])
-
-            def er_bp(results, match): results.er_bp[Spin.up] = np.array([float(match.group(1)), float(match.group(2)), float(match.group(3))]) / 2.0; results.er_bp[Spin.down] = results.er_bp[Spin.up]
-            search.append(['^ *e<r>_bp=\( *([-0-9.Ee+]*) *([-0-9.Ee+]*) *([-0-9.Ee+]*) *\)', lambda results, line: results.context == 2, er_bp])
-
-            # Spin cases
-            def er_ev_up(results, match): results.er_ev[Spin.up] = np.array([float(match.group(1)), float(match.group(2)), float(match.group(3))]); results.context = Spin.up
-            search.append(['^.*Spin component 1 *e<r>_ev=\( *([-0-9.Ee+]*) *([-0-9.Ee+]*) *([-0-9.Ee+]*) *\)', None, er_ev_up])
-
-            def er_bp_up(results, match): results.er_bp[Spin.up] = np.array([float(match.group(1)), float(match.group(2)), float(match.group(3))])
-            search.append(['^ *e<r>_bp=\( *([-0-9.Ee+]*) *([-0-9.Ee+]*) *([-0-9.Ee+]*) *\)', lambda results, line: results.context == Spin.up, er_bp_up])
-
-            def er_ev_dn(results, match): results.er_ev[Spin.down] = np.array([float(match.group(1)), float(match.group(2)), float(match.group(3))]); results.context = Spin.down
-            search.append(['^.*Spin component 2 *e<r>_ev=\( *([-0-9.Ee+]*) *([-0-9.Ee+]*) *([-0-9.Ee+]*) *\)', None, er_ev_dn])
-
-            def er_bp_dn(results, match): results.er_bp[Spin.down] = np.array([float(match.group(1)), float(match.group(2)), float(match.group(3))])
-            search.append(['^ *e<r>_bp=\( *([-0-9.Ee+]*) *([-0-9.Ee+]*) *([-0-9.Ee+]*) *\)', lambda results, line: results.context == Spin.down, er_bp_dn])
-
-            # Always present spin/non-spin
-            def p_elc(results, match): results.p_elc = np.array([float(match.group(1)), float(match.group(2)), float(match.group(3))])
-            search.append(['^.*Total electronic dipole moment: *p\[elc\]=\( *([-0-9.Ee+]*) *([-0-9.Ee+]*) *([-0-9.Ee+]*) *\)', None, p_elc])
-
-            def p_ion(results, match): results.p_ion = np.array([float(match.group(1)), float(match.group(2)), float(match.group(3))])
-            search.append(['^.*ionic dipole moment: *p\[ion\]=\( *([-0-9.Ee+]*) *([-0-9.Ee+]*) *([-0-9.Ee+]*) *\)', None, p_ion])
-
-            self.context = None
-            self.er_ev = {Spin.up: None, Spin.down: None}
-            self.er_bp = {Spin.up: None, Spin.down: None}
-
-            micro_pyawk(self.filename, search, self)
-
-            if self.er_ev[Spin.up] != None and self.er_ev[Spin.down] != None:
-                self.er_ev_tot = self.er_ev[Spin.up] + self.er_ev[Spin.down]
-
-            if self.er_bp[Spin.up] != None and self.er_bp[Spin.down] != None:
-                self.er_bp_tot = self.er_bp[Spin.up] + self.er_bp[Spin.down]
-
+            self._scan(["igpar"])
         except:
             self.er_ev_tot = None
             self.er_bp_tot = None
             raise Exception("IGPAR OUTCAR could not be parsed.")
 
-    def read_lepsilon(self):
-        # variables to be filled
-        try:
-            search = []
-
-            def dielectric_section_start(results, match): results.dielectric_index = -1;
-            search.append(['MACROSCOPIC STATIC DIELECTRIC TENSOR', None, dielectric_section_start])
-
-            def dielectric_section_start2(results, match): results.dielectric_index = 0
-            search.append(['-------------------------------------', lambda results, line: results.dielectric_index == -1, dielectric_section_start2])
-
-            def dielectric_data(results, match): results.dielectric_tensor[results.dielectric_index, :] = np.array([float(match.group(1)), float(match.group(2)), float(match.group(3))]); results.dielectric_index += 1
-            search.append(['^ *([-0-9.Ee+]+) +([-0-9.Ee+]+) +([-0-9.Ee+]+) *$', lambda results, line: results.dielectric_index >= 0, dielectric_data])
-
-            def dielectric_section_stop(results, match): results.dielectric_index = None
-            search.append(['-------------------------------------', lambda results, line: results.dielectric_index >= 1, dielectric_section_stop])
-
-            self.dielectric_index = None
-            self.dielectric_tensor = np.zeros((3, 3))
-
-
-            def piezo_section_start(results, match): results.piezo_index = 0;
-            search.append(['PIEZOELECTRIC TENSOR  for field in x, y, z        \(e  Angst\)', None, piezo_section_start])
-
-            def piezo_data(results, match): results.piezo_tensor[results.piezo_index, :] = np.array([float(match.group(1)), float(match.group(2)), float(match.group(3)), float(match.group(4)), float(match.group(5)), float(match.group(6))]); results.piezo_index += 1
-            search.append(['^ *[xyz] +([-0-9.Ee+]+) +([-0-9.Ee+]+) +([-0-9.Ee+]+) *([-0-9.Ee+]+) +([-0-9.Ee+]+) +([-0-9.Ee+]+)*$', lambda results, line: results.piezo_index >= 0, piezo_data])
-
-            def piezo_section_stop(results, match): results.piezo_index = None
-            search.append(['-------------------------------------', lambda results, line: results.piezo_index >= 1, piezo_section_stop])
-
-            self.piezo_index = None
-            self.piezo_tensor = np.zeros((3, 6))
-
-
-            def born_section_start(results, match): results.born_ion = -1;
-            search.append(['BORN EFFECTIVE CHARGES \(in e, cummulative output\)', None, born_section_start])
-
-            def born_ion(results, match): results.born_ion = int(match.group(1)) - 1; results.born[results.born_ion] = np.zeros((3, 3));
-            search.append(['ion +([0-9]+)', lambda results, line: results.born_ion != None, born_ion])
-
-            def born_data(results, match): results.born[results.born_ion][int(match.group(1)) - 1, :] = np.array([float(match.group(2)), float(match.group(3)), float(match.group(4))]);
-            search.append(['^ *([1-3]+) +([-0-9.Ee+]+) +([-0-9.Ee+]+) +([-0-9.Ee+]+)$', lambda results, line: results.born_ion >= 0, born_data])
-
-            def born_section_stop(results, match): results.born_index = None
-            search.append(['-------------------------------------', lambda results, line: results.born_ion >= 1, born_section_stop])
-
-            self.born_ion = None
-            self.born = {}
-
-            #def debug_print(results,match): print "MATCH:",match.group(0),':',results.born_ion
-            #micro_pyawk(filename,search,self,debug=debug_print, postdebug=debug_print)
+    def _init_igpar(self):
+        self.er_ev = {Spin.up: None, Spin.down: None}
+        self.er_bp = {Spin.up: None, Spin.down: None}
+        self.er_ev_tot = None
+        self.er_bp_tot = None
+        self.p_elec = None
+        self.p_ion = None
+        self._igpar_context = None
+
+    def _read_igpar(self, anchor, line, f):
+        if anchor == "e<r>_ev=":
+            m = _igpar_ev_pattern.search(line)
+            if not m:
+                return
+            #The following e<r>_bp is assigned to the same spins, and is
+            #halved over both spins for non spin polarized runs.
+            if m.group(1) == "1":
+                self._igpar_context = ([Spin.up], 1.0)
+            elif m.group(1) == "2":
+                self._igpar_context = ([Spin.down], 1.0)
+            elif line.lstrip().startswith("e<r>_ev="):
+                self._igpar_context = ([Spin.up, Spin.down], 0.5)
+            else:
+                return
+            vector = _get_vector(m) * self._igpar_context[1]
+            for spin in self._igpar_context[0]:
+                self.er_ev[spin] = vector
+        elif anchor == "e<r>_bp=":
+            m = _igpar_bp_pattern.match(line)
+            if m and self._igpar_context is not None:
+                vector = _get_vector(m) * self._igpar_context[1]
+                for spin in self._igpar_context[0]:
+                    self.er_bp[spin] = vector
+        else:
+            self._read_dipole_moment(anchor, line)
 
-            micro_pyawk(self.filename, search, self)
+    def _finish_igpar(self):
+        del self._igpar_context
+        if self.er_ev[Spin.up] is not None and \
+                self.er_ev[Spin.down] is not None:
+            self.er_ev_tot = self.er_ev[Spin.up] + self.er_ev[Spin.down]
+        if self.er_bp[Spin.up] is not None and \
+                self.er_bp[Spin.down] is not None:
+            self.er_bp_tot = self.er_bp[Spin.up] + self.er_bp[Spin.down]
 
+    def read_lepsilon(self):
+        """
+        Renders accessible:
+            dielectric_tensor = 3x3 numpy array of the macroscopic static
+                dielectric tensor
+            piezo_tensor = 3x6 numpy array of the piezoelectric tensor
+            born = dict of {ion index: 3x3 numpy array of the Born effective
+                charges}
+        """
+        try:
+            self._scan(["lepsilon"])
         except:
             raise Exception("LEPSILON OUTCAR could not be parsed.")
 
+    def _init_lepsilon(self):
+        self.dielectric_tensor = np.zeros((3, 3))
+        self.piezo_tensor = np.zeros((3, 6))
+        self.born = {}
+
+    def _read_lepsilon(self, anchor, line, f):
+        if anchor.startswith("MACROSCOPIC"):
+            i = None
+            for line in f:
+                toks = line.split()
+                if "-------------------------------------" in line:
+                    if i:
+                        break
+                    i = 0
+                elif i is not None and len(toks) == 3:
+                    self.dielectric_tensor[i, :] = [float(t) for t in toks]
+                    i += 1
+        elif anchor.startswith("PIEZOELECTRIC"):
+            i = 0
+            for line in f:
+                toks = line.split()
+                if toks and toks[0] in ("x", "y", "z") and len(toks) == 7:
+                    self.piezo_tensor[i, :] = [float(t) for t in toks[1:]]
+                    i += 1
+                elif i > 0 and "-------------------------------------" in line:
+                    break
+        else:
+            ion = None
+            for line in f:
+                toks = line.split()
+                if toks and toks[0] == "ion":
+                    ion = int(toks[1]) - 1
+                    self.born[ion] = np.zeros((3, 3))
+                elif ion is not None and len(toks) == 4:
+                    self.born[ion][int(toks[0]) - 1, :] = \
+                        [float(t) for t in toks[1:]]
+                elif ion is not None and \
+                        "-------------------------------------" in line:
+                    break
+
     def read_lcalcpol(self):
-        # variables to be filled
-        self.p_elec = None
-        self.p_ion = None
+        """
+        Renders accessible:
+            p_elc = total electronic dipole moment
+            p_ion = ionic dipole moment
+        """
         try:
-            search = []
-
-            # Always present spin/non-spin
-            def p_elc(results, match): results.p_elc = np.array([float(match.group(1)), float(match.group(2)), float(match.group(3))])
-            search.append(['^.*Total electronic dipole moment: *p\[elc\]=\( *([-0-9.Ee+]*) *([-0-9.Ee+]*) *([-0-9.Ee+]*) *\)', None, p_elc])
-
-            def p_ion(results, match): results.p_ion = np.array([float(match.group(1)), float(match.group(2)), float(match.group(3))])
-            search.append(['^.*Ionic dipole moment: *p\[ion\]=\( *([-0-9.Ee+]*) *([-0-9.Ee+]*) *([-0-9.Ee+]*) *\)', None, p_ion])
-
-            micro_pyawk(self.filename, search, self)
-
+            self._scan(["lcalcpol"])
         except:
             raise Exception("CLACLCPOL OUTCAR could not be parsed.")
 
+    def _init_lcalcpol(self):
+        self.p_elec = None
+        self.p_ion = None
+
+    def _read_lcalcpol(self, anchor, line, f):
+        self._read_dipole_moment(anchor, line)
+
 class VolumetricData(object):
     """
     Simple volumetric object for reading LOCPOT and CHGCAR type files.
+
+    Volumetric data can also be stored in a binary format with write_binary
+    and loaded with VolumetricData.from_binary, in which case the grids are
+    memory-mapped. Slicing a sub-volume of such a grid, e.g.,
+    data[Spin.up][:, :, 10:20], only reads the pages of the file holding it.
+    Grids are stored with the x index running fastest, as in the VASP files,
+    so slabs along z are contiguous on disk.
     
     Attributes:
         name:
@@ -2008,19 +3664,31 @@ class VolumetricData(object):
             Tuple of dimensions of volumetric grid in each direction, 
             (nx, ny, nz)
         data:
-            Actual data as a dict of {grid coordinate: value}. Grid coordinate
-            is a (x,y,z) tuple.
+            Actual data as a dict of {Spin: array}, where the arrays have
+            shape dim and are indexed by grid coordinate, e.g.,
+            data[Spin.up][x, y, z].
         ngridpts:
             Total number of grid points in volumetric data.
     """
-    def __init__(self, filename):
+
+    #Version of the binary format written by write_binary.
+    binary_format_version = 1
+
+    def __init__(self, filename=None):
+        """
+        Args:
+            filename:
+                Name of file containing the volumetric data in VASP format.
+                Defaults to None, which creates an empty object.
+        """
         self.name = str()
         self.poscar = None
         self.spinpolarized = False
         self.dim = None
         self.data = dict()
         self.ngridpts = 0
-        self._read_file(filename)
+        if filename is not None:
+            self._read_file(filename)
 
     def __add__(self, other):
         return self.linear_add(other, 1.0)
@@ -2034,72 +3702,344 @@ class VolumetricData(object):
         operators as well.
         '''
         #To add checks
-        summed = VolumetricData()
+        summed = self.__class__()
         summed.name = self.name
         summed.poscar = self.poscar
         summed.spinpolarized = self.spinpolarized
         summed.dim = self.dim
-        summed.numpts = self.ngridpts
+        summed.ngridpts = self.ngridpts
         for spin in self.data.keys():
-            summed.data[spin] = self.data[spin] + scalefactor * other.data[spin]
+            #Only a single new array is allocated for each spin.
+            data = np.multiply(other.data[spin], scalefactor)
+            summed.data[spin] = np.add(self.data[spin], data, out=data)
         return summed
 
+    def _get_file_data(self):
+        """
+        Returns the grids in the order they are written in the VASP file.
+        """
+        return [self.data[spin] for spin in (Spin.up, Spin.down)
+                if spin in self.data]
+
+    def write_file(self, filename, chunk_size=100000):
+        """
+        Writes the volumetric data to a file in the VASP text format. Data
+        which is not parsed, e.g., the augmentation occupancies of a CHGCAR,
+        is not written.
+
+        Args:
+            filename:
+                Filename to write to.
+            chunk_size:
+                Number of grid points formatted at a time. Defaults to
+                100000.
+        """
+        nperline = 5
+        chunk_size -= chunk_size % nperline
+        dimensionline = "".join(["{:5d}".format(i) for i in self.dim])
+        with open(filename, "w") as f:
+            f.write(self.poscar.get_string() + "\n\n")
+            for grid in self._get_file_data():
+                f.write(dimensionline + "\n")
+                values = np.ravel(grid, order="F")
+                for i in xrange(0, len(values), chunk_size):
+                    chunk = values[i:i + chunk_size]
+                    lines = [" %17.11E" * nperline] * (len(chunk) // nperline)
+                    if len(chunk) % nperline:
+                        lines.append(" %17.11E" * (len(chunk) % nperline))
+                    f.write(("\n".join(lines) + "\n") % tuple(chunk))
+
+    def write_binary(self, filename):
+        """
+        Writes the volumetric data to a binary file, which can be loaded
+        with VolumetricData.from_binary. The file is an uncompressed numpy
+        .npz archive holding a header and the raw float64 grid for each spin.
+
+        Args:
+            filename:
+                Filename to write to. Note that numpy adds a .npz extension
+                if filename does not have one.
+        """
+        header = {"version": VolumetricData.binary_format_version,
+                  "type": self.__class__.__name__, "name": self.name,
+                  "poscar": self.poscar.get_string(), "dim": list(self.dim),
+                  "spinpolarized": self.spinpolarized,
+                  "spins": [int(spin) for spin in self.data.keys()]}
+        arrays = {"header": np.fromstring(json.dumps(header), dtype=np.uint8)}
+        for (spin, grid) in self.data.items():
+            arrays["data_" + str(spin)] = np.asfortranarray(grid)
+        np.savez(filename, **arrays)
+
+    @staticmethod
+    def from_binary(filename):
+        """
+        Loads volumetric data written by write_binary. The grids are
+        read-only memory maps into the file, so data is only read from disk
+        when it is accessed.
+
+        Args:
+            filename:
+                Filename of binary volumetric data.
+
+        Returns:
+            VolumetricData, or Locpot or Chgcar if the data was written from
+            one of these.
+        """
+        arrays = load_npz_mmap(filename)
+        header = json.loads(arrays["header"].tostring())
+        if header["version"] != VolumetricData.binary_format_version:
+            raise ValueError("Unsupported binary volumetric data version "
+                             "{}".format(header["version"]))
+        classes = {"VolumetricData": VolumetricData, "Locpot": Locpot,
+                   "Chgcar": Chgcar}
+        volumetric_data = classes[header["type"]]()
+        volumetric_data.name = header["name"]
+        volumetric_data.poscar = Poscar.from_string(header["poscar"])
+        volumetric_data.dim = tuple(header["dim"])
+        volumetric_data.ngridpts = int(np.prod(header["dim"]))
+        volumetric_data.spinpolarized = header["spinpolarized"]
+        for spin in header["spins"]:
+            spin = Spin.from_int(spin)
+            volumetric_data.data[spin] = arrays["data_" + str(spin)]
+        return volumetric_data
+
+    def _get_grid(self, spin):
+        """
+        Returns the grid for spin, or the first grid in the file, i.e., the
+        total, if spin is None.
+        """
+        return self._get_file_data()[0] if spin is None else self.data[spin]
+
+    def _get_sphere_points(self, ind, radius):
+        """
+        Returns the flattened (Fortran ordered) indices and the distances of
+        all grid points within radius of site ind. Only the sub-box of grid
+        points enclosing the sphere is examined. If the sphere is larger than
+        the cell, a grid point appears once for each of its images within
+        the sphere.
+        """
+        structure = self.poscar.struct
+        matrix = structure.lattice.matrix
+        dim = np.array(self.dim)
+        fcoords = structure[ind].frac_coords
+        # Half-widths of the sub-box in fractional coordinates.
+        extent = radius * np.sqrt((np.linalg.inv(matrix) ** 2).sum(axis=0))
+        lower = np.floor((fcoords - extent) * dim).astype(int)
+        upper = np.ceil((fcoords + extent) * dim).astype(int)
+        grid_ind = [np.arange(lower[i], upper[i] + 1) for i in xrange(3)]
+        frac = [grid_ind[i] / dim[i] - fcoords[i] for i in xrange(3)]
+        cart = frac[0][:, None, None, None] * matrix[0] \
+            + frac[1][None, :, None, None] * matrix[1] \
+            + frac[2][None, None, :, None] * matrix[2]
+        dist = np.sqrt((cart ** 2).sum(axis=-1))
+        within = dist < radius
+        (x, y, z) = [grid_ind[i] % dim[i] for i in xrange(3)]
+        flat_ind = x[:, None, None] + dim[0] * (y[None, :, None]
+                                                + dim[1] * z[None, None, :])
+        return (flat_ind[within], dist[within])
+
+    def get_average_along_axis(self, ind, spin=None):
+        """
+        Get the average of the data over the planes of grid points
+        perpendicular to a lattice axis.
+
+        Args:
+            ind:
+                Index of axis.
+            spin:
+                Spin of the grid to average. Defaults to None, which uses
+                the first grid in the file, e.g., the total density of a
+                CHGCAR.
+
+        Returns:
+            numpy array of length dim[ind] of the averages.
+        """
+        axes = tuple(i for i in xrange(3) if i != ind)
+        return self._get_grid(spin).mean(axis=axes)
+
+    def get_planar_average(self, miller_index, nbins=None, spin=None):
+        """
+        Get the average of the data over the (hkl) lattice planes, as a
+        function of the distance along the plane normal. The profile spans
+        one interplanar spacing.
+
+        Args:
+            miller_index:
+                Miller index of the planes, e.g., (0, 0, 1) for planes
+                perpendicular to c in an orthogonal cell.
+            nbins:
+                Number of bins along the normal. Defaults to None, which
+                uses one bin for each distinct plane of grid points.
+            spin:
+                Spin of the grid to average. Defaults to None, which uses
+                the first grid in the file.
+
+        Returns:
+            (distances, averages) numpy arrays. Distances are in Angstroms
+            from the plane through the origin. Bins which contain no grid
+            points have an average of nan.
+        """
+        (na, nb, nc) = self.dim
+        miller_index = np.array(miller_index, dtype=int)
+        # Position of each grid point along the normal, in units of
+        # 1 / ngridpts of the interplanar spacing.
+        steps = miller_index * np.array([nb * nc, na * nc, na * nb])
+        if nbins is None:
+            nbins = self.ngridpts // reduce(gcd, [self.ngridpts]
+                                            + [abs(int(i)) for i in steps])
+        (x, y, z) = np.ogrid[0:na, 0:nb, 0:nc]
+        position = (x * steps[0] + y * steps[1] + z * steps[2]) \
+            % self.ngridpts
+        bins = np.ravel(position * nbins // self.ngridpts, order="F")
+        weights = np.ravel(self._get_grid(spin), order="F")
+        with np.errstate(invalid="ignore", divide="ignore"):
+            averages = np.bincount(bins, weights=weights, minlength=nbins) \
+                / np.bincount(bins, minlength=nbins)
+        recp_matrix = np.linalg.inv(self.poscar.struct.lattice.matrix).T
+        spacing = 1 / np.linalg.norm(np.dot(miller_index, recp_matrix))
+        return (np.arange(nbins) * spacing / nbins, averages)
+
+    def get_macroscopic_average(self, miller_index, window, nbins=None,
+                                spin=None):
+        """
+        Get the macroscopic average of the data, i.e., the planar average of
+        get_planar_average further averaged over a sliding window along the
+        plane normal. The window is applied periodically, as a convolution
+        computed by FFT. For the macroscopic average of a LOCPOT across an
+        interface, window is typically the interplanar spacing of the bulk
+        materials.
+
+        Args:
+            miller_index:
+                Miller index of the planes.
+            window:
+                Width of the averaging window in Angstroms.
+            nbins:
+                Number of bins along the normal. See get_planar_average.
+            spin:
+                Spin of the grid to average. Defaults to None, which uses
+                the first grid in the file.
+
+        Returns:
+            (distances, averages) numpy arrays, as for get_planar_average.
+        """
+        (distances, planar) = self.get_planar_average(miller_index, nbins,
+                                                      spin)
+        n = len(distances)
+        step = distances[1] if n > 1 else window
+        # Box kernel centered on the origin, with the bins straddling its
+        # edges weighted by the fraction of the bin inside the window. Parts
+        # of the window beyond one period wrap around.
+        half_width = window / 2 / step
+        offsets = np.arange(-int(half_width) - 1, int(half_width) + 2)
+        weights = np.clip(half_width - np.abs(offsets) + 0.5, 0, 1)
+        kernel = np.bincount(offsets % n, weights=weights, minlength=n)
+        kernel /= kernel.sum()
+        averages = np.fft.irfft(np.fft.rfft(planar) * np.fft.rfft(kernel), n)
+        return (distances, averages)
+
+    def get_radial_profile(self, ind, radius, nbins=50, spin=None):
+        """
+        Get the spherical average of the data around a site, as a function
+        of distance from the site.
+
+        Args:
+            ind:
+                Index of site.
+            radius:
+                Maximum distance in Angstroms.
+            nbins:
+                Number of radial bins. Defaults to 50.
+            spin:
+                Spin of the grid to average. Defaults to None, which uses
+                the first grid in the file.
+
+        Returns:
+            (distances, averages) numpy arrays. Distances are the centers of
+            the bins. Bins which contain no grid points have an average of
+            nan.
+        """
+        (points, dist) = self._get_sphere_points(ind, radius)
+        bins = np.minimum((dist * nbins / radius).astype(int), nbins - 1)
+        weights = np.ravel(self._get_grid(spin), order="F")[points]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            averages = np.bincount(bins, weights=weights, minlength=nbins) \
+                / np.bincount(bins, minlength=nbins)
+        return ((np.arange(nbins) + 0.5) * radius / nbins, averages)
+
     def _read_file(self, filename):
+        #The file is read line by line, so that compressed files are streamed
+        #and only the parsed grids are held in memory.
+        with file_open_zip_aware(filename) as f:
+            # The POSCAR part ends at the first blank line
+            poscar_lines = []
+            for line in f:
+                if line.strip() == "":
+                    break
+                poscar_lines.append(line)
+            self.poscar = Poscar.from_string("".join(poscar_lines),
+                                             _get_potcar_names(filename))
+
+            # Skip whitespace between POSCAR and LOCPOT data
+            for line in f:
+                if line.strip() != "":
+                    break
+            dimensionline = line.strip()
+
+            # Read three numbers that is the dimension
+            dimensionexpr = re.compile('([0-9]+) +([0-9]+) +([0-9]+)')
+            m = dimensionexpr.match(dimensionline)
+            a = (int(m.group(1)), int(m.group(2)), int(m.group(3)))
+            self.dim = a
+            self.ngridpts = a[0] * a[1] * a[2]
+            uppot = _read_volumetric_grid(f, a)
+
+            # Search for the second dimension line, where the next spin starts
+            spinpolarized = False
+            for line in f:
+                if line.strip() == dimensionline:
+                    spinpolarized = True
+                    break
+            self.spinpolarized = spinpolarized
+            if spinpolarized:
+                downpot = _read_volumetric_grid(f, a)
+                self.data = {Spin.up:uppot, Spin.down:downpot}
+            else:
+                self.data = {Spin.up:uppot}
 
-        reader = file_open_zip_aware(filename)
-        lines = reader.readlines()
-        reader.close()
-
-        self.poscar = Poscar.from_file(filename)
-
-        # Skip whitespace between POSCAR and LOCPOT data
-        i = 0
-        while lines[i].strip() != "":
-            i += 1
-        while lines[i].strip() == "":
-            i += 1
-
-        dimensionline = lines[i].strip()
-        i += 1
-        spinpolarized = False
-        # Search for the second dimension line, where the next spin starts
-        for j in xrange(i, len(lines)):
-            if(dimensionline == lines[j].strip()):
-                spinpolarized = True
-                break
 
-        if not spinpolarized:
-            j = j + 2
-
-        self.spinpolarized = spinpolarized
-
-        # Read three numbers that is the dimension
-        dimensionexpr = re.compile('([0-9]+) +([0-9]+) +([0-9]+)')
-        m = dimensionexpr.match(dimensionline.strip())
-        a = (int(m.group(1)), int(m.group(2)), int(m.group(3)))
-        data = (" ".join(lines[i:j - 1])).split()
-        data = data[:(a[0] * a[1] * a[2])]
-
-        self.dim = a
-        self.ngridpts = self.dim[0] * self.dim[1] * self.dim[2]
-        uppot = np.zeros((a[0], a[1], a[2]))
-        count = 0
-        for z in xrange(a[2]):
-            for y in xrange(a[1]):
-                for x in xrange(a[0]):
-                    uppot[x, y, z] = float(data[count])
-                    count += 1
-        if spinpolarized:
-            data = (" ".join(lines[j + 1:])).split()
-            data = data[:(a[0] * a[1] * a[2])]
-            downpot = np.zeros((a[0], a[1], a[2]))
-            count = 0
-            for (z, y, x) in itertools.product(xrange(a[2]), xrange(a[1]), xrange(a[0])):
-                downpot[x, y, z] = float(data[count])
-                count += 1
-            self.data = {Spin.up:uppot, Spin.down:downpot}
+def _read_volumetric_grid(f, dim, chunk_size=10000):
+    """
+    Reads a grid of volumetric data from an open file, positioned after the
+    dimension line, into an array of shape dim. The data is written with the
+    x index running fastest, i.e., in Fortran order. Lines are parsed in bulk
+    in chunks of chunk_size lines, and reading stops at the line holding the
+    last grid point.
+    """
+    ngridpts = dim[0] * dim[1] * dim[2]
+    data = np.empty(ngridpts)
+    count = 0
+    nperline = None
+    while count < ngridpts:
+        if nperline is None:
+            lines = list(itertools.islice(f, 1))
         else:
-            self.data = {Spin.up:uppot}
+            nlines = -(-(ngridpts - count) // nperline)
+            lines = list(itertools.islice(f, min(nlines, chunk_size)))
+        if not lines:
+            raise IOError("Volumetric data ended after {} of {} grid "
+                          "points".format(count, ngridpts))
+        values = np.fromstring(" ".join(lines), sep=" ")
+        if nperline is None:
+            nperline = max(len(values), 1)
+        #Only the last line of the grid may be incomplete.
+        elif len(values) < min((len(lines) - 1) * nperline + 1,
+                               ngridpts - count):
+            raise ValueError("Invalid volumetric data")
+        values = values[:ngridpts - count]
+        data[count:count + len(values)] = values
+        count += len(values)
+    return data.reshape(dim, order="F")
 
 
 class Locpot(VolumetricData):
@@ -2107,11 +4047,12 @@ class Locpot(VolumetricData):
     Simple object for reading a LOCPOT file.
     """
 
-    def __init__(self, filename):
+    def __init__(self, filename=None):
         """
         Args:
             filename:
-                Name of file containing LOCPOT.
+                Name of file containing LOCPOT. Defaults to None, which
+                creates an empty object.
         """
         super(Locpot, self).__init__(filename)
 
@@ -2126,51 +4067,34 @@ class Locpot(VolumetricData):
         Returns:
             Average Hatree potential along axis
         """
-        m = self.data[Spin.up]
-
-        ng = self.dim
-        avg = np.zeros((ng[ind], 1))
-        for i in xrange(ng[ind]):
-            mysum = 0
-            for j in xrange(ng[(ind + 1) % 3]):
-                for k in xrange(ng[(ind + 2) % 3]):
-                    if ind == 0:
-                        mysum += m[i, j, k]
-                    if ind == 1:
-                        mysum += m[k, i, j]
-                    if ind == 2:
-                        mysum += m[j, k, i]
-
-            avg[i] = mysum / (ng[(ind + 1) % 3] * 1.0) / (ng[(ind + 2) % 3] * 1.0)
-        return avg
+        avg = self.get_average_along_axis(ind, Spin.up)
+        return avg.reshape((self.dim[ind], 1))
 
 class Chgcar(VolumetricData):
     """
     Simple object for reading a CHGCAR file.
     """
-    def __init__(self, filename):
+    def __init__(self, filename=None):
         """
         Args:
             filename:
-                Name of file containing CHGCAR.
+                Name of file containing CHGCAR. Defaults to None, which
+                creates an empty object.
         """
         super(Chgcar, self).__init__(filename)
         # Chgcar format is total density in first set, and moment density in
         # second set. Need to split them into up and down.
-        updowndata = dict()
-        updowndata[Spin.up] = 0.5 * (self.data[Spin.up] + self.data[Spin.down])
-        updowndata[Spin.down] = 0.5 * (self.data[Spin.up] - self.data[Spin.down])
-        self.data = updowndata
-        self._distance_matrix = dict()
-
-    def _calculate_distance_matrix(self, ind):
-        structure = self.poscar.struct
-        a = self.dim
-        distances = dict()
-        for (x, y, z) in itertools.product(xrange(a[0]), xrange(a[1]), xrange(a[2])):
-            pt = np.array([x / a[0], y / a[1] , z / a[2]])
-            distances[(x, y, z)] = structure[ind].distance_and_image_from_frac_coords(pt)[0]
-        self._distance_matrix[ind] = distances
+        if self.spinpolarized:
+            updowndata = dict()
+            updowndata[Spin.up] = 0.5 * (self.data[Spin.up] + self.data[Spin.down])
+            updowndata[Spin.down] = 0.5 * (self.data[Spin.up] - self.data[Spin.down])
+            self.data = updowndata
+
+    def _get_file_data(self):
+        if not self.spinpolarized:
+            return [self.data[Spin.up]]
+        return [self.data[Spin.up] + self.data[Spin.down],
+                self.data[Spin.up] - self.data[Spin.down]]
 
     def get_diff_int_charge(self, ind, radius):
         """
@@ -2185,15 +4109,103 @@ class Chgcar(VolumetricData):
         Returns:
             Differential integrated charge.
         """
-        if ind not in self._distance_matrix:
-            self._calculate_distance_matrix(ind)
-        a = self.dim
-        intchg = 0
-        for (x, y, z) in itertools.product(xrange(a[0]), xrange(a[1]), xrange(a[2])):
-            if self._distance_matrix[ind][(x, y, z)] < radius:
-                intchg += self.data[Spin.up][x, y, z] - self.data[Spin.down][x, y, z]
+        # A sphere larger than the cell overlaps its own images.
+        sphere = np.unique(self._get_sphere_points(ind, radius)[0])
+        intchg = np.ravel(self.data[Spin.up], order="F")[sphere].sum() \
+            - np.ravel(self.data[Spin.down], order="F")[sphere].sum()
         return intchg / self.ngridpts
 
+    def get_diff_int_charges(self, radius, indices=None):
+        """
+        Get differential integrated charges of several atoms in one call.
+        
+        Args:
+            radius:
+                Radius of integration.
+            indices:
+                Indices of atoms to integrate. Defaults to None, which means
+                all atoms in the structure.
+            
+        Returns:
+            numpy array of differential integrated charges, in the same order
+            as indices.
+        """
+        if indices is None:
+            indices = xrange(len(self.poscar.struct))
+        diff = np.ravel(self.data[Spin.up] - self.data[Spin.down], order="F")
+        return np.array([diff[np.unique(self._get_sphere_points(i, radius)[0])].sum()
+                         for i in indices]) / self.ngridpts
+
+    def get_bader_partition(self):
+        """
+        Partitions the grid into Bader-like atomic basins using the on-grid
+        steepest ascent method (Henkelman et al., Comput. Mater. Sci. 36, 354
+        (2006)). Each grid point is moved to the neighbour among its 26
+        nearest grid points with the largest positive density gradient until
+        a local maximum is reached, and every maximum is then assigned to the
+        nearest atom. All grid points are processed in one batch.
+        
+        Returns:
+            Integer numpy array of shape dim, containing the index of the
+            atom each grid point is assigned to.
+        """
+        structure = self.poscar.struct
+        matrix = structure.lattice.matrix
+        dim = np.array(self.dim)
+        rho = self.data[Spin.up] + self.data[Spin.down] \
+            if self.spinpolarized else self.data[Spin.up]
+        offsets = np.array(list(itertools.product((-1, 0, 1), repeat=3)))
+        best_grad = np.zeros(self.dim)
+        best_offset = np.zeros(self.dim, dtype=int) + 13
+        for (n, offset) in enumerate(offsets):
+            if not offset.any():
+                continue
+            dist = np.linalg.norm(np.dot(offset / dim, matrix))
+            neighbour = rho
+            for i in xrange(3):
+                if offset[i]:
+                    neighbour = np.roll(neighbour, -offset[i], axis=i)
+            grad = (neighbour - rho) / dist
+            steeper = grad > best_grad
+            best_grad[steeper] = grad[steeper]
+            best_offset[steeper] = n
+        del best_grad
+        # Parent of each grid point along the steepest ascent path.
+        step = offsets[np.ravel(best_offset, order="F")]
+        (x, y, z) = np.unravel_index(np.arange(self.ngridpts), self.dim,
+                                     order="F")
+        parent = (x + step[:, 0]) % dim[0] + dim[0] * (
+            (y + step[:, 1]) % dim[1] + dim[1] * ((z + step[:, 2]) % dim[2]))
+        # Follow all paths to their maxima at once by pointer jumping.
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        maxima = np.unique(parent)
+        max_fcoords = np.array(np.unravel_index(maxima, self.dim,
+                                                order="F")).T / dim
+        fdist = max_fcoords[:, None, :] - np.array(structure.frac_coords)
+        fdist -= np.round(fdist)
+        nearest = np.argmin((np.dot(fdist, matrix) ** 2).sum(axis=-1), axis=1)
+        partition = nearest[np.searchsorted(maxima, parent)]
+        return partition.reshape(self.dim, order="F")
+
+    def get_bader_charges(self):
+        """
+        Get the total charge within the Bader-like basin of every atom. See
+        get_bader_partition.
+        
+        Returns:
+            numpy array of integrated charges, one per atom.
+        """
+        rho = self.data[Spin.up] + self.data[Spin.down] \
+            if self.spinpolarized else self.data[Spin.up]
+        partition = self.get_bader_partition()
+        return np.bincount(np.ravel(partition, order="F"),
+                           weights=np.ravel(rho, order="F"),
+                           minlength=len(self.poscar.struct)) / self.ngridpts
+
     def get_diff_int_charge_slow(self, ind, radius):
         """
         Deprecated. **Much** slower algorithm for finding differential
@@ -2230,48 +4242,212 @@ class Chgcar(VolumetricData):
 
 class Procar(object):
     """
-    Object for reading a PROCAR file
+    Object for reading a PROCAR file. The projections of every band at every
+    k-point onto the orbitals of every ion are read into a single numpy
+    array. Each block of ion rows is converted in bulk, and only one k-point
+    is held as text at a time.
+
+    Attributes:
+        name:
+            The first line of the PROCAR.
+        orbitals:
+            Names of the orbitals projected onto, e.g., ["s", "py", "pz",
+            "px", "dxy", "dyz", "dz2", "dxz", "dx2"].
+        kpoints:
+            numpy array of the fractional coordinates of the k-points, of
+            shape (nkpt, 3).
+        weights:
+            numpy array of the weights of the k-points.
+        eigenvalues:
+            numpy array of the band energies, of shape (nspin, nkpt, nband).
+        occupations:
+            numpy array of the band occupations, of shape (nspin, nkpt,
+            nband).
+        projections:
+            numpy array of the projections, of shape (nspin, nkpt, nband,
+            nion, norb). The totals over the orbitals are not stored.
     """
-    def __init__(self, filename):
+    #Columns of the lm-decomposed orbitals of each angular momentum.
+    _lm_columns = {"s": [0], "p": [1, 2, 3], "d": range(4, 9),
+                   "f": range(9, 16)}
+
+    def __init__(self, filename, use_index=False, dtype=np.float64,
+                 mmap_filename=None):
         """
         Args:
             filename:
                 Name of file containing PROCAR.
+            use_index:
+                Set to True to index the offsets of the k-point headers in a
+                file next to the PROCAR (see
+                pymatgen.util.io_utils.SectionIndex). Once the index exists,
+                the number of spins is known up front, and the projections
+                are written straight into their final array instead of being
+                joined at the end, which halves the peak memory use.
+                Defaults to False.
+            dtype:
+                numpy dtype of the projections, e.g., np.float32 to halve
+                the memory needed. Defaults to np.float64.
+            mmap_filename:
+                Filename of a file in which to store the projections, which
+                are then a read-only memory-mapped array. Defaults to None,
+                i.e., the projections are held in memory.
         """
-        #create and return data object containing the information of a PROCAR type file
         self.name = ""
-        self.data = dict()
-        self._read_file(filename)
+        self._read_file(filename, use_index, np.dtype(dtype), mmap_filename)
 
-    def get_d_occupation(self, atomNo):
-        row = self.data[atomNo]
-        return sum(row[4:9])
-
-    def _read_file(self, filename):
-        reader = file_open_zip_aware(filename, "r")
-        lines = clean_lines(reader.readlines())
-        reader.close()
-        self.name = lines[0]
-        kpointexpr = re.compile("^\s*k-point\s+(\d+).*weight = ([0-9\.]+)")
-        expr = re.compile('^\s*([0-9]+)\s+')
-        dataexpr = re.compile('[\.0-9]+')
-        currentKpoint = 0
-        weight = 0
-        for l in lines:
-            if kpointexpr.match(l):
-                m = kpointexpr.match(l)
-                currentKpoint = int(m.group(1))
-                weight = float(m.group(2))
-                if currentKpoint == 1:
-                    self.data = dict()
-            if expr.match(l):
-                linedata = dataexpr.findall(l)
-                linefloatdata = map(float, linedata)
-                index = int(linefloatdata.pop(0))
-                if index in self.data:
-                    self.data[index] = self.data[index] + np.array(linefloatdata) * weight
+    def _read_file(self, filename, use_index, dtype, mmap_filename):
+        with file_open_zip_aware(filename, "r") as f:
+            self.name = f.readline().strip()
+            header = f.readline()
+            m = re.search("# of k-points:\s*(\d+)\s+# of bands:\s*(\d+)\s+"
+                          "# of ions:\s*(\d+)", header)
+            (nkpt, nband, nion) = [int(i) for i in m.groups()]
+            nspin = None
+            if use_index:
+                index = SectionIndex(filename, ["# of k-points:"],
+                                     persist=True)
+                nspin = len(index.offsets["# of k-points:"])
+            mmap_file = open(mmap_filename, "wb") if mmap_filename else None
+            projections = None
+            blocks = []
+            kpoints = []
+            weights = []
+            bands = []
+            count = 0
+            for (kpoint, orbitals, rows, band_data) in \
+                    Procar._iter_kpoints(f, nion):
+                if count < nkpt:
+                    (coords, weight) = kpoint.split(":")[1].split("weight")
+                    kpoints.append(re.findall("-?\d+\.\d+", coords))
+                    weights.append(weight.split("=")[1])
+                self.orbitals = orbitals
+                data = np.fromstring("".join(rows), sep=" ")
+                #Drop the ion numbers and the totals over the orbitals.
+                data = data.reshape((nband, nion, -1))[:, :, 1:-1]
+                if mmap_file is not None:
+                    mmap_file.write(data.astype(dtype).tostring())
+                elif nspin is not None:
+                    if projections is None:
+                        projections = np.empty((nspin, nkpt) + data.shape,
+                                               dtype=dtype)
+                    projections[count // nkpt, count % nkpt] = data
                 else:
-                    self.data[index] = np.array(linefloatdata) * weight
+                    blocks.append(data.astype(dtype))
+                bands.append(band_data)
+                count += 1
+        nspin = count // nkpt
+        shape = (nspin, nkpt, nband, nion, len(self.orbitals))
+        if mmap_file is not None:
+            mmap_file.close()
+            self.projections = np.memmap(mmap_filename, dtype=dtype,
+                                         mode="r", shape=shape)
+        elif projections is not None:
+            self.projections = projections
+        else:
+            self.projections = np.array(blocks, dtype=dtype).reshape(shape)
+        self.kpoints = np.array(kpoints, dtype=float)
+        self.weights = np.array(weights, dtype=float)
+        bands = np.array(bands, dtype=float).reshape((nspin, nkpt, nband, 2))
+        self.eigenvalues = bands[..., 0]
+        self.occupations = bands[..., 1]
+
+    @staticmethod
+    def _iter_kpoints(f, nion):
+        """
+        Generator over the k-points of an open PROCAR, positioned after the
+        header. Yields (k-point line, orbital names, ion rows of all bands,
+        [[energy, occupation] of each band]). Only the first block of ion
+        rows of each band is read, e.g., the totals of non-collinear runs.
+        """
+        kpoint = None
+        orbitals = None
+        rows = []
+        bands = []
+        remaining = 0
+        for line in f:
+            if remaining > 0:
+                rows.append(line)
+                remaining -= 1
+            elif line.startswith(" k-point"):
+                if kpoint is not None:
+                    yield (kpoint, orbitals, rows, bands)
+                kpoint = line
+                rows = []
+                bands = []
+            elif line.startswith("band"):
+                toks = line.split()
+                bands.append([toks[4], toks[7]])
+                remaining = -1
+            elif line.startswith("ion") and remaining < 0:
+                orbitals = line.split()[1:-1]
+                remaining = nion
+        if kpoint is not None:
+            yield (kpoint, orbitals, rows, bands)
+
+    def _get_orbital_indices(self, orbitals):
+        """
+        Returns the indices of orbitals, given as a name or a sequence of
+        names. An angular momentum which is not an orbital, e.g., "d",
+        selects its lm-decomposed orbitals by position, since the names of
+        the last d orbital ("dx2" or "x2-y2") depend on the VASP version.
+        Any other name selects all orbitals starting with it.
+        """
+        if isinstance(orbitals, basestring):
+            orbitals = [orbitals]
+        indices = []
+        for orbital in orbitals:
+            if orbital in self.orbitals:
+                indices.append(self.orbitals.index(orbital))
+            elif orbital in Procar._lm_columns:
+                indices.extend([i for i in Procar._lm_columns[orbital]
+                                if i < len(self.orbitals)])
+            else:
+                indices.extend([i for (i, o) in enumerate(self.orbitals)
+                                if o.startswith(orbital)])
+        return indices
+
+    def get_fatband_weights(self, ions=None, orbitals=None):
+        """
+        Get the projections of each band onto a set of ions and orbitals,
+        e.g., as the weights of a fat band plot.
+
+        Args:
+            ions:
+                Sequence of indices of the ions (starting from 0). Defaults
+                to None, which means all ions.
+            orbitals:
+                Orbital name or sequence of orbital names. A name such as
+                "d" selects all orbitals starting with it. Defaults to None,
+                which means all orbitals.
+
+        Returns:
+            numpy array of the summed projections, of shape (nspin, nkpt,
+            nband).
+        """
+        projections = self.projections
+        if ions is not None:
+            projections = projections[:, :, :, list(ions)]
+        if orbitals is not None:
+            projections = projections[..., self._get_orbital_indices(orbitals)]
+        return projections.sum(axis=(3, 4))
+
+    @property
+    def data(self):
+        """
+        Projections of the last spin summed over the bands and the k-points
+        weighted by their weights, as a dict of {ion number (starting from
+        1): numpy array of the projection onto each orbital followed by
+        their total}.
+        """
+        summed = np.tensordot(self.weights, self.projections[-1].sum(axis=1),
+                              axes=1)
+        return {i + 1: np.append(row, row.sum())
+                for (i, row) in enumerate(summed)}
+
+    def get_d_occupation(self, atomNo):
+        weights = self.get_fatband_weights([atomNo - 1], "d")[-1]
+        return np.dot(self.weights, weights.sum(axis=1))
 
 class Oszicar(object):
     """
@@ -2295,41 +4471,140 @@ class Oszicar(object):
             [{'dE': -526.36, 'E0': -526.36024, 'mag': 0.0, 'F': -526.36024},
             ...]
             This is the typical output from VASP at the end of each ionic step.
+        last_modified:
+            Modification time of the file when it was last read.
 
     Please refer to the vasp manual for the definition for each of the terms.
-            
+
+    The OSZICAR of a running calculation can be followed with update, which
+    only parses the lines written since the last read (see also
+    update_oszicars for following many files). The convergence can be
+    monitored with electronic_step_counts, ionic_dE and electronic_dE.
+
     In addition, two convenience properties, all_energies and final_energy are
     provided for quick access to the commonly used energetic output from a run.
     Please refer to the doc for those two methods for details.    
     """
 
+    _ionic_pattern = re.compile("(\d+)\s+F=\s*([\d\-\.E\+]+)\s+E0=\s*"
+                                "([\d\-\.E\+]+)\s+d\s*E\s*=\s*([\d\-\.E\+]+)"
+                                "(?:\s+mag=\s*([\d\-\.E\+]+))?")
+    _electronic_pattern = re.compile("\s*\w+\s*:(.*)")
+    _header_pattern = re.compile("^\s*N\s+E\s*")
+    #Number of bytes before the read offset kept to detect rewrites.
+    _fingerprint_size = 4096
+
     def __init__(self, filename):
-        electronic_steps = []
-        ionic_steps = []
-        ionic_pattern = re.compile("(\d+)\s+F=\s*([\d\-\.E\+]+)\s+E0=\s*([\d\-\.E\+]+)\s+d\s*E\s*=\s*([\d\-\.E\+]+)\s+mag=\s*([\d\-\.E\+]+)")
-        electronic_pattern = re.compile("\s*\w+\s*:(.*)")
+        """
+        Args:
+            filename:
+                Filename of OSZICAR.
+        """
+        self.filename = filename
+        self.electronic_steps = []
+        self.ionic_steps = []
+        self.last_modified = None
+        self._reset(None)
+        self.update()
+
+    def _reset(self, inode):
+        self.electronic_steps = []
+        self.ionic_steps = []
+        self._header = []
+        self._offset = 0
+        self._fingerprint = ""
+        self._inode = inode
+
+    def update(self):
+        """
+        Parses the lines written to the OSZICAR since it was last read, e.g.,
+        to follow a running calculation. Only the new bytes are read, and an
+        incomplete last line is left for the next update. If the file has
+        been replaced, truncated or rewritten in place, e.g., by a restarted
+        run, it is parsed again from the start. Rewrites are detected by
+        comparing the last bytes read before against the file.
+
+        Returns:
+            Number of new lines parsed.
+        """
+        stat = os.stat(self.filename)
+        if stat.st_ino != self._inode or stat.st_size < self._offset:
+            self._reset(stat.st_ino)
+        if stat.st_size == self._offset and \
+                stat.st_mtime == self.last_modified:
+            return 0
+        self.last_modified = stat.st_mtime
+        with open(self.filename, "rb") as f:
+            f.seek(self._offset - len(self._fingerprint))
+            data = f.read()
+            if data.startswith(self._fingerprint):
+                data = data[len(self._fingerprint):]
+            else:
+                self._reset(stat.st_ino)
+                f.seek(0)
+                data = f.read()
+        end = data.rfind("\n") + 1
+        self._offset += end
+        self._fingerprint = (self._fingerprint + data[:end])[
+                                            -Oszicar._fingerprint_size:]
+        lines = data[:end].splitlines()
+        self._parse_lines(lines)
+        return len(lines)
+
+    def _parse_lines(self, lines):
         def smart_convert(header, num):
             if header == "N" or header == "ncg":
                 return int(num)
             return float(num)
-        header = []
-        with open(filename, 'r') as fid:
-            for line in fid.readlines():
-                m = electronic_pattern.match(line)
+        header = self._header
+        for line in lines:
+            if "F=" in line:
+                m = self._ionic_pattern.match(line.strip())
                 if m:
-                    toks = re.split("\s+", m.group(1).strip())
-                    data = {header[i]:smart_convert(header[i], toks[i]) for i in xrange(len(toks))}
-                    if toks[0] == '1':
-                        electronic_steps.append([data])
-                    else:
-                        electronic_steps[-1].append(data)
-                elif ionic_pattern.match(line.strip()):
-                    m = ionic_pattern.match(line.strip())
-                    ionic_steps.append({'F':float(m.group(2)), 'E0':float(m.group(3)), 'dE':float(m.group(4)), 'mag':float(m.group(5))})
-                elif re.match("^\s*N\s+E\s*", line):
-                    header = re.split("\s+", line.strip().replace("d eps", "deps"))
-        self.electronic_steps = electronic_steps
-        self.ionic_steps = ionic_steps
+                    step = {'F': float(m.group(2)), 'E0': float(m.group(3)),
+                            'dE': float(m.group(4))}
+                    if m.group(5) is not None:
+                        step['mag'] = float(m.group(5))
+                    self.ionic_steps.append(step)
+                continue
+            m = self._electronic_pattern.match(line)
+            if m:
+                toks = m.group(1).split()
+                data = {h: smart_convert(h, t) for (h, t) in zip(header, toks)}
+                if toks[0] == '1' or not self.electronic_steps:
+                    self.electronic_steps.append([data])
+                else:
+                    self.electronic_steps[-1].append(data)
+            elif self._header_pattern.match(line):
+                header = line.replace("d eps", "deps").split()
+        self._header = header
+
+    @property
+    def electronic_step_counts(self):
+        """
+        numpy array of the number of electronic (SCF) steps in each ionic
+        step, including the one in progress in a running calculation.
+        """
+        return np.array([len(steps) for steps in self.electronic_steps],
+                        dtype=int)
+
+    @property
+    def ionic_dE(self):
+        """
+        numpy array of the change in energy dE of each ionic step.
+        """
+        return np.array([step['dE'] for step in self.ionic_steps])
+
+    @property
+    def electronic_dE(self):
+        """
+        numpy array of the change in energy dE of each electronic step of the
+        last ionic step, e.g., to check whether the SCF cycle of a running
+        calculation is converging.
+        """
+        if not self.electronic_steps:
+            return np.array([])
+        return np.array([step['dE'] for step in self.electronic_steps[-1]])
 
     @property
     def all_energies(self):
@@ -2353,6 +4628,31 @@ class Oszicar(object):
         return self.ionic_steps[-1]['F']
 
 
+def update_oszicars(oszicars):
+    """
+    Updates many followed Oszicars from one process, e.g., to monitor the
+    OSZICARs of running calculations for stalls. Each file is only stat-ed,
+    unless it has changed since it was last read. Files which cannot be read,
+    e.g., because they have been removed, are skipped with a warning.
+
+    Args:
+        oszicars:
+            Sequence of Oszicar objects.
+
+    Returns:
+        List of the Oszicars with new lines.
+    """
+    updated = []
+    for oszicar in oszicars:
+        try:
+            if oszicar.update() > 0:
+                updated.append(oszicar)
+        except (IOError, OSError) as ex:
+            warnings.warn("Unable to update {}: {}".format(oszicar.filename,
+                                                           ex))
+    return updated
+
+
 class VaspParserError(Exception):
     '''
     Exception class for Structure.
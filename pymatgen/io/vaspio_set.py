@@ -21,6 +21,7 @@ import os
 import abc
 import ConfigParser
 import json
+import threading
 
 from pymatgen.io.vaspio import Incar, Poscar, Potcar, Kpoints
 
@@ -129,12 +130,13 @@ class VaspInputSet(AbstractVaspInputSet):
     implementations.
     """
 
+    #The parsed VaspInputSets.cfg, shared by all input sets in a process.
+    _shared_config = None
+    _config_lock = threading.Lock()
+
     def __init__(self, name):
         self.name = name
-        module_dir = os.path.dirname(os.path.abspath(__file__))
-        self._config = ConfigParser.SafeConfigParser()
-        self._config.optionxform = str
-        self._config.readfp(open(os.path.join(module_dir, "VaspInputSets.cfg")))
+        self._config = VaspInputSet._get_config()
         self.potcar_settings = dict(self._config.items(self.name + 'POTCAR'))
         self.kpoints_settings = dict(self._config.items(self.name + 'KPOINTS'))
         self.incar_settings = dict(self._config.items(self.name + 'INCAR'))
@@ -142,6 +144,22 @@ class VaspInputSet(AbstractVaspInputSet):
             if key in self.incar_settings:
                 self.incar_settings[key] = json.loads(self.incar_settings[key])
 
+    @staticmethod
+    def _get_config():
+        """
+        Returns the parsed VaspInputSets.cfg, which is only read once per
+        process.
+        """
+        with VaspInputSet._config_lock:
+            if VaspInputSet._shared_config is None:
+                module_dir = os.path.dirname(os.path.abspath(__file__))
+                config = ConfigParser.SafeConfigParser()
+                config.optionxform = str
+                with open(os.path.join(module_dir, "VaspInputSets.cfg")) as f:
+                    config.readfp(f)
+                VaspInputSet._shared_config = config
+            return VaspInputSet._shared_config
+
     def get_incar(self, structure):
         incar = Incar()
         symamt = structure.composition.to_dict
@@ -16,10 +16,19 @@ __date__ = "Mar 9, 2012"
 import os
 import re
 import glob
+import json
+import struct
 import numpy as np
 
-from pymatgen.core.operations import SymmOp
-from pymatgen.core.structure import PeriodicSite
+from pymatgen.core.operations import SymmOpSet
+
+"""
+Location of the packed space group database and the text data it is built
+from.
+"""
+SG_DATABASE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spacegroups.dat")
+SG_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sg_data")
+
 
 class Spacegroup(object):
     """
@@ -27,9 +36,24 @@ class Spacegroup(object):
     """
 
     def __init__(self, int_symbol, int_number, symmops):
+        """
+        Args:
+            int_symbol:
+                International symbol
+            int_number:
+                International number
+            symmops:
+                Symmetry operations, either as a list of SymmOps or as a
+                SymmOpSet.
+        """
         self._symbol = int_symbol
         self._number = int_number
-        self._symmops = symmops
+        if isinstance(symmops, SymmOpSet):
+            self._symmops = None
+            self._symmop_set = symmops
+        else:
+            self._symmops = symmops
+            self._symmop_set = None
 
     @property
     def international_symbol(self):
@@ -39,6 +63,25 @@ class Spacegroup(object):
     def international_number(self):
         return self._number
 
+    @property
+    def symmops(self):
+        """
+        The symmetry operations as a list of SymmOps.
+        """
+        if self._symmops is None:
+            self._symmops = self._symmop_set.symmops
+        return self._symmops
+
+    @property
+    def symmop_set(self):
+        """
+        The symmetry operations as a SymmOpSet, i.e., stacked arrays of
+        rotations and translations.
+        """
+        if self._symmop_set is None:
+            self._symmop_set = SymmOpSet.from_symmops(self._symmops)
+        return self._symmop_set
+
     def are_symmetrically_equivalent(self, sites1, sites2, symprec=1e-8):
         """
         Given two sets of PeriodicSites, test if they are actually symmetrically
@@ -62,53 +105,179 @@ class Spacegroup(object):
             Boolean indicating whether the two sets of sites are symmetrically
             equivalent.
         """
-        def in_sites(site):
-            for test_site in sites1:
-                if test_site.is_periodic_image(site, symprec):
-                    return True
+        sites = list(sites1) + list(sites2)
+        #Sites on different lattices are never periodic images.
+        if any([site.lattice != sites[0].lattice for site in sites[1:]]):
             return False
-        for op in self._symmops:
-            newsites2 = [PeriodicSite(site.species_and_occu, op.operate(site.frac_coords), site.lattice) for site in sites2]
-            ismapping = True
-            for site in newsites2:
-                if not in_sites(site):
-                    ismapping = False
-                    break
-            if ismapping:
-                return True
-        return False
+        fcoords1 = [site.frac_coords for site in sites1]
+        fcoords2 = [site.frac_coords for site in sites2]
+        return self.symmop_set.are_symmetrically_equivalent(fcoords1, fcoords2, symprec)
 
     @staticmethod
     def from_spacegroup_number(sgnum):
-        datadir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sg_data')
-        filename = str(sgnum).zfill(3) + "*"
-        files = sorted(glob.glob(os.path.join(datadir, filename)))
-        with open(files[0], "r") as fid:
-            symmops = []
-            rots = []
-            lines = fid.readlines()
-            sgname = lines[0].strip()
-            for i in xrange(1, len(lines)):
-                toks = re.split(",", lines[i].strip())
-                if len(toks) == 3:
-                    rot = np.zeros((3, 3))
-                    trans = [0, 0, 0]
-                    for j in xrange(3):
-                        tok = toks[j]
-                        m = re.search("([\+\-]*)([xyz])", tok)
-                        if m:
-                            factor = -1 if m.group(1) == "-" else 1
-                            loc = ord(m.group(2)) - 120
-                            rot[j, loc] = factor
-                            tok = re.sub("([\+\-]*)([xyz])", "", tok)
-                            if tok.strip() != '':
-                                trans[j] = eval(tok)
-                        rots.append(rot)
-                    symmops.append(SymmOp.from_rotation_matrix_and_translation_vector(rot, trans))
-            return Spacegroup(sgname, sgnum, symmops)
+        """
+        Returns the Spacegroup with a particular international number, using
+        the default setting, from the packed space group database.
+        """
+        db = get_spacegroup_database()
+        return Spacegroup(db.get_symbol(sgnum), sgnum, db.get_symmop_set(sgnum))
 
     def __str__(self):
         return "{} ({}) spacegroup".format(self._symbol, self._number)
 
+
+class SpacegroupDatabase(object):
+    """
+    Database of the symmetry operations of the 230 space groups (default
+    settings), packed into a single binary file. The file consists of a
+    magic string, a JSON header with the symbols and the offset of each space
+    group's operations, followed by all rotations as an (n, 3, 3) int8 array
+    and all translations as an (n, 3) float64 array. The arrays are memory
+    mapped, so looking up a space group only touches its own operations.
+    
+    Use get_spacegroup_database() to get a shared instance.
+    """
+
+    MAGIC = "PMGSG001"
+
+    def __init__(self, filename=SG_DATABASE_FILE):
+        """
+        Args:
+            filename:
+                Database file. Defaults to the database shipped with pymatgen.
+        """
+        with open(filename, "rb") as f:
+            if f.read(len(SpacegroupDatabase.MAGIC)) != SpacegroupDatabase.MAGIC:
+                raise ValueError("{} is not a space group database.".format(filename))
+            (header_len,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_len))
+        self._symbols = header["symbols"]
+        self._offsets = header["offsets"]
+        nops = self._offsets[-1]
+        self._rotations = np.memmap(filename, dtype=np.int8, mode="r", offset=header["rotations_offset"], shape=(nops, 3, 3))
+        self._translations = np.memmap(filename, dtype="<f8", mode="r", offset=header["translations_offset"], shape=(nops, 3))
+
+    def get_symbol(self, sgnum):
+        """
+        Returns the international symbol of a space group.
+        """
+        return self._symbols[sgnum - 1]
+
+    def get_operations(self, sgnum):
+        """
+        Returns the symmetry operations of a space group as a tuple of
+        (rotations, translations) read-only arrays.
+        """
+        if not 1 <= sgnum <= len(self._symbols):
+            raise ValueError("Invalid space group number {}".format(sgnum))
+        (start, end) = self._offsets[sgnum - 1:sgnum + 1]
+        return (self._rotations[start:end], self._translations[start:end])
+
+    def get_symmop_set(self, sgnum):
+        """
+        Returns the symmetry operations of a space group as a SymmOpSet.
+        """
+        return SymmOpSet(*self.get_operations(sgnum))
+
+    @staticmethod
+    def write_database(filename=SG_DATABASE_FILE, datadir=SG_DATA_DIR):
+        """
+        Builds the database from the text files in the sg_data directory. For
+        each space group number, the first file (i.e., the default setting)
+        is used.
+        
+        Args:
+            filename:
+                Database file to write.
+            datadir:
+                Directory containing the space group text files.
+        """
+        symbols = []
+        offsets = [0]
+        all_rots = []
+        all_trans = []
+        for sgnum in xrange(1, 231):
+            files = sorted(glob.glob(os.path.join(datadir, str(sgnum).zfill(3) + "*")))
+            (symbol, rots, trans) = parse_sg_data_file(files[0])
+            symbols.append(symbol)
+            all_rots.extend(rots)
+            all_trans.extend(trans)
+            offsets.append(len(all_rots))
+        rotations = np.array(all_rots, dtype=np.int8)
+        translations = np.array(all_trans, dtype="<f8")
+
+        def align(n):
+            return (n + 7) // 8 * 8
+
+        #Header length is fixed first so that the array offsets can be stored
+        #in the header itself.
+        header = {"symbols": symbols, "offsets": offsets, "rotations_offset": 0, "translations_offset": 0}
+        prefix_len = len(SpacegroupDatabase.MAGIC) + 4 + len(json.dumps(header)) + 40
+        header["rotations_offset"] = align(prefix_len)
+        header["translations_offset"] = align(header["rotations_offset"] + rotations.nbytes)
+        header_str = json.dumps(header).ljust(prefix_len - len(SpacegroupDatabase.MAGIC) - 4)
+        with open(filename, "wb") as f:
+            f.write(SpacegroupDatabase.MAGIC)
+            f.write(struct.pack("<I", len(header_str)))
+            f.write(header_str)
+            f.write("\0" * (header["rotations_offset"] - f.tell()))
+            f.write(rotations.tostring())
+            f.write("\0" * (header["translations_offset"] - f.tell()))
+            f.write(translations.tostring())
+
+
+_sg_database = None
+
+
+def get_spacegroup_database():
+    """
+    Returns the shared SpacegroupDatabase, loading it on first use.
+    """
+    global _sg_database
+    if _sg_database is None:
+        _sg_database = SpacegroupDatabase()
+    return _sg_database
+
+
+def parse_symmop_string(xyz_string):
+    """
+    Parses a symmetry operation in the "x, y, z" notation, e.g.,
+    "1.0/2.0-x, -x+y, z".
+    
+    Returns:
+        (rotation, translation) as numpy arrays.
+    """
+    rot = np.zeros((3, 3))
+    trans = np.zeros(3)
+    for j, tok in enumerate(xyz_string.split(",")):
+        tok = tok.replace(" ", "").strip()
+        for m in re.finditer("([\+\-]?)([xyz])", tok):
+            rot[j, ord(m.group(2)) - 120] = -1 if m.group(1) == "-" else 1
+        tok = re.sub("[\+\-]?[xyz]", "", tok)
+        if tok:
+            (num, denom) = tok.split("/") if "/" in tok else (tok, 1)
+            trans[j] = float(num) / float(denom)
+    return (rot, trans)
+
+
+def parse_sg_data_file(filename):
+    """
+    Parses a space group text file in the sg_data directory.
+    
+    Returns:
+        (symbol, rotations, translations)
+    """
+    with open(filename, "r") as f:
+        lines = f.readlines()
+    rots = []
+    trans = []
+    for line in lines[1:]:
+        if len(line.split(",")) == 3:
+            (rot, t) = parse_symmop_string(line)
+            rots.append(rot)
+            trans.append(t)
+    return (lines[0].strip(), rots, trans)
+
+
 if __name__ == "__main__":
     print Spacegroup.from_spacegroup_number(230)
@@ -20,9 +20,16 @@ __email__ = "shyue@mit.edu"
 __date__ = "Mar 9, 2012"
 
 import re
+import os
+import copy
+import hashlib
+import json
+import tempfile
+import itertools
+from collections import OrderedDict
+from multiprocessing import Pool
 
 import numpy as np
-import itertools
 
 from pymatgen.core.structure import Structure
 from pymatgen.symmetry.spacegroup import Spacegroup
@@ -38,7 +45,8 @@ class SymmetryFinder(object):
     Uses pyspglib to perform various symmetry finding operations.
     """
 
-    def __init__(self, structure, symprec=1e-5, angle_tolerance=5):
+    def __init__(self, structure, symprec=1e-5, angle_tolerance=5,
+                 cache=None):
         """
         Args:
             structure:
@@ -47,27 +55,33 @@ class SymmetryFinder(object):
                 Tolerance for symmetry finding
             angle_tolerance:
                 Angle tolerance for symmetry finding.
+            cache:
+                SymmetryDatasetCache used to store spglib results. Defaults to
+                None, which means the module level symmetry_cache is used.
+                Set to False to disable caching.
         """
         self._symprec = symprec
         self._angle_tol = angle_tolerance
         self._structure = structure
-        self._lattice = structure.lattice.matrix
-        self._positions = np.array([site.frac_coords for site in structure])
-        unique_species = []
-        zs = []
+        (self._lattice, self._positions, self._numbers, self._unique_species) = get_spglib_cell(structure)
+        self._cache = _resolve_cache(cache)
+        if self._cache is not None:
+            self._cache_key = get_cell_hash(self._lattice, self._positions, self._numbers, symprec, angle_tolerance)
 
-        for species, g in itertools.groupby(structure, key=lambda site: site.species_and_occu):
-            try:
-                ind = unique_species.index(species)
-                zs.extend([ind + 1] * len(tuple(g)))
-            except ValueError:
-                unique_species.append(species)
-                zs.extend([len(unique_species)] * len(tuple(g)))
+        self._spacegroup_data = self._cached("spacegroup", lambda: spg.spacegroup(self._lattice.transpose().copy(), self._positions.copy(), self._numbers, self._symprec, self._angle_tol))
 
-        self._unique_species = unique_species
-        self._numbers = np.array(zs)
-
-        self._spacegroup_data = spg.spacegroup(self._lattice.transpose().copy(), self._positions.copy(), self._numbers, self._symprec, self._angle_tol)
+    def _cached(self, name, func):
+        """
+        Returns the named spglib result for this structure from the cache,
+        calling func and caching its result if it is not present.
+        """
+        if self._cache is None:
+            return func()
+        val = self._cache.get(self._cache_key, name)
+        if val is None:
+            val = func()
+            self._cache.set(self._cache_key, name, val)
+        return copy.deepcopy(val)
 
     def get_spacegroup(self):
         """
@@ -137,30 +151,7 @@ class SymmetryFinder(object):
             wyckoffs:
                   Wyckoff letters
         """
-        keys = ('number',
-                'international',
-                'hall',
-                'transformation_matrix',
-                'origin_shift',
-                'rotations',
-                'translations',
-                'wyckoffs',
-                'equivalent_atoms')
-        dataset = {}
-        for key, data in zip(keys, spg.dataset(self._lattice.transpose().copy(), self._positions, self._numbers, self._symprec, self._angle_tol)):
-            dataset[key] = data
-
-        dataset['international'] = dataset['international'].strip()
-        dataset['hall'] = dataset['hall'].strip()
-        dataset['transformation_matrix'] = np.array(dataset['transformation_matrix'])
-        dataset['origin_shift'] = np.array(dataset['origin_shift'])
-        dataset['rotations'] = np.array(dataset['rotations'])
-        dataset['translations'] = np.array(dataset['translations'])
-        letters = "abcdefghijklmnopqrstuvwxyz"
-        dataset['wyckoffs'] = [letters[x] for x in dataset['wyckoffs']]
-        dataset['equivalent_atoms'] = np.array(dataset['equivalent_atoms'])
-
-        return dataset
+        return self._cached("dataset", lambda: _get_dataset(self._lattice, self._positions, self._numbers, self._symprec, self._angle_tol))
 
     def get_symmetry(self):
         """
@@ -171,15 +162,18 @@ class SymmetryFinder(object):
         of the translation vectors in scaled positions
         """
 
-        # Get number of symmetry operations and allocate symmetry operations
-        # multi = spg.multiplicity(cell, positions, numbers, symprec)
-        multi = 48 * self._structure.num_sites
-        rotation = np.zeros((multi, 3, 3), dtype=int)
-        translation = np.zeros((multi, 3))
+        def get_symm():
+            # Get number of symmetry operations and allocate symmetry operations
+            # multi = spg.multiplicity(cell, positions, numbers, symprec)
+            multi = 48 * self._structure.num_sites
+            rotation = np.zeros((multi, 3, 3), dtype=int)
+            translation = np.zeros((multi, 3))
+
+            num_sym = spg.symmetry(rotation, translation, self._lattice.transpose().copy(),
+                                       self._positions, self._numbers, self._symprec, self._angle_tol)
+            return (rotation[:num_sym], translation[:num_sym])
 
-        num_sym = spg.symmetry(rotation, translation, self._lattice.transpose().copy(),
-                                   self._positions, self._numbers, self._symprec, self._angle_tol)
-        return (rotation[:num_sym], translation[:num_sym])
+        return self._cached("symmetry", get_symm)
 
     def get_symmetry_operations(self, cartesian=False):
         """
@@ -246,6 +240,260 @@ class SymmetryFinder(object):
             #Not sure if we should return None or just return the full structure.
             return None
 
+class SymmetryDatasetCache(object):
+    """
+    A cache of spglib results keyed by a hash of the cell (see get_cell_hash).
+    Entries are held in memory with least recently used eviction, and can
+    optionally be persisted as one json file per cell in a directory so
+    that results are shared across sessions and processes. Nothing is
+    pickled, so that loading the on-disk store never executes code.
+    """
+
+    def __init__(self, maxsize=1000, cache_dir=None):
+        """
+        Args:
+            maxsize:
+                Maximum number of cells held in memory.
+            cache_dir:
+                Directory for the on-disk store. Defaults to None, i.e., no
+                on-disk store.
+        """
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._entries = OrderedDict()
+
+    def _get_entry(self, key):
+        if key in self._entries:
+            entry = self._entries.pop(key)
+        elif self.cache_dir is not None and os.path.exists(self._path(key)):
+            with open(self._path(key)) as f:
+                entry = json.load(f, object_hook=_decode_arrays)
+        else:
+            return None
+        self._put_entry(key, entry)
+        return entry
+
+    def _put_entry(self, key, entry):
+        self._entries[key] = entry
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def get(self, key, name):
+        """
+        Returns the cached result with a particular name (e.g., "dataset") for
+        a cell hash, or None if it is not cached.
+        """
+        entry = self._get_entry(key)
+        return entry.get(name) if entry is not None else None
+
+    def set(self, key, name, value):
+        """
+        Caches a named result for a cell hash.
+        """
+        entry = self._get_entry(key) or {}
+        entry[name] = value
+        self._put_entry(key, entry)
+        if self.cache_dir is not None:
+            #Write to a temp file and rename so that concurrent readers never
+            #see a partially written file.
+            (fd, tmp) = tempfile.mkstemp(dir=self.cache_dir)
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f, default=_encode_array)
+            os.rename(tmp, self._path(key))
+
+    def clear(self):
+        """
+        Clears the in-memory cache. The on-disk store is left untouched.
+        """
+        self._entries.clear()
+
+    def __contains__(self, key):
+        return key in self._entries or (self.cache_dir is not None and os.path.exists(self._path(key)))
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _encode_array(obj):
+    """
+    Encodes the numpy arrays in spglib results for json, keeping the dtype.
+    """
+    if isinstance(obj, np.ndarray):
+        return {"@ndarray": obj.tolist(), "dtype": obj.dtype.str}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    raise TypeError("{} is not JSON serializable".format(repr(obj)))
+
+
+def _decode_arrays(d):
+    """
+    Restores the numpy arrays encoded by _encode_array.
+    """
+    if "@ndarray" in d:
+        return np.array(d["@ndarray"], dtype=d["dtype"])
+    return d
+
+
+"""
+Default cache used by all SymmetryFinders.
+"""
+symmetry_cache = SymmetryDatasetCache()
+
+
+def _resolve_cache(cache):
+    """
+    Interprets the cache argument of SymmetryFinder and get_symmetry_datasets.
+    """
+    if cache is None:
+        return symmetry_cache
+    return None if cache is False else cache
+
+
+def get_spglib_cell(structure):
+    """
+    Converts a structure into the cell representation used by spglib.
+    
+    Args:
+        structure:
+            Structure object
+            
+    Returns:
+        (lattice, frac_coords, numbers, unique_species), where numbers are the
+        integer species types passed to spglib and unique_species[i - 1] is
+        the species_and_occu of type i.
+    """
+    lattice = structure.lattice.matrix
+    positions = np.array([site.frac_coords for site in structure])
+    unique_species = []
+    zs = []
+
+    for species, g in itertools.groupby(structure, key=lambda site: site.species_and_occu):
+        try:
+            ind = unique_species.index(species)
+            zs.extend([ind + 1] * len(tuple(g)))
+        except ValueError:
+            unique_species.append(species)
+            zs.extend([len(unique_species)] * len(tuple(g)))
+
+    return (lattice, positions, np.array(zs), unique_species)
+
+
+def get_cell_hash(lattice, positions, numbers, symprec, angle_tolerance=5):
+    """
+    Canonical hash of a spglib cell and tolerances. The lattice and
+    fractional coordinates are rounded to 8 decimal places and the fractional
+    coordinates are brought into the unit cell, so that floating point noise
+    and lattice translations do not lead to different keys. Site order is
+    preserved since spglib results (e.g., equivalent_atoms) depend on it.
+    """
+    lattice = np.round(np.array(lattice, dtype=float), 8) + 0.0
+    positions = np.mod(np.array(positions, dtype=float), 1)
+    positions = np.mod(np.round(positions, 8), 1) + 0.0
+    h = hashlib.sha1()
+    h.update(lattice.tostring())
+    h.update(positions.tostring())
+    h.update(np.array(numbers, dtype=np.int64).tostring())
+    h.update(repr((float(symprec), float(angle_tolerance))))
+    return h.hexdigest()
+
+
+def _get_dataset(lattice, positions, numbers, symprec, angle_tolerance):
+    """
+    Calls spglib to get the symmetry dataset of a cell. See
+    SymmetryFinder.get_symmetry_dataset for a description of the dataset.
+    """
+    keys = ('number',
+            'international',
+            'hall',
+            'transformation_matrix',
+            'origin_shift',
+            'rotations',
+            'translations',
+            'wyckoffs',
+            'equivalent_atoms')
+    dataset = {}
+    for key, data in zip(keys, spg.dataset(lattice.transpose().copy(), positions, numbers, symprec, angle_tolerance)):
+        dataset[key] = data
+
+    dataset['international'] = dataset['international'].strip()
+    dataset['hall'] = dataset['hall'].strip()
+    dataset['transformation_matrix'] = np.array(dataset['transformation_matrix'])
+    dataset['origin_shift'] = np.array(dataset['origin_shift'])
+    dataset['rotations'] = np.array(dataset['rotations'])
+    dataset['translations'] = np.array(dataset['translations'])
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    dataset['wyckoffs'] = [letters[x] for x in dataset['wyckoffs']]
+    dataset['equivalent_atoms'] = np.array(dataset['equivalent_atoms'])
+
+    return dataset
+
+
+def _get_dataset_star(args):
+    return _get_dataset(*args)
+
+
+def get_symmetry_datasets(structures, symprec=1e-5, angle_tolerance=5,
+                          nprocs=1, cache=None):
+    """
+    Gets the symmetry datasets for a list of structures, distributing the
+    spglib calls over several processes. Results are read from and stored in
+    the cache, so that subsequent SymmetryFinders on the same structures do
+    not call spglib again.
+    
+    Args:
+        structures:
+            List of Structure objects.
+        symprec:
+            Tolerance for symmetry finding
+        angle_tolerance:
+            Angle tolerance for symmetry finding.
+        nprocs:
+            Number of processes to use. Defaults to 1.
+        cache:
+            SymmetryDatasetCache to use. Defaults to None, which means the
+            module level symmetry_cache is used. Set to False to disable
+            caching.
+            
+    Returns:
+        List of symmetry datasets (see
+        SymmetryFinder.get_symmetry_dataset), in the same order as structures.
+    """
+    cache = _resolve_cache(cache)
+    datasets = [None] * len(structures)
+    todo = OrderedDict()
+    for i, s in enumerate(structures):
+        (lattice, positions, numbers, unique_species) = get_spglib_cell(s)
+        key = get_cell_hash(lattice, positions, numbers, symprec, angle_tolerance)
+        ds = cache.get(key, "dataset") if cache is not None else None
+        if ds is not None:
+            datasets[i] = copy.deepcopy(ds)
+        elif key in todo:
+            todo[key][1].append(i)
+        else:
+            todo[key] = ((lattice, positions, numbers, symprec, angle_tolerance), [i])
+
+    args = [v[0] for v in todo.values()]
+    if nprocs > 1 and len(args) > 1:
+        p = Pool(nprocs)
+        results = p.map(_get_dataset_star, args)
+        p.close()
+        p.join()
+    else:
+        results = map(_get_dataset_star, args)
+
+    for (key, (cell, inds)), ds in zip(todo.items(), results):
+        if cache is not None:
+            cache.set(key, "dataset", ds)
+        for i in inds:
+            datasets[i] = copy.deepcopy(ds)
+    return datasets
+
+
 def get_pointgroup(rotations):
     """    
     Return point group in international table symbol and number.
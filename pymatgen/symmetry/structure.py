@@ -15,6 +15,8 @@ __date__ = "Mar 9, 2012"
 
 import itertools
 
+import numpy as np
+
 from pymatgen.core.structure import Structure
 
 class SymmetrizedStructure(Structure):
@@ -32,11 +34,171 @@ class SymmetrizedStructure(Structure):
         site_map = zip(self._sites, equivalent_positions)
         site_map = sorted(site_map, key=lambda x: x[1])
         self._equivalent_sites = [[x[0] for x in g] for k, g in itertools.groupby(site_map, key=lambda x: x[1])]
+        inds = sorted(range(len(equivalent_positions)), key=lambda i: equivalent_positions[i])
+        self._equivalent_indices = [np.array(list(g)) for k, g in itertools.groupby(inds, key=lambda i: equivalent_positions[i])]
+        self._site_permutations = {}
+
+    @property
+    def spacegroup(self):
+        return self._spacegroup
 
     @property
     def equivalent_sites(self):
         return self._equivalent_sites
 
+    @property
+    def equivalent_indices(self):
+        """
+        Indices of the sites in each orbit, as a list of numpy arrays in the
+        same order as equivalent_sites.
+        """
+        return self._equivalent_indices
+
+    def get_site_permutations(self, tol=0.01):
+        """
+        Returns the permutations of the sites induced by the symmetry
+        operations of the spacegroup. Operations that do not map every site
+        onto a site with the same species and occupancy (e.g., because the
+        structure only has the symmetry within a looser tolerance) are left
+        out.
+        
+        Args:
+            tol:
+                Tolerance in fractional coordinates for two sites to be
+                considered the same.
+        
+        Returns:
+            A (n_ops, num_sites) integer numpy array, where element [k, i] is
+            the index of the site that site i is mapped onto by operation k.
+        """
+        if tol not in self._site_permutations:
+            perms = self._spacegroup.symmop_set.get_site_permutations(self.frac_coords, tol)
+            species = [site.species_and_occu for site in self._sites]
+            valid = [all([j >= 0 and species[j] == species[i] for i, j in enumerate(perm)]) for perm in perms]
+            self._site_permutations[tol] = perms[np.array(valid, dtype=bool)]
+        return self._site_permutations[tol]
+
+    def get_distinct_subsets(self, indices, num, tol=0.01):
+        """
+        Enumerates the symmetrically distinct subsets of a set of sites, e.g.,
+        all inequivalent ways of choosing num sites out of an orbit. Subsets
+        are generated by canonical augmentation, i.e., subsets of size n are
+        obtained by extending the distinct subsets of size n - 1 and a subset
+        is kept only if it is the lexicographically smallest member of its
+        orbit under the site permutation group. Only one representative of
+        each orbit is ever generated, so the cost scales with the number of
+        distinct subsets rather than the number of combinations.
+        
+        Args:
+            indices:
+                Indices of the sites to choose from. Should be a union of
+                orbits (e.g., all sites of a species); symmetry operations
+                that do not map these sites onto each other are ignored.
+            num:
+                Number of sites to choose.
+            tol:
+                Tolerance in fractional coordinates for two sites to be
+                considered the same.
+        
+        Returns:
+            List of tuples of site indices, one per distinct subset.
+        """
+        indices = sorted(indices)
+        perms = self._get_local_permutations([indices], tol)
+        subsets = [()]
+        for n in xrange(num):
+            subsets = [subset + (i,) for subset in subsets for i in xrange(subset[-1] + 1 if subset else 0, len(indices)) if _is_canonical(perms, subset + (i,))]
+        return [tuple([indices[i] for i in subset]) for subset in subsets]
+
+    def get_distinct_combinations(self, indices_list, nums, tol=0.01):
+        """
+        Enumerates the symmetrically distinct ways of choosing nums[i] sites
+        from each indices_list[i] simultaneously. With a single set of
+        indices, this is the same as get_distinct_subsets. Otherwise, all
+        combinations are enumerated and reduced to one representative per
+        orbit using a canonical form, which is much cheaper than pairwise
+        equivalence checks.
+        
+        Args:
+            indices_list:
+                List of lists of site indices.
+            nums:
+                Number of sites to choose from each list.
+            tol:
+                Tolerance in fractional coordinates for two sites to be
+                considered the same.
+        
+        Returns:
+            List of tuples of tuples of site indices, e.g.,
+            [((0, 1), (4, 6)), ...], one per distinct combination.
+        """
+        indices_list = [sorted(indices) for indices in indices_list]
+        if len(indices_list) == 1:
+            return [(subset,) for subset in self.get_distinct_subsets(indices_list[0], nums[0], tol)]
+        perms = self._get_local_permutations(indices_list, tol)
+        offsets = np.cumsum([0] + [len(indices) for indices in indices_list])
+        seen = set()
+        distinct = []
+        allcombis = [itertools.combinations(xrange(len(indices)), n) for indices, n in zip(indices_list, nums)]
+        for combi in itertools.product(*allcombis):
+            local = np.concatenate([np.array(c, dtype=int) + offsets[i] for i, c in enumerate(combi)])
+            groups = np.sort(perms[:, local].reshape((len(perms), -1)), axis=1)
+            canonical = min([tuple(row) for row in groups])
+            if canonical not in seen:
+                seen.add(canonical)
+                distinct.append(tuple([tuple([indices_list[i][j] for j in c]) for i, c in enumerate(combi)]))
+        return distinct
+
+    def get_equivalent_combinations(self, indices_list, combination, tol=0.01):
+        """
+        Returns all combinations symmetrically equivalent to a combination of
+        sites chosen from each of indices_list, i.e., its orbit. Within a
+        loose tolerance, equivalent combinations need not have exactly the
+        same properties (e.g., Ewald energy), so the orbit is needed to pick
+        the best member.
+        
+        Args:
+            indices_list:
+                List of lists of site indices.
+            combination:
+                Tuple of tuples of site indices chosen from each list, as
+                returned by get_distinct_combinations.
+            tol:
+                Tolerance in fractional coordinates for two sites to be
+                considered the same.
+        
+        Returns:
+            Sorted list of tuples of tuples of site indices, including
+            combination itself.
+        """
+        perms = self.get_site_permutations(tol)
+        all_inds = [i for indices in indices_list for i in indices]
+        group = np.zeros(self.num_sites, dtype=int) - 1
+        for g, indices in enumerate(indices_list):
+            group[list(indices)] = g
+        valid = (group[perms[:, all_inds]] == group[all_inds]).all(axis=1)
+        images = set([tuple(combination)])
+        for perm in perms[valid]:
+            images.add(tuple([tuple(sorted(perm[list(c)])) for c in combination]))
+        return sorted(images)
+
+    def _get_local_permutations(self, indices_list, tol):
+        """
+        Restricts the site permutations to the concatenation of indices_list,
+        keeping only the operations that map each list onto itself. Returns
+        an array of permutations of positions in the concatenated list.
+        """
+        perms = self.get_site_permutations(tol)
+        all_inds = [i for indices in indices_list for i in indices]
+        position = -np.ones(self.num_sites, dtype=int)
+        position[all_inds] = np.arange(len(all_inds))
+        group = np.zeros(self.num_sites, dtype=int) - 1
+        for g, indices in enumerate(indices_list):
+            group[indices] = g
+        local = position[perms[:, all_inds]]
+        valid = (group[perms[:, all_inds]] == group[all_inds]).all(axis=1)
+        return local[valid]
+
     def find_equivalent_sites(self, site):
         """
         Finds all symmetrically equivalent sites for a particular site
@@ -53,3 +215,17 @@ class SymmetrizedStructure(Structure):
                 return sites
 
         raise ValueError("Site not in structure")
+
+
+def _is_canonical(perms, subset):
+    """
+    Checks if a sorted tuple of positions is the lexicographically smallest
+    member of its orbit under a set of permutations.
+    """
+    subset = np.array(subset)
+    images = np.sort(perms[:, subset], axis=1)
+    diff = images - subset
+    nonzero = diff != 0
+    first = np.argmax(nonzero, axis=1)
+    smaller = nonzero.any(axis=1) & (diff[np.arange(len(diff)), first] < 0)
+    return not smaller.any()
@@ -15,13 +15,24 @@ __date__ = "Mar 12, 2012"
 
 import unittest
 import os
+import glob
 
-from pymatgen.symmetry.spacegroup import Spacegroup
+import numpy as np
+
+from pymatgen.symmetry.spacegroup import Spacegroup, get_spacegroup_database, \
+    parse_sg_data_file, parse_symmop_string, SG_DATA_DIR
 from pymatgen.io.vaspio import Poscar
-from pymatgen.symmetry.spglib_adaptor import SymmetryFinder
+from pymatgen.core.lattice import Lattice
+from pymatgen.core.structure import PeriodicSite
 
 import pymatgen
 
+try:
+    from pymatgen.symmetry.spglib_adaptor import SymmetryFinder
+    spglib_loaded = True
+except ImportError:
+    spglib_loaded = False
+
 test_dir = os.path.join(os.path.dirname(os.path.abspath(pymatgen.__file__)), '..', 'test_files')
 
 
@@ -30,19 +41,62 @@ class SpacegroupTest(unittest.TestCase):
     def setUp(self):
         p = Poscar.from_file(os.path.join(test_dir, 'POSCAR'))
         self.structure = p.struct
-        self.sg1 = SymmetryFinder(self.structure, 0.001).get_spacegroup()
         self.sg2 = Spacegroup.from_spacegroup_number(62)
+        #The spacegroup found by spglib is only tested if it is present.
+        self.sgs = [self.sg2]
+        if spglib_loaded:
+            self.sgs.append(SymmetryFinder(self.structure, 0.001).get_spacegroup())
 
     def test_are_symmetrically_equivalent(self):
-        sites1 = [self.structure[i] for i in [0, 1]]
-        sites2 = [self.structure[i] for i in [2, 3]]
-        self.assertTrue(self.sg1.are_symmetrically_equivalent(sites1, sites2, 1e-3))
-        self.assertTrue(self.sg2.are_symmetrically_equivalent(sites1, sites2, 1e-3))
-
-        sites1 = [self.structure[i] for i in [0, 1]]
-        sites2 = [self.structure[i] for i in [0, 2]]
-        self.assertFalse(self.sg1.are_symmetrically_equivalent(sites1, sites2, 1e-3))
-        self.assertFalse(self.sg2.are_symmetrically_equivalent(sites1, sites2, 1e-3))
+        for sg in self.sgs:
+            sites1 = [self.structure[i] for i in [0, 1]]
+            sites2 = [self.structure[i] for i in [2, 3]]
+            self.assertTrue(sg.are_symmetrically_equivalent(sites1, sites2, 1e-3))
+
+            sites1 = [self.structure[i] for i in [0, 1]]
+            sites2 = [self.structure[i] for i in [0, 2]]
+            self.assertFalse(sg.are_symmetrically_equivalent(sites1, sites2, 1e-3))
+
+            #Sites on a different lattice are never equivalent.
+            site = self.structure[2]
+            lattice = Lattice(site.lattice.matrix * 1.1)
+            sites2 = [PeriodicSite(site.species_and_occu, site.frac_coords, lattice),
+                      self.structure[3]]
+            self.assertFalse(sg.are_symmetrically_equivalent(sites1, sites2, 1e-3))
+
+    def test_symmop_set(self):
+        opset = self.sg2.symmop_set
+        self.assertEqual(len(opset), 8)
+        self.assertEqual(opset.rotations.shape, (8, 3, 3))
+        perms = opset.get_site_permutations(self.structure.frac_coords, 1e-3)
+        for perm in perms:
+            self.assertEqual(sorted(perm), range(self.structure.num_sites))
+
+class SpacegroupDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = get_spacegroup_database()
+
+    def test_get_operations(self):
+        for sgnum in [1, 62, 167, 191, 225, 230]:
+            files = sorted(glob.glob(os.path.join(SG_DATA_DIR, str(sgnum).zfill(3) + "*")))
+            (symbol, rots, trans) = parse_sg_data_file(files[0])
+            self.assertEqual(self.db.get_symbol(sgnum), symbol)
+            (dbrots, dbtrans) = self.db.get_operations(sgnum)
+            self.assertTrue(np.allclose(dbrots, rots))
+            self.assertTrue(np.allclose(dbtrans, trans))
+        self.assertEqual(len(self.db.get_symmop_set(225)), 48)
+        self.assertRaises(ValueError, self.db.get_operations, 231)
+
+    def test_parse_symmop_string(self):
+        (rot, trans) = parse_symmop_string("1.0/2.0-x,  -x+y, 5/6+z")
+        self.assertTrue(np.allclose(rot, [[-1, 0, 0], [-1, 1, 0], [0, 0, 1]]))
+        self.assertTrue(np.allclose(trans, [0.5, 0, 5 / 6]))
+
+    def test_from_spacegroup_number(self):
+        sg = Spacegroup.from_spacegroup_number(191)
+        self.assertEqual(sg.international_symbol, "P6/mmm")
+        self.assertEqual(len(sg.symmops), 24)
 
 
 if __name__ == "__main__":
@@ -15,12 +15,16 @@ __date__ = "Mar 9, 2012"
 
 import unittest
 import os
+import shutil
+import json
+import tempfile
 
 import numpy as np
 
 from pymatgen.core.structure import PeriodicSite
 from pymatgen.io.vaspio import Poscar
-from pymatgen.symmetry.spglib_adaptor import SymmetryFinder, get_pointgroup
+from pymatgen.symmetry.spglib_adaptor import SymmetryFinder, get_pointgroup, \
+    SymmetryDatasetCache, get_symmetry_datasets, get_spglib_cell, get_cell_hash
 from pymatgen.io.cifio import CifParser
 from pymatgen.core.structure_modifier import StructureEditor
 
@@ -132,6 +136,59 @@ class HelperFunctionsTest(unittest.TestCase):
         pg = get_pointgroup(rots)
         self.assertEqual(pg[0].strip(), "mmm")
 
+class SymmetryDatasetCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        p = Poscar.from_file(os.path.join(test_dir, 'POSCAR'))
+        self.structure = p.struct
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_get_cell_hash(self):
+        (latt, pos, numbers, species) = get_spglib_cell(self.structure)
+        key = get_cell_hash(latt, pos, numbers, 0.1)
+        self.assertEqual(key, get_cell_hash(latt, pos + 1, numbers, 0.1))
+        self.assertEqual(key, get_cell_hash(latt + 1e-12, pos, numbers, 0.1))
+        self.assertNotEqual(key, get_cell_hash(latt, pos, numbers, 0.01))
+        self.assertNotEqual(key, get_cell_hash(latt, pos + 0.1, numbers, 0.1))
+
+    def test_cache(self):
+        cache = SymmetryDatasetCache(maxsize=1, cache_dir=self.cache_dir)
+        finder = SymmetryFinder(self.structure, 0.1, cache=cache)
+        ds = finder.get_symmetry_dataset()
+        self.assertEqual(len(cache), 1)
+        finder = SymmetryFinder(self.structure, 0.1, cache=cache)
+        self.assertEqual(finder.get_symmetry_dataset()['hall'], ds['hall'])
+        self.assertEqual(finder.get_spacegroup_symbol(), "Pnma")
+        #Evicted from memory, but still in the on-disk store.
+        SymmetryFinder(self.structure, 0.01, cache=cache)
+        self.assertEqual(len(cache), 1)
+        cache.clear()
+        cache = SymmetryDatasetCache(cache_dir=self.cache_dir)
+        (latt, pos, numbers, species) = get_spglib_cell(self.structure)
+        key = get_cell_hash(latt, pos, numbers, 0.1)
+        self.assertIn(key, cache)
+        self.assertEqual(cache.get(key, "dataset")['number'], 62)
+        with open(os.path.join(self.cache_dir, key + ".json")) as f:
+            self.assertIn("dataset", json.load(f))
+        rotations = cache.get(key, "dataset")['rotations']
+        self.assertEqual(rotations.dtype, ds['rotations'].dtype)
+        self.assertTrue(np.array_equal(rotations, ds['rotations']))
+        self.assertTrue(np.allclose(cache.get(key, "dataset")['translations'],
+                                    ds['translations']))
+
+    def test_get_symmetry_datasets(self):
+        parser = CifParser(os.path.join(test_dir, 'Li2O.cif'))
+        li2o = parser.get_structures(False)[0]
+        cache = SymmetryDatasetCache()
+        datasets = get_symmetry_datasets([self.structure, li2o, self.structure], 0.1, nprocs=2, cache=cache)
+        self.assertEqual([ds['number'] for ds in datasets], [62, 225, 62])
+        self.assertEqual(len(cache), 2)
+        datasets = get_symmetry_datasets([li2o], 0.1, cache=False)
+        self.assertEqual(datasets[0]['international'], 'Fm-3m')
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+'''
+Tests for pymatgen.symmetry.structure.
+'''
+
+from __future__ import division
+
+import unittest
+import os
+import itertools
+
+from pymatgen.io.vaspio import Poscar
+from pymatgen.symmetry.spglib_adaptor import SymmetryFinder
+from pymatgen.symmetry.structure import SymmetrizedStructure
+
+import pymatgen
+
+test_dir = os.path.join(os.path.dirname(os.path.abspath(pymatgen.__file__)), '..', 'test_files')
+
+
+class SymmetrizedStructureTest(unittest.TestCase):
+
+    def setUp(self):
+        p = Poscar.from_file(os.path.join(test_dir, 'POSCAR'))
+        self.structure = p.struct
+        finder = SymmetryFinder(self.structure, 0.1)
+        self.symm_structure = SymmetrizedStructure(self.structure, finder.get_spacegroup(), finder.get_symmetry_dataset()['equivalent_atoms'])
+
+    def test_equivalent_indices(self):
+        inds = self.symm_structure.equivalent_indices
+        self.assertEqual(len(inds), 5)
+        self.assertEqual(list(inds[0]), [0, 1, 2, 3])
+        for sites, site_inds in zip(self.symm_structure.equivalent_sites, inds):
+            self.assertEqual(sites, [self.symm_structure[i] for i in site_inds])
+
+    def test_get_site_permutations(self):
+        perms = self.symm_structure.get_site_permutations()
+        self.assertEqual(len(perms), 8)
+        for perm in perms:
+            self.assertEqual(sorted(perm), range(self.structure.num_sites))
+
+    def test_get_distinct_subsets(self):
+        self.assertEqual(self.symm_structure.get_distinct_subsets(range(4), 2), [(0, 1), (0, 2), (0, 3)])
+        self.assertEqual(len(self.symm_structure.get_distinct_subsets(range(4), 4)), 1)
+        #Compare against brute force reduction of all combinations.
+        inds = range(8, 24)
+        perms = self.symm_structure.get_site_permutations()
+        orbits = set([min([tuple(sorted(perm[list(c)])) for perm in perms]) for c in itertools.combinations(inds, 5)])
+        self.assertEqual(len(self.symm_structure.get_distinct_subsets(inds, 5)), len(orbits))
+
+    def test_get_distinct_combinations(self):
+        combis = self.symm_structure.get_distinct_combinations([range(4), range(4, 8)], [1, 1])
+        self.assertEqual(combis, [((0,), (4,)), ((0,), (5,)), ((0,), (6,)), ((0,), (7,))])
+        combis = self.symm_structure.get_distinct_combinations([range(4)], [2])
+        self.assertEqual(combis, [((0, 1),), ((0, 2),), ((0, 3),)])
+
+    def test_get_equivalent_combinations(self):
+        #The orbits of the distinct combinations partition all combinations.
+        combis = self.symm_structure.get_distinct_combinations([range(4)], [2])
+        images = [self.symm_structure.get_equivalent_combinations([range(4)], c) for c in combis]
+        self.assertEqual(images[0], [((0, 1),), ((2, 3),)])
+        self.assertEqual(sorted([c for orbit in images for c in orbit]),
+                         [(c,) for c in itertools.combinations(range(4), 2)])
+
+
+if __name__ == "__main__":
+    #import sys;sys.argv = ['', 'Test.testName']
+    unittest.main()
@@ -239,49 +239,41 @@ class PartialRemoveSitesTransformation(AbstractTransformation):
         self.logger.debug('Performing complete ordering...')
         all_structures = []
         from pymatgen.symmetry.spglib_adaptor import SymmetryFinder
+        from pymatgen.symmetry.structure import SymmetrizedStructure
         symprec = 0.1
         s = SymmetryFinder(structure, symprec=symprec)
         self.logger.debug('Symmetry of structure is determined to be {}.'.format(s.get_spacegroup_symbol()))
-        sg = s.get_spacegroup()
-        tested_sites = []
+        symm_structure = SymmetrizedStructure(structure, s.get_spacegroup(), s.get_symmetry_dataset()['equivalent_atoms'])
         starttime = time.time()
         self.logger.debug('Performing initial ewald sum...')
         ewaldsum = EwaldSummation(structure)
         self.logger.debug('Ewald sum took {} seconds.'.format(time.time() - starttime))
         starttime = time.time()
 
-        allcombis = []
-        for ind, num in num_remove_dict.items():
-            allcombis.append(itertools.combinations(ind, num))
-
-        count = 0
-        for allindices in itertools.product(*allcombis):
-            sites_to_remove = []
-            indices_list = []
-            for indices in allindices:
-                sites_to_remove.extend([structure[i] for i in indices])
-                indices_list.extend(indices)
+        #Only symmetrically distinct removals are generated.
+        indices_list = num_remove_dict.keys()
+        nums = [num_remove_dict[indices] for indices in indices_list]
+        distinct = symm_structure.get_distinct_combinations(indices_list, nums)
+        self.logger.debug('{} symmetrically distinct structures found.'.format(len(distinct)))
+
+        for count, allindices in enumerate(distinct):
+            #Symmetry is only approximate within symprec, so the removal with
+            #the lowest energy in each orbit is kept.
+            best = None
+            for combination in symm_structure.get_equivalent_combinations(indices_list, allindices):
+                to_delete = [i for indices in combination for i in indices]
+                energy = ewaldsum.compute_partial_energy(to_delete)
+                if best is None or energy < best[0]:
+                    best = (energy, to_delete)
 
             mod = StructureEditor(structure)
-            mod.delete_sites(indices_list)
-            s_new = mod.modified_structure
-            energy = ewaldsum.compute_partial_energy(indices_list)
-            already_tested = False
-            for i, tsites in enumerate(tested_sites):
-                tenergy = all_structures[i]['energy']
-                if abs((energy - tenergy) / len(s_new)) < 1e-5 and sg.are_symmetrically_equivalent(sites_to_remove, tsites, symprec=symprec):
-                    already_tested = True
-
-            if not already_tested:
-                tested_sites.append(sites_to_remove)
-                all_structures.append({'structure':s_new, 'energy':energy})
-
-            count += 1
-            if count % 10 == 0:
+            mod.delete_sites(best[1])
+            all_structures.append({'structure':mod.modified_structure, 'energy':best[0]})
+
+            if (count + 1) % 10 == 0:
                 timenow = time.time()
-                self.logger.debug('{} structures, {:.2f} seconds.'.format(count, timenow - starttime))
-                self.logger.debug('Average time per combi = {} seconds'.format((timenow - starttime) / count))
-                self.logger.debug('{} symmetrically distinct structures found.'.format(len(all_structures)))
+                self.logger.debug('{} structures, {:.2f} seconds.'.format(count + 1, timenow - starttime))
+                self.logger.debug('Average time per combi = {} seconds'.format((timenow - starttime) / (count + 1)))
 
         all_structures = sorted(all_structures, key=lambda s: s['energy'])
         return all_structures
@@ -15,6 +15,7 @@ __date__ = "Sep 23, 2011"
 import os
 import unittest
 import random
+import itertools
 
 from pymatgen.transformations.standard_transformations import *
 from pymatgen.io.vaspio import Poscar
@@ -160,7 +161,20 @@ class PartialRemoveSpecieTransformationTest(unittest.TestCase):
         t1 = OxidationStateDecorationTransformation({"Li":1, "Fe":2, "P":5, "O":-2})
         s = t1.apply_transformation(p.struct)
         t = PartialRemoveSpecieTransformation("Li+", 0.5, PartialRemoveSpecieTransformation.ALGO_COMPLETE)
-        self.assertEqual(len(t.apply_transformation(s, 10)), 6)
+        ranked = t.apply_transformation(s, 10)
+        #The best ordering is the brute force minimum, even though the
+        #structure is only symmetric within a loose tolerance.
+        ewaldsum = EwaldSummation(s)
+        li_indices = [i for i, site in enumerate(s) if site.specie.symbol == "Li"]
+        energies = []
+        for c in itertools.combinations(li_indices, 2):
+            mod = StructureEditor(s)
+            mod.delete_sites(list(c))
+            energies.append((ewaldsum.compute_partial_energy(list(c)), EwaldSummation(mod.modified_structure).total_energy))
+        self.assertAlmostEqual(ranked[0]['energy'], min(energies)[0], 5)
+        self.assertAlmostEqual(EwaldSummation(ranked[0]['structure']).total_energy, min(energies)[1], 5)
+        #Only the 3 symmetrically distinct orderings of the 4a Li sites remain.
+        self.assertEqual(len(ranked), 3)
 
     def test_apply_transformations_best_first(self):
 
@@ -12,9 +12,18 @@ __email__ = "shyue@mit.edu"
 __status__ = "Production"
 __date__ = "$Sep 23, 2011M$"
 
+import os
 import gzip
 import bz2
+import cStringIO
 import re
+import hashlib
+import json
+import shutil
+import struct
+import tempfile
+import warnings
+import zipfile
 import numpy
 
 
@@ -148,3 +157,359 @@ def clean_json(input_json, strict=False):
                 return 'None'
             else:
                 return clean_json(input_json.to_dict)
+
+
+def get_file_sha1(filename, chunk_size=1048576):
+    """
+    Returns the sha1 hex digest of the contents of a file, which is read in
+    chunks.
+
+    Args:
+        filename:
+            Filename.
+        chunk_size:
+            Size of the chunks in bytes.
+    """
+    h = hashlib.sha1()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), ""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def load_npz_mmap(filename):
+    """
+    Loads the arrays in an uncompressed .npz archive, as written by
+    numpy.savez, as read-only memory maps into the archive. Unlike
+    numpy.load, which reads every member that is accessed into memory, the
+    data is only paged in from disk when it is used. Members which cannot be
+    memory-mapped, i.e., compressed members and object arrays, are read
+    normally.
+
+    Args:
+        filename:
+            Filename of the .npz archive.
+
+    Returns:
+        Dict of {name: array}.
+    """
+    arrays = {}
+    fallback = []
+    with zipfile.ZipFile(filename) as z:
+        infos = z.infolist()
+    with open(filename, "rb") as f:
+        for info in infos:
+            name = info.filename[:-4] if info.filename.endswith(".npy") \
+                else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                fallback.append(name)
+                continue
+            #The local file header is 30 bytes, followed by the file name
+            #and the extra field, whose lengths are in the last 4 bytes.
+            f.seek(info.header_offset)
+            header = f.read(30)
+            (name_length, extra_length) = struct.unpack("<HH", header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = numpy.lib.format.read_magic(f)
+            if version == (1, 0):
+                (shape, fortran_order, dtype) = \
+                    numpy.lib.format.read_array_header_1_0(f)
+            else:
+                (shape, fortran_order, dtype) = \
+                    numpy.lib.format.read_array_header_2_0(f)
+            if dtype.hasobject:
+                fallback.append(name)
+            elif numpy.prod(shape) == 0:
+                arrays[name] = numpy.zeros(shape, dtype=dtype)
+            else:
+                arrays[name] = numpy.memmap(filename, dtype=dtype, mode="r",
+                                            offset=f.tell(), shape=shape,
+                                            order="F" if fortran_order else "C")
+    if fallback:
+        npz = numpy.load(filename)
+        for name in fallback:
+            arrays[name] = npz[name]
+        npz.close()
+    return arrays
+
+
+class NpzRowWriter(object):
+    """
+    Writes an uncompressed .npz archive, in the same format as numpy.savez,
+    whose arrays are built up one row at a time. Rows are spooled to
+    temporary files as they are appended and only copied into the archive on
+    close, so memory use is bounded by a single row regardless of the number
+    of rows. Use as a context manager; the archive is only written if no
+    exception occurred.
+    """
+
+    def __init__(self, filename):
+        """
+        Args:
+            filename:
+                Filename of the .npz archive. As with numpy.savez, the .npz
+                extension is added if missing.
+        """
+        if not filename.endswith(".npz"):
+            filename += ".npz"
+        self.filename = filename
+        self._rows = {}
+        self._arrays = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._cleanup()
+
+    def append(self, name, row):
+        """
+        Appends a row to an array. All rows of an array must have the same
+        shape; the dtype is that of the first row.
+
+        Args:
+            name:
+                Name of the array.
+            row:
+                Row, i.e., anything numpy.asarray accepts.
+        """
+        row = numpy.asarray(row)
+        if name not in self._rows:
+            self._rows[name] = [tempfile.TemporaryFile(), row.dtype,
+                                row.shape, 0]
+        entry = self._rows[name]
+        if row.shape != entry[2]:
+            raise ValueError("Row of shape {} does not match shape {} of "
+                             "array {}.".format(row.shape, entry[2], name))
+        entry[0].write(row.astype(entry[1]).tostring())
+        entry[3] += 1
+
+    def add(self, name, array):
+        """
+        Adds a complete array, e.g., a small one known up front.
+        """
+        self._arrays[name] = numpy.asarray(array)
+
+    def discard(self, name):
+        """
+        Removes an array and its rows from the archive.
+        """
+        if name in self._rows:
+            self._rows.pop(name)[0].close()
+        self._arrays.pop(name, None)
+
+    def close(self):
+        """
+        Writes the archive and removes the temporary files.
+        """
+        try:
+            with zipfile.ZipFile(self.filename, "w", zipfile.ZIP_STORED,
+                                 allowZip64=True) as z:
+                for (name, array) in self._arrays.items():
+                    self._write_member(z, name,
+                                       lambda f: numpy.save(f, array))
+                for (name, (rows, dtype, shape, nrows)) in self._rows.items():
+                    header = cStringIO.StringIO()
+                    numpy.lib.format.write_array_header_1_0(
+                        header, {"descr": numpy.lib.format.dtype_to_descr(dtype),
+                                 "fortran_order": False,
+                                 "shape": (nrows, ) + shape})
+                    header = header.getvalue()
+                    #Older numpy versions leave out the magic string.
+                    if not header.startswith(numpy.lib.format.MAGIC_PREFIX):
+                        header = numpy.lib.format.magic(1, 0) + header
+
+                    def write(f, header=header, rows=rows):
+                        f.write(header)
+                        rows.seek(0)
+                        shutil.copyfileobj(rows, f)
+                    self._write_member(z, name, write)
+        finally:
+            self._cleanup()
+
+    @staticmethod
+    def _write_member(z, name, write):
+        (fd, tmpname) = tempfile.mkstemp(suffix=".npy")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            z.write(tmpname, name + ".npy")
+        finally:
+            os.remove(tmpname)
+
+    def _cleanup(self):
+        for entry in self._rows.values():
+            entry[0].close()
+        self._rows = {}
+        self._arrays = {}
+
+
+class SectionIndex(object):
+    """
+    Index of the byte offsets of the lines holding given marker strings in a
+    text file, e.g., the ionic step boundaries of an OUTCAR, the k-point
+    headers of a PROCAR or the <calculation> elements of a vasprun.xml. The
+    index is built in a single pass over the file, after which parsers can
+    seek straight to the sections they need instead of rescanning the file.
+
+    Offsets refer to the uncompressed data, so compressed files can also be
+    indexed, but seeking in them is emulated by decompressing up to the
+    offset.
+
+    The index can be persisted in a hidden json file next to the indexed file
+    (see SectionIndex.get_index_filename), which is reused for as long as the
+    size and modification time of the file are unchanged. If markers which
+    are not in the persisted index are requested, the file is indexed again
+    for all markers.
+    """
+
+    #Version of the persisted index format.
+    version = 1
+
+    def __init__(self, filename, markers, persist=False):
+        """
+        Args:
+            filename:
+                Filename of the text file to index.
+            markers:
+                Sequence of literal strings marking the lines to index. A
+                line is recorded under every marker it contains.
+            persist:
+                Set to True to load the index from and save it to the index
+                file next to filename. Defaults to False.
+        """
+        self.filename = filename
+        self.markers = tuple(markers)
+        key = [os.path.getsize(filename), os.path.getmtime(filename)]
+        stored = self._load(key) if persist else None
+        if stored is not None and set(self.markers).issubset(stored):
+            offsets = stored
+        else:
+            #Keep the previously persisted markers in the new index.
+            all_markers = set(self.markers).union(stored or [])
+            offsets = self._build(all_markers)
+            if persist:
+                self._save(key, offsets)
+        self.offsets = {m: offsets[m] for m in self.markers}
+
+    @staticmethod
+    def get_index_filename(filename):
+        """
+        Returns the filename of the persisted index of a file.
+        """
+        (dirname, basename) = os.path.split(os.path.abspath(filename))
+        return os.path.join(dirname, "." + basename + ".pmgindex.json")
+
+    def _build(self, markers):
+        """
+        Indexes the file in one pass, returning a dict of {marker: offsets}.
+        """
+        offsets = {m: [] for m in markers}
+        pattern = re.compile("|".join([re.escape(m) for m in markers]))
+        pos = 0
+        with file_open_zip_aware(self.filename, "rb") as f:
+            for line in f:
+                if pattern.search(line):
+                    for m in markers:
+                        if m in line:
+                            offsets[m].append(pos)
+                pos += len(line)
+        return offsets
+
+    def _load(self, key):
+        """
+        Returns the persisted offsets, or None if there is no valid index.
+        """
+        try:
+            with open(SectionIndex.get_index_filename(self.filename)) as f:
+                d = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if d.get("version") != SectionIndex.version or d.get("key") != key:
+            return None
+        return d["offsets"]
+
+    def _save(self, key, offsets):
+        """
+        Persists the index. Fails with a warning if the index cannot be
+        written, e.g., because the directory is not writable.
+        """
+        index_filename = SectionIndex.get_index_filename(self.filename)
+        tmp_filename = None
+        try:
+            (fd, tmp_filename) = tempfile.mkstemp(
+                dir=os.path.dirname(index_filename), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump({"version": SectionIndex.version, "key": key,
+                           "offsets": offsets}, f)
+            os.chmod(tmp_filename, 0644)
+            os.rename(tmp_filename, index_filename)
+        except (IOError, OSError) as ex:
+            warnings.warn("Unable to write index {}: {}".format(
+                                                    index_filename, ex))
+            if tmp_filename is not None and os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    def get_offsets(self, markers=None):
+        """
+        Returns a list of (offset, marker) of the indexed lines holding
+        markers, sorted by offset.
+
+        Args:
+            markers:
+                Sequence of markers. Defaults to None, which means all
+                markers of the index.
+        """
+        if markers is None:
+            markers = self.markers
+        return sorted([(offset, m) for m in markers
+                       for offset in self.offsets[m]])
+
+    def iter_sections(self, f, markers=None):
+        """
+        Generator over the indexed lines of an open file, in file order,
+        seeking directly from one to the next. Yields (marker, line, lines),
+        where lines is an iterator over the lines following the marker line.
+        Indexed lines which have been consumed from a previous lines iterator
+        are skipped, so a line holding several markers is only yielded once.
+
+        Args:
+            f:
+                File object of the indexed file, opened in binary mode.
+            markers:
+                Sequence of markers. Defaults to None, which means all
+                markers of the index.
+        """
+        end = 0
+        for (offset, marker) in self.get_offsets(markers):
+            if offset < end:
+                continue
+            f.seek(offset)
+            lines = _OffsetLineIterator(f, offset)
+            line = next(lines)
+            yield (marker, line, lines)
+            end = lines.offset
+
+
+class _OffsetLineIterator(object):
+    """
+    Iterator over the lines of a file, which keeps track of the offset of
+    the current position.
+    """
+
+    def __init__(self, f, offset):
+        self._f = f
+        self.offset = offset
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        line = self._f.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line
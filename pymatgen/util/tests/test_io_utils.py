@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+'''
+Tests for pymatgen.util.io_utils.
+'''
+
+from __future__ import division
+
+import unittest
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import numpy as np
+
+from pymatgen.util.io_utils import SectionIndex, NpzRowWriter, load_npz_mmap
+
+
+class SectionIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.lines = ["header\n", " k-point 1 : weight = 0.5\n", "a\n",
+                      " k-point 2 : weight = 0.5\n", "b\n", "c\n",
+                      "# of k-points: 2\n", " k-point 1 : weight = 0.5\n"]
+        self.filename = os.path.join(self.tmpdir, "PROCAR")
+        with open(self.filename, "w") as f:
+            f.write("".join(self.lines))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_offsets(self):
+        index = SectionIndex(self.filename, [" k-point ", "# of"])
+        self.assertEqual(index.offsets[" k-point "], [7, 35, 82])
+        self.assertEqual(index.offsets["# of"], [65])
+        self.assertEqual([m for (o, m) in index.get_offsets()],
+                         [" k-point ", " k-point ", "# of", " k-point "])
+        with open(self.filename, "rb") as f:
+            for (offset, marker) in index.get_offsets():
+                f.seek(offset)
+                self.assertIn(marker, f.readline())
+        self.assertFalse(os.path.exists(SectionIndex.get_index_filename(self.filename)))
+
+    def test_iter_sections(self):
+        index = SectionIndex(self.filename, [" k-point "])
+        with open(self.filename, "rb") as f:
+            sections = [(line, next(lines, None))
+                        for (marker, line, lines) in index.iter_sections(f)]
+        self.assertEqual(sections, [(self.lines[1], "a\n"), (self.lines[3], "b\n"),
+                                    (self.lines[7], None)])
+        #Marker lines consumed with a previous section are skipped.
+        with open(self.filename, "rb") as f:
+            sections = [(line, list(lines))
+                        for (marker, line, lines) in index.iter_sections(f)]
+        self.assertEqual(sections, [(self.lines[1], self.lines[2:])])
+
+    def test_persist(self):
+        index_filename = SectionIndex.get_index_filename(self.filename)
+        index = SectionIndex(self.filename, [" k-point "], persist=True)
+        self.assertTrue(os.path.exists(index_filename))
+        #The persisted index is used, as long as the file is unchanged.
+        with open(index_filename) as f:
+            d = json.load(f)
+        d["offsets"][" k-point "][2] = 83
+        with open(index_filename, "w") as f:
+            json.dump(d, f)
+        index = SectionIndex(self.filename, [" k-point "], persist=True)
+        self.assertEqual(index.offsets[" k-point "], [7, 35, 83])
+        #New markers are added to the index.
+        index = SectionIndex(self.filename, ["# of"], persist=True)
+        self.assertEqual(index.offsets["# of"], [65])
+        index = SectionIndex(self.filename, [" k-point "], persist=True)
+        self.assertEqual(index.offsets[" k-point "], [7, 35, 82])
+        #The index is rebuilt if the file changes.
+        with open(self.filename, "a") as f:
+            f.write(" k-point 2 : weight = 0.5\n")
+        index = SectionIndex(self.filename, [" k-point "], persist=True)
+        self.assertEqual(index.offsets[" k-point "], [7, 35, 82, 108])
+
+    def test_compressed(self):
+        filename = self.filename + ".gz"
+        with open(self.filename, "rb") as f_in:
+            f_out = gzip.open(filename, "wb")
+            f_out.write(f_in.read())
+            f_out.close()
+        index = SectionIndex(filename, [" k-point "])
+        self.assertEqual(index.offsets[" k-point "], [7, 35, 82])
+        f = gzip.open(filename, "rb")
+        sections = [line for (marker, line, lines) in index.iter_sections(f)]
+        f.close()
+        self.assertEqual(sections, [self.lines[1], self.lines[3], self.lines[7]])
+
+
+
+class NpzRowWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_write(self):
+        filename = os.path.join(self.tmpdir, "traj")
+        coords = np.random.rand(5, 4, 3)
+        with NpzRowWriter(filename) as writer:
+            for i in xrange(5):
+                writer.append("coords", coords[i])
+                writer.append("steps", i)
+                writer.append("forces", coords[i])
+            writer.discard("forces")
+            writer.add("species", ["Li", "Fe", "P", "O"])
+            self.assertRaises(ValueError, writer.append, "coords", [1, 2])
+        self.assertEqual(writer.filename, filename + ".npz")
+        data = np.load(writer.filename)
+        self.assertEqual(sorted(data.files), ["coords", "species", "steps"])
+        self.assertTrue(np.allclose(data["coords"], coords))
+        self.assertEqual(list(data["steps"]), range(5))
+        self.assertEqual(list(data["species"]), ["Li", "Fe", "P", "O"])
+        data.close()
+        self.assertTrue(np.allclose(load_npz_mmap(writer.filename)["coords"], coords))
+        #Nothing is written if an exception occurs.
+        filename = os.path.join(self.tmpdir, "failed.npz")
+        try:
+            with NpzRowWriter(filename) as writer:
+                writer.append("steps", 0)
+                raise KeyError
+        except KeyError:
+            pass
+        self.assertFalse(os.path.exists(filename))
+
+if __name__ == '__main__':
+    unittest.main()
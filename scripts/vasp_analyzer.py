@@ -25,11 +25,10 @@ def get_energies(rootdir, reanalyze):
     logging.info('Detected {} cpus'.format(ncpus))
     queen = BorgQueen(drone, number_of_drones=ncpus)
     if os.path.exists('vasp_analyzer_data.gz') and not reanalyze:
-        logging.info('Using previously assimilated data file vasp_analyzer_data.gz. Use -f to force re-analysis')
+        logging.info('Using previously assimilated data file vasp_analyzer_data.gz. Only new or changed runs are reanalyzed. Use -f to force re-analysis')
         queen.load_data('vasp_analyzer_data.gz')
-    else:
-        queen.parallel_assimilate(rootdir)
-        queen.save_data('vasp_analyzer_data.gz')
+    queen.incremental_assimilate(rootdir)
+    queen.save_data('vasp_analyzer_data.gz')
     entries = queen.get_assimilated_data()
     entries = sorted(entries, key=lambda x:x.data['filename'])
     all_data = [(e.data['filename'].replace("./", ""), e.composition.formula, "{:.5f}".format(e.energy), "{:.5f}".format(e.energy_per_atom), "{:.2f}".format(e.structure.volume)) for e in entries]
@@ -60,7 +59,7 @@ Last updated: Nov 15 2011''')
 parser.add_argument('directories', metavar='dir', default='.', type=str, nargs='*', help='directory to process (default to .)')
 parser.add_argument('-e', '--energies', dest='get_energies', action='store_const', const=True, help='print energies')
 parser.add_argument('-m', '--mag', dest="ion_list", type=str, nargs=1, help='print magmoms. ION LIST can be a range (e.g., 1-2) or the string "All" for all ions.')
-parser.add_argument('-f', '--force', dest="reanalyze", action='store_const', const=True, help='force reanalysis. Typically, vasp_analyzer will just reuse a vasp_analyzer_data.gz if present. This forces the analyzer to reanalyzer.')
+parser.add_argument('-f', '--force', dest="reanalyze", action='store_const', const=True, help='force reanalysis. Typically, vasp_analyzer will reuse a vasp_analyzer_data.gz if present and only reanalyze new or changed runs. This forces the analyzer to reanalyzer.')
 
 args = parser.parse_args()
 if args.get_energies: